@@ -0,0 +1,74 @@
+"""
+Async read endpoints served under ``/async/``.
+
+They return the same JSON as their DRF counterparts but are plain async
+Django views using the async ORM, so under an ASGI server (uvicorn,
+daphne) a request waiting on the database does not hold a worker thread,
+and slow PDF or report requests cannot starve the fast reads. DRF views
+are synchronous, which is why these are not viewset actions; every write
+still goes through the sync API.
+"""
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import NotFound
+
+from .models import Balance, ExpenseSplit, User
+from .renderers import dumps
+from .views import BALANCE_LIST_FIELDS, USER_EXPENSE_FIELDS, balance_data, user_expense_data, user_expenses_paginator
+
+
+def json_response(data, status=200):
+    # the API's renderer, so decimals and datetimes render as in the sync API
+    return HttpResponse(dumps(data), status=status, content_type='application/json')
+
+
+def user_not_found():
+    return json_response({"error": "User not found"}, status=404)
+
+
+@require_GET
+async def user_expenses(request, user_id):
+    """
+    Async version of ``GET /expenses/user/{user_id}/``.
+    """
+    if not await User.objects.filter(id=user_id).aexists():
+        return user_not_found()
+
+    splits = ExpenseSplit.objects.filter(user_id=user_id).values(*USER_EXPENSE_FIELDS)
+    paginator = user_expenses_paginator()
+    try:
+        page = await paginator.apaginate_queryset(splits, request)
+    except NotFound as exc:
+        return json_response({"detail": str(exc.detail)}, status=404)
+
+    return json_response({
+        'next': paginator.get_next_link(),
+        'results': [user_expense_data(split) for split in page],
+    })
+
+
+@require_GET
+async def user_overall_expenses(request, user_id):
+    """
+    Async version of ``GET /expenses/user/{user_id}/overall/``.
+    """
+    user = await User.objects.filter(id=user_id).values('id', 'username').afirst()
+    if user is None:
+        return user_not_found()
+
+    totals = await ExpenseSplit.objects.filter(user_id=user_id).aaggregate(total=Sum('amount_owed'))
+    return json_response({
+        'user_id': user['id'],
+        'username': user['username'],
+        'total_amount_owed': totals['total'] or 0,
+    })
+
+
+@require_GET
+async def balance_list(request):
+    """
+    Async version of ``GET /balances/``.
+    """
+    balances = Balance.objects.order_by('id').values_list(*BALANCE_LIST_FIELDS)
+    return json_response([balance_data(row) async for row in balances])
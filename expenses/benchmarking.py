@@ -0,0 +1,211 @@
+"""
+Helpers shared by the ``bench_*`` management commands.
+
+Benchmarks run against the configured database inside a transaction that
+is always rolled back, so they can be pointed at a development database
+without leaving any rows behind.
+"""
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .ledger import compute_splits, record_expenses
+from .models import Expense, ExpenseSplit, Group, User, default_group_id
+from .money import allocate, from_cents
+
+SPLIT_MIX = {'equal': 6, 'exact': 3, 'percentage': 1}
+
+
+class Rollback(Exception):
+    pass
+
+
+@contextmanager
+def rolled_back():
+    """
+    Run the block in a transaction and discard everything it wrote.
+    """
+    try:
+        with transaction.atomic():
+            yield
+            raise Rollback
+    except Rollback:
+        pass
+
+
+def api_client(user=None):
+    """
+    In-process API client; ``localhost`` keeps it inside ALLOWED_HOSTS.
+    """
+    client = APIClient(SERVER_NAME='localhost')
+    if user is not None:
+        client.force_authenticate(user=user)
+    return client
+
+
+def timed(func, *args, **kwargs):
+    """
+    Call ``func`` and return ``(result, elapsed_seconds)``.
+    """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def percentile(samples, fraction):
+    """
+    Nearest-rank percentile of a list of samples, ``fraction`` in [0, 1].
+    """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def seed_splits(users, splits, participants, rng, batch_size=5000, prefix='bench'):
+    """
+    Insert ``users`` users and enough equal-split expenses to produce
+    ``splits`` split rows, ``participants`` splits per expense.
+
+    Rows are written straight to the tables with ``bulk_create`` and no
+    balances are maintained, which keeps seeding a million rows fast.
+    Returns the ids of the created users.
+    """
+    user_ids = [
+        user.id for user in User.objects.bulk_create(
+            [User(username=f'{prefix}-{i}', email=f'{prefix}-{i}@example.com', mobile_number=str(i)) for i in range(users)],
+            batch_size=batch_size,
+        )
+    ]
+
+    Participant = Expense.participants.through
+    # resolved once; left unset, the field default looks it up per expense
+    group_id = default_group_id()
+    remaining = splits
+    while remaining > 0:
+        expenses = []
+        members = []
+        while remaining > 0 and len(expenses) * participants < batch_size:
+            group = rng.sample(user_ids, min(participants + 1, len(user_ids)))
+            expenses.append(Expense(
+                creator_id=group[0], paid_by_id=group[0], group_id=group_id, total_amount=Decimal(len(group) * 10),
+                description='seeded expense', split_method='equal',
+            ))
+            members.append(group)
+            remaining -= len(group) - 1
+
+        Expense.objects.bulk_create(expenses)
+        Participant.objects.bulk_create(
+            [Participant(expense_id=expense.id, user_id=user_id) for expense, group in zip(expenses, members) for user_id in group],
+            batch_size=batch_size,
+        )
+        ExpenseSplit.objects.bulk_create(
+            [
+                ExpenseSplit(expense_id=expense.id, user_id=user_id, amount_owed=Decimal(10), created_at=expense.created_at)
+                for expense, group in zip(expenses, members) for user_id in group[1:]
+            ],
+            batch_size=batch_size,
+        )
+    return user_ids
+
+
+def zipf_weights(count, skew):
+    """
+    Weights ``1 / rank ** skew`` for ``count`` items: with ``skew`` 0 every
+    item is equally likely, around 1 a few items take most of the traffic.
+    """
+    return [1 / (rank ** skew) for rank in range(1, count + 1)]
+
+
+def weighted_sample(population, weights, k, rng):
+    """
+    ``k`` distinct items of ``population`` drawn with ``weights``.
+    """
+    chosen = {}
+    k = min(k, len(population))
+    while len(chosen) < k:
+        for item in rng.choices(population, weights, k=k - len(chosen)):
+            chosen.setdefault(item, None)
+    return list(chosen)[:k]
+
+
+def seed_dataset(users, groups, expenses, rng, skew=1.1, group_size=6, days=90, batch_size=500, prefix='seed'):
+    """
+    Create ``users`` users in ``groups`` groups and ``expenses`` expenses
+    spread over the last ``days`` days.
+
+    Group sizes, which groups are active and who pays follow a Zipf
+    distribution with exponent ``skew``. Split methods follow ``SPLIT_MIX``
+    and amounts are log-normal around 20. Expenses go through
+    ``record_expenses``, so balances, debts and the ledger are consistent,
+    and the daily rollups are rebuilt for the backdated expenses at the
+    end. Returns ``(user_ids, group_members)`` with ``group_members`` being
+    ``{group_id: [user_id, ...]}``.
+    """
+    user_ids = [
+        user.id for user in User.objects.bulk_create(
+            [User(username=f'{prefix}-{i}', email=f'{prefix}-{i}@example.com', mobile_number=str(i)) for i in range(users)],
+            batch_size=batch_size,
+        )
+    ]
+    user_weights = zipf_weights(len(user_ids), skew)
+
+    group_members = {}
+    Member = Group.members.through
+    for group in Group.objects.bulk_create([Group(name=f'{prefix} group {i}') for i in range(groups)]):
+        size = max(2, min(len(user_ids), round(rng.paretovariate(1.5) * group_size / 3)))
+        group_members[group.id] = weighted_sample(user_ids, user_weights, size, rng)
+    Member.objects.bulk_create(
+        [Member(group_id=group_id, user_id=user_id) for group_id, members in group_members.items() for user_id in members],
+        batch_size=batch_size,
+    )
+
+    group_ids = list(group_members)
+    group_weights = zipf_weights(len(group_ids), skew)
+    rank = {user_id: i for i, user_id in enumerate(user_ids)}
+    instances = {user_id: User(id=user_id) for user_id in user_ids}
+    methods, method_weights = zip(*SPLIT_MIX.items())
+
+    def build():
+        group_id = rng.choices(group_ids, group_weights)[0]
+        members = group_members[group_id]
+        weights = [user_weights[rank[user_id]] for user_id in members]
+        participants = weighted_sample(members, weights, rng.randint(2, len(members)), rng)
+        payer = participants[0]
+        method = rng.choices(methods, method_weights)[0]
+        total_cents = 100 + int(rng.lognormvariate(7.5, 1.0))
+        shares = allocate(100 if method == 'percentage' else total_cents, [rng.randint(1, 10) for _ in participants])
+        split_data = [
+            {'user': user_id, 'percentage': share, 'amount_owed': str(from_cents(share))}
+            for user_id, share in zip(participants, shares)
+        ]
+        owed = compute_splits(method, from_cents(total_cents), [instances[user_id] for user_id in participants], instances[payer], split_data)
+        expense = Expense(
+            creator_id=payer, paid_by_id=payer, group_id=group_id, total_amount=from_cents(total_cents),
+            description=f'{prefix} expense', split_method=method,
+        )
+        return expense, [instances[user_id] for user_id in participants], owed
+
+    now = timezone.now()
+    per_day = [0] * max(days, 1)
+    for _ in range(expenses):
+        per_day[rng.randrange(len(per_day))] += 1
+    for days_ago, count in reversed(list(enumerate(per_day))):
+        created_at = now - timedelta(days=days_ago)
+        for start in range(0, count, batch_size):
+            with transaction.atomic():
+                saved = record_expenses([build() for _ in range(min(batch_size, count - start))])
+                # created_at is set on insert; backdate the batch afterwards
+                Expense.objects.filter(id__in=[expense.id for expense in saved]).update(created_at=created_at)
+                ExpenseSplit.objects.filter(expense_id__in=[expense.id for expense in saved]).update(created_at=created_at)
+
+    call_command('backfill_rollups', stdout=StringIO())
+    return user_ids, group_members
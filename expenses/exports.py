@@ -0,0 +1,170 @@
+"""
+Streaming CSV and NDJSON exports of expenses, splits and balances.
+
+Rows are read with ``.iterator()`` in chunks (a server-side cursor where
+the database has one) and encoded into a ``StreamingHttpResponse`` a
+buffer at a time, so an export of millions of rows holds one chunk in
+memory and the header goes out before the first query has run.
+"""
+import csv
+import io
+from datetime import datetime, time, timedelta
+
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import DateTimeField
+
+from .models import Balance, Expense, ExpenseSplit
+from .money import from_cents
+from .renderers import dumps
+
+CHUNK_SIZE = 2000
+# encoded bytes collected before a piece of the response is sent
+FLUSH_SIZE = 64 * 1024
+
+# timestamps are written as the API renders them
+timestamp = DateTimeField().to_representation
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def parse_filters(params):
+    """
+    ``(start, end, user_id)`` from ``?start=`` and ``?end=`` (inclusive
+    YYYY-MM-DD dates, as bounds on local time) and ``?user=``; each is
+    None when not given.
+    """
+    try:
+        start = date_bound(params['start']) if 'start' in params else None
+        end = date_bound(params['end'], next_day=True) if 'end' in params else None
+    except ValueError:
+        raise ValidationError({"error": "start and end must be dates in YYYY-MM-DD format"})
+    try:
+        user_id = int(params['user']) if 'user' in params else None
+    except ValueError:
+        raise ValidationError({"error": "Invalid user id"})
+    return start, end, user_id
+
+
+def date_bound(value, next_day=False):
+    day = datetime.strptime(value, '%Y-%m-%d').date()
+    if next_day:
+        day += timedelta(days=1)
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def date_range(queryset, field, start, end):
+    if start is not None:
+        queryset = queryset.filter(**{f'{field}__gte': start})
+    if end is not None:
+        queryset = queryset.filter(**{f'{field}__lt': end})
+    return queryset
+
+
+def expense_rows(start, end, user_id):
+    """
+    Expenses created in the range; with a user, those they paid or take part in.
+    """
+    expenses = date_range(Expense.objects.order_by('id'), 'created_at', start, end)
+    if user_id is not None:
+        Participant = Expense.participants.through
+        expenses = expenses.filter(
+            Q(paid_by_id=user_id) | Q(id__in=Participant.objects.filter(user_id=user_id).values('expense_id'))
+        )
+    rows = expenses.values_list(
+        'id', 'created_at', 'description', 'total_amount', 'split_method', 'creator_id', 'paid_by_id', 'group_id',
+    )
+    for expense_id, created_at, description, total_amount, *rest in rows.iterator(chunk_size=CHUNK_SIZE):
+        yield (expense_id, timestamp(created_at), description, str(total_amount), *rest)
+
+
+def split_rows(start, end, user_id):
+    """
+    Splits of the expenses created in the range; with a user, only theirs.
+    """
+    splits = date_range(ExpenseSplit.objects.order_by('id'), 'expense__created_at', start, end)
+    if user_id is not None:
+        splits = splits.filter(user_id=user_id)
+    rows = splits.values_list('expense_id', 'user_id', 'amount_owed', 'expense__created_at')
+    for expense_id, user_id, amount_owed, created_at in rows.iterator(chunk_size=CHUNK_SIZE):
+        yield (expense_id, user_id, str(amount_owed), timestamp(created_at))
+
+
+def balance_rows(start, end, user_id):
+    """
+    Current balances; a date range does not apply to them.
+    """
+    balances = Balance.objects.order_by('user_id')
+    if user_id is not None:
+        balances = balances.filter(user_id=user_id)
+    rows = balances.values_list('user_id', 'user__username', 'balance_cents')
+    for balance_user_id, username, balance_cents in rows.iterator(chunk_size=CHUNK_SIZE):
+        yield (balance_user_id, username, str(from_cents(balance_cents)))
+
+
+EXPORTS = {
+    'expenses': (
+        ('id', 'created_at', 'description', 'total_amount', 'split_method', 'creator', 'paid_by', 'group'),
+        expense_rows,
+    ),
+    'splits': (('expense', 'user', 'amount_owed', 'expense_created_at'), split_rows),
+    'balances': (('user', 'username', 'balance'), balance_rows),
+}
+
+
+def encode_csv(header, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    yield buffer.getvalue().encode()
+    buffer.seek(0)
+    buffer.truncate()
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= FLUSH_SIZE:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def encode_ndjson(header, rows):
+    rows = iter(rows)
+    # the first row goes out on its own so the client gets bytes at once
+    for row in rows:
+        yield dumps(dict(zip(header, row))) + b'\n'
+        break
+    pieces = []
+    size = 0
+    for row in rows:
+        line = dumps(dict(zip(header, row)))
+        pieces.append(line)
+        size += len(line) + 1
+        if size >= FLUSH_SIZE:
+            yield b'\n'.join(pieces) + b'\n'
+            pieces = []
+            size = 0
+    if pieces:
+        yield b'\n'.join(pieces) + b'\n'
+
+
+ENCODERS = {'csv': encode_csv, 'ndjson': encode_ndjson}
+
+
+def export_response(kind, file_format, params):
+    """
+    Streaming response with the ``kind`` export (a key of ``EXPORTS``) in
+    ``file_format``, filtered by the query ``params``.
+    """
+    start, end, user_id = parse_filters(params)
+    header, rows = EXPORTS[kind]
+    response = StreamingHttpResponse(
+        ENCODERS[file_format](header, rows(start, end, user_id)), content_type=FORMATS[file_format],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{kind}.{file_format}"'
+    return response
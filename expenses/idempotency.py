@@ -0,0 +1,181 @@
+"""
+Idempotency keys for the expense write endpoints.
+
+A client sends ``Idempotency-Key: <unique value>`` with a request and the
+same header again when it retries. The first request inserts the key row
+before running, so a concurrent duplicate waits on the unique constraint;
+once it succeeds its response is stored with the key and every retry gets
+that response back without running the split and balance logic again.
+Failed requests do not keep their key, so they can be retried as usual.
+
+Recent keys are also kept in a per-process LRU, so a retry storm does not
+hit the table. Keys expire after a TTL and are swept by the
+``prune_idempotency_keys`` command. Both are set with::
+
+    IDEMPOTENCY_KEYS = {
+        'TTL': 24 * 60 * 60,  # seconds
+        'LRU_SIZE': 10000,
+    }
+"""
+import functools
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+DEFAULTS = {
+    'TTL': 24 * 60 * 60,
+    'LRU_SIZE': 10000,
+}
+
+
+class RecentResponses:
+    """
+    In-process LRU of completed keys: ``key -> (fingerprint, status_code,
+    body, created_at)``.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_recent = None
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'IDEMPOTENCY_KEYS', {})}
+
+
+def get_recent():
+    global _recent
+    if _recent is None:
+        _recent = RecentResponses(get_config()['LRU_SIZE'])
+    return _recent
+
+
+def _reset_recent(*, setting, **kwargs):
+    global _recent
+    if setting == 'IDEMPOTENCY_KEYS':
+        _recent = None
+
+
+setting_changed.connect(_reset_recent)
+
+
+def expiry_cutoff():
+    return timezone.now() - timedelta(seconds=get_config()['TTL'])
+
+
+def fingerprint(request):
+    """
+    Hash of what the request asks for, to refuse a key reused for a
+    different request.
+    """
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    payload = json.dumps([request.method, request.path, data], sort_keys=True, cls=JSONEncoder)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def replay(entry, digest):
+    stored_digest, status_code, body, _ = entry
+    if stored_digest != digest:
+        return Response(
+            {"error": f"This {HEADER} was already used for a different request."},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    response = Response(json.loads(body), status=status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent_response(request, handler):
+    """
+    Return ``handler()``, or the stored response of an earlier request
+    carrying the same ``Idempotency-Key``. Requests without the header are
+    passed straight through.
+    """
+    key = request.headers.get(HEADER)
+    if key is None:
+        return handler()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        return Response(
+            {"error": f"{HEADER} must be between 1 and {MAX_KEY_LENGTH} characters."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    digest = fingerprint(request)
+    cutoff = expiry_cutoff()
+    recent = get_recent()
+    entry = recent.get(key)
+    if entry is not None and entry[3] >= cutoff:
+        return replay(entry, digest)
+
+    with transaction.atomic():
+        # an expired key that was not swept yet is free to be used again
+        IdempotencyKey.objects.filter(key=key, created_at__lt=cutoff).delete()
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(key=key, fingerprint=digest)
+        except IntegrityError:
+            # an earlier request with this key has completed
+            record = IdempotencyKey.objects.get(key=key)
+            entry = (record.fingerprint, record.status_code, record.response_body, record.created_at)
+            recent.set(key, entry)
+            return replay(entry, digest)
+
+        response = handler()
+        if response.status_code >= 400:
+            record.delete()
+            return response
+
+        record.status_code = response.status_code
+        record.response_body = json.dumps(response.data, cls=JSONEncoder)
+        record.save(update_fields=['status_code', 'response_body'])
+        entry = (record.fingerprint, record.status_code, record.response_body, record.created_at)
+        transaction.on_commit(lambda: recent.set(key, entry))
+    return response
+
+
+def idempotent(view_method):
+    """
+    Decorator for viewset methods that honour the ``Idempotency-Key`` header.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        return idempotent_response(request, lambda: view_method(self, request, *args, **kwargs))
+    return wrapper
@@ -0,0 +1,428 @@
+"""
+Bulk import of historical expenses from CSV or NDJSON files.
+
+Records are read one line at a time, their users resolved through a map
+loaded once for the whole file, and their splits worked out with the same
+engine as ``POST /expenses/``. Valid rows are written a chunk at a time,
+one transaction per chunk. A chunk's expenses, participants, splits and
+ledger entries are each inserted with a single ``executemany`` of plain
+tuples, and the balance, group balance, pairwise debt and rollup changes
+of the whole chunk are netted and applied with ``increment``. A chunk
+therefore costs the same number of statements whatever its size.
+
+The ``ImportCheckpoint`` of the file is advanced in the same transaction
+as each chunk, so an interrupted import resumes after the last committed
+chunk and never writes a row twice.
+
+Expense ids are reserved by the importer up front, so the chunk's rows
+can reference them without reading them back. They start past both the
+current maximum and the table's id sequence, so the id of a deleted
+expense is never handed out again: its ledger entries are kept and its
+reports may still be cached. On SQLite the sequence is read from
+``sqlite_sequence`` and the transaction holds the write lock from its
+start (see the ``transaction_mode`` setting), so nothing can take those
+ids meanwhile. On PostgreSQL the ids are reserved by advancing the
+sequence. On other databases the sequence is reset after every chunk, but
+an import should not run alongside other expense writes.
+"""
+import csv
+from collections import defaultdict, namedtuple
+from datetime import datetime
+
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import F, Max
+from django.db.models.constants import OnConflict
+from django.utils import timezone
+from rest_framework import serializers
+
+from .ledger import (
+    ROLLUP_FIELDS, apply_balance_deltas, apply_debt_deltas, apply_group_balance_deltas, apply_rollup_deltas,
+    balance_deltas, compute_splits, debt_deltas,
+)
+from .models import (
+    Expense, ExpenseSplit, Group, ImportCheckpoint, LedgerEntry, LedgerState, User, default_group_id,
+)
+from .money import from_cents, to_cents
+
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads
+
+CHUNK_SIZE = 20000
+
+FORMATS = ('csv', 'ndjson')
+COLUMNS = ('created_at', 'description', 'total_amount', 'split_method', 'paid_by', 'participants', 'splits', 'creator', 'group')
+REQUIRED_COLUMNS = COLUMNS[:6]
+# fields users can be referenced by in an import file
+USER_KEYS = ('email', 'username', 'id')
+
+DESCRIPTION_LENGTH = Expense._meta.get_field('description').max_length
+# totals must fit the ten digits of Expense.total_amount
+MAX_TOTAL_CENTS = 10 ** Expense._meta.get_field('total_amount').max_digits
+
+# stands in for a User wherever compute_splits only needs the id
+UserRef = namedtuple('UserRef', 'id')
+
+
+class InvalidRow(ValueError):
+    pass
+
+
+def user_map(key):
+    """
+    ``{value: UserRef}`` for every user, keyed by the string form of their
+    ``key`` field, one of ``USER_KEYS``.
+    """
+    return {str(value): UserRef(pk) for pk, value in User.objects.values_list('id', key).iterator()}
+
+
+class LineReader:
+    """
+    Iterates over the decoded lines of a binary file, keeping the byte
+    offset just past the last line handed out in ``position``. A line that
+    is not valid UTF-8 is handed out with replacement characters and sets
+    ``undecodable``, which the reader clears once it has rejected the row.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.position = stream.tell()
+        self.undecodable = False
+
+    def __iter__(self):
+        for raw in self.stream:
+            self.position += len(raw)
+            try:
+                text = raw.decode('utf-8')
+            except UnicodeDecodeError:
+                self.undecodable = True
+                text = raw.decode('utf-8', 'replace')
+            yield text
+
+
+def undecodable_row(lines):
+    lines.undecodable = False
+    return InvalidRow("The row is not valid UTF-8.")
+
+
+def csv_records(stream, position=0, line=0):
+    """
+    Yield ``(line, position, record)`` for every row of a CSV file opened
+    in binary mode, ``line`` being the last line of the row and
+    ``position`` the byte offset just past it. Reading starts at
+    ``position`` (the first row when 0) and counts lines from ``line``.
+
+    ``participants`` holds user references separated by ``;`` and
+    ``splits`` entries like ``alice@example.com:12.50``, the amount owed
+    or, for percentage splits, the percentage.
+    """
+    stream.seek(0)
+    header = next(csv.reader([stream.readline().decode('utf-8-sig')]), [])
+    missing = [column for column in REQUIRED_COLUMNS if column not in header]
+    if missing:
+        raise ValueError(f"The CSV header lacks the columns {', '.join(missing)}.")
+    if position:
+        stream.seek(position)
+    else:
+        line = 1
+
+    lines = LineReader(stream)
+    reader = csv.reader(lines)
+    for values in reader:
+        if lines.undecodable:
+            yield line + reader.line_num, lines.position, undecodable_row(lines)
+            continue
+        if not values:
+            continue
+        # a short row lacks the last columns, which parse_record reports
+        record = dict(zip(header, values))
+        record['participants'] = [key for key in record.get('participants', '').split(';') if key]
+        value_key = 'percentage' if record.get('split_method') == 'percentage' else 'amount_owed'
+        record['splits'] = [
+            {'user': key, value_key: value}
+            for key, _, value in (split.rpartition(':') for split in record.get('splits', '').split(';') if split)
+        ]
+        yield line + reader.line_num, lines.position, record
+
+
+def ndjson_records(stream, position=0, line=0):
+    """
+    Yield ``(line, position, record)`` like ``csv_records`` for a file
+    with one JSON object per line, in the shape of a ``POST /expenses/``
+    payload plus ``created_at``, with user references in place of ids.
+    A line that is not valid JSON gives a ``None`` record.
+    """
+    stream.seek(position)
+    lines = LineReader(stream)
+    for text in lines:
+        line += 1
+        if lines.undecodable:
+            yield line, lines.position, undecodable_row(lines)
+            continue
+        if not text.strip():
+            continue
+        try:
+            record = loads(text)
+        except ValueError:
+            record = None
+        yield line, lines.position, record
+
+
+READERS = {'csv': csv_records, 'ndjson': ndjson_records}
+
+
+def parse_record(record, users, groups, default_group):
+    """
+    Validate one record and work out its splits.
+
+    Returns the tuple ``(created_at, description, total_cents,
+    split_method, creator_id, paid_by_id, group_id, participant_ids,
+    owed)``, or raises ``InvalidRow`` saying what is wrong with it.
+    """
+    if isinstance(record, InvalidRow):
+        # the reader could not make a record of the row
+        raise record
+    if not isinstance(record, dict):
+        raise InvalidRow("Each record must be an object.")
+
+    def user(key):
+        try:
+            return users[key if type(key) is str else str(key)]
+        except KeyError:
+            raise InvalidRow(f"Unknown user {key!r}.")
+
+    try:
+        created_at = datetime.fromisoformat(record['created_at'])
+        if timezone.is_naive(created_at):
+            created_at = timezone.make_aware(created_at)
+    except KeyError:
+        raise InvalidRow("created_at is required.")
+    except (TypeError, ValueError):
+        raise InvalidRow("created_at must be an ISO 8601 date or datetime.")
+
+    description = record.get('description')
+    if not isinstance(description, str) or not description:
+        raise InvalidRow("description is required.")
+    if len(description) > DESCRIPTION_LENGTH:
+        raise InvalidRow(f"description is longer than {DESCRIPTION_LENGTH} characters.")
+
+    total_amount = record.get('total_amount')
+    try:
+        total_cents = to_cents(total_amount)
+    except ValueError as exc:
+        raise InvalidRow(str(exc))
+    if abs(total_cents) >= MAX_TOTAL_CENTS:
+        raise InvalidRow("total_amount is too large.")
+
+    if 'paid_by' not in record:
+        raise InvalidRow("paid_by is required.")
+    paid_by = user(record['paid_by'])
+    creator = user(record['creator']) if record.get('creator') not in (None, '') else paid_by
+
+    group = record.get('group')
+    if group in (None, ''):
+        group_id = default_group
+    else:
+        try:
+            group_id = int(group)
+        except (TypeError, ValueError):
+            group_id = None
+        if group_id not in groups:
+            raise InvalidRow(f"Unknown group {group!r}.")
+
+    participants = record.get('participants')
+    if not isinstance(participants, list) or not participants:
+        raise InvalidRow("participants must be a non-empty list.")
+    participants = {user(key) for key in participants}
+
+    splits = record.get('splits') or []
+    if not isinstance(splits, list):
+        raise InvalidRow("splits must be a list.")
+    splits = [
+        dict(split, user=user(split['user']).id) if isinstance(split, dict) and 'user' in split else split
+        for split in splits
+    ]
+
+    split_method = record.get('split_method')
+    try:
+        owed = compute_splits(split_method, total_amount, participants, paid_by, splits)
+    except serializers.ValidationError as exc:
+        raise InvalidRow("; ".join(map(str, exc.detail)))
+
+    return (
+        created_at, description, total_cents, split_method, creator.id, paid_by.id, group_id,
+        sorted(participant.id for participant in participants), owed,
+    )
+
+
+def insert_rows(model, fields, rows, ignore_conflicts=False):
+    """
+    Insert value tuples for ``fields`` of ``model`` with one
+    ``executemany``, without building a model instance per row. With
+    ``ignore_conflicts`` rows that violate a unique constraint are skipped,
+    as with ``bulk_create``.
+    """
+    ops = connection.ops
+    on_conflict = OnConflict.IGNORE if ignore_conflicts else None
+    columns = [model._meta.get_field(name).column for name in fields]
+    sql = (
+        f"{ops.insert_statement(on_conflict=on_conflict)} {ops.quote_name(model._meta.db_table)} "
+        f"({', '.join(map(ops.quote_name, columns))}) VALUES ({', '.join(['%s'] * len(fields))}) "
+        f"{ops.on_conflict_suffix_sql(fields, on_conflict, None, None)}"
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def reserve_expense_ids(count):
+    """
+    First of ``count`` consecutive expense ids that have never been used.
+    """
+    first_id = (Expense.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+    table = Expense._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s', [table])
+            row = cursor.fetchone()
+            if row:
+                first_id = max(first_id, row[0] + 1)
+        elif connection.vendor == 'postgresql':
+            cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+            sequence = cursor.fetchone()[0]
+            cursor.execute(
+                'SELECT setval(%s, GREATEST(nextval(%s), %s) + %s - 1)', [sequence, sequence, first_id, count],
+            )
+            first_id = cursor.fetchone()[0] - count + 1
+    return first_id
+
+
+def write_chunk(rows):
+    """
+    Write rows returned by ``parse_record`` as new expenses, with their
+    participants, splits, ledger entries, group memberships and netted
+    balance, group balance, debt and rollup changes, and bump the ledger
+    version. Callers are expected to wrap this in a transaction.
+    """
+    first_id = reserve_expense_ids(len(rows))
+    adapt_datetime = connection.ops.adapt_datetimefield_value
+    now = adapt_datetime(timezone.now())
+    tz = timezone.get_current_timezone()
+
+    expenses = []
+    participants = []
+    splits = []
+    entries = []
+    members = set()
+    deltas = defaultdict(int)
+    group_deltas = defaultdict(int)
+    debts = defaultdict(int)
+    rollups = defaultdict(lambda: [0] * len(ROLLUP_FIELDS))
+    for expense_id, row in enumerate(rows, first_id):
+        created_at, description, total_cents, split_method, creator_id, paid_by_id, group_id, participant_ids, owed = row
+        created = adapt_datetime(created_at)
+        expenses.append((
+            expense_id, creator_id, paid_by_id, group_id, from_cents(total_cents), description, split_method, created, 1,
+        ))
+        for user_id in participant_ids:
+            participants.append((expense_id, user_id))
+            members.add((group_id, user_id))
+        for user_id, cents in owed.items():
+            splits.append((expense_id, user_id, from_cents(cents), created))
+
+        for user_id, delta in balance_deltas(paid_by_id, owed).items():
+            if delta:
+                deltas[user_id] += delta
+                group_deltas[(group_id, user_id)] += delta
+                entries.append((expense_id, user_id, delta, now))
+        for pair, delta in debt_deltas(paid_by_id, owed).items():
+            debts[pair] += delta
+
+        day = created_at.astimezone(tz).date()
+        method = ROLLUP_FIELDS.index(f'{split_method}_owed_cents')
+        rollups[(paid_by_id, day)][0] += total_cents
+        for user_id, cents in owed.items():
+            rollup = rollups[(user_id, day)]
+            rollup[1] += cents
+            rollup[method] += cents
+
+    insert_rows(
+        Expense,
+        ('id', 'creator', 'paid_by', 'group', 'total_amount', 'description', 'split_method', 'created_at', 'version'),
+        expenses,
+    )
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [Expense]):
+                cursor.execute(sql)
+    insert_rows(Expense.participants.through, ('expense', 'user'), participants)
+    insert_rows(ExpenseSplit, ('expense', 'user', 'amount_owed', 'created_at'), splits)
+    insert_rows(LedgerEntry, ('expense', 'user', 'amount_cents', 'created_at'), entries)
+
+    insert_rows(Group.members.through, ('group', 'user'), sorted(members), ignore_conflicts=True)
+    apply_balance_deltas(deltas)
+    apply_group_balance_deltas(group_deltas)
+    apply_debt_deltas(debts)
+    apply_rollup_deltas(rollups)
+    LedgerState.bump()
+
+
+def save_chunk(checkpoint, rows, rejected, line, position):
+    """
+    Write ``rows`` and move ``checkpoint`` past them in one transaction.
+    """
+    with transaction.atomic():
+        # the checkpoint only moves on from where this run read it, so two
+        # runs over the same file cannot both import a chunk
+        moved = ImportCheckpoint.objects.filter(pk=checkpoint.pk, position=checkpoint.position).update(
+            position=position, line=line, imported=F('imported') + len(rows), rejected=F('rejected') + rejected,
+            updated_at=timezone.now(),
+        )
+        if not moved:
+            raise ValueError("Another import of this file moved its checkpoint on.")
+        if rows:
+            write_chunk(rows)
+    checkpoint.position = position
+    checkpoint.line = line
+    checkpoint.imported += len(rows)
+    checkpoint.rejected += rejected
+
+
+def import_records(records, checkpoint, users, chunk_size=CHUNK_SIZE, strict=False, on_reject=None, on_chunk=None):
+    """
+    Import the ``(line, position, record)`` triples of one of the readers,
+    ``chunk_size`` valid rows per transaction, advancing ``checkpoint``
+    with every chunk.
+
+    Invalid records are skipped and passed to ``on_reject(line, error)``;
+    with ``strict`` the first one raises ``InvalidRow`` instead, leaving
+    the chunks before it imported. ``on_chunk(checkpoint)`` is called
+    after every committed chunk.
+    """
+    groups = set(Group.objects.values_list('id', flat=True))
+    default_group = default_group_id()
+    rows = []
+    rejected = 0
+    line = position = None
+    for line, position, record in records:
+        try:
+            rows.append(parse_record(record, users, groups, default_group))
+        except InvalidRow as exc:
+            if strict:
+                raise InvalidRow(f"line {line}: {exc}")
+            rejected += 1
+            if on_reject:
+                on_reject(line, str(exc))
+
+        if len(rows) >= chunk_size:
+            save_chunk(checkpoint, rows, rejected, line, position)
+            rows = []
+            rejected = 0
+            if on_chunk:
+                on_chunk(checkpoint)
+
+    if rows or rejected:
+        save_chunk(checkpoint, rows, rejected, line, position)
+        if on_chunk:
+            on_chunk(checkpoint)
+    return checkpoint
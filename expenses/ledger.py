@@ -0,0 +1,621 @@
+"""
+Split and balance engine shared by the expense write paths.
+
+Every amount is handled as integer cents (see ``money``). Splits are
+computed in memory, inserted with one ``bulk_create`` and the resulting
+balance deltas are applied with a single set-based ``UPDATE``, so the
+number of queries depends neither on the number of participants nor on
+the number of expenses written together.
+"""
+from collections import defaultdict
+from copy import copy
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection
+from django.db.models import BigIntegerField, Case, F, Max, Q, Sum, Value, When
+from django.db.models.functions import Cast, Round
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.exceptions import APIException
+
+from .models import (
+    Balance, BalanceSnapshot, BalanceSnapshotRow, DailyRollup, Expense, ExpenseSplit, Group, GroupBalance, LedgerEntry,
+    LedgerState, PairwiseDebt, default_group_id,
+)
+from .money import allocate, from_cents, to_cents
+from .summary_cache import summaries_changed
+
+ROLLUP_FIELDS = ('paid_cents', 'owed_cents', 'equal_owed_cents', 'exact_owed_cents', 'percentage_owed_cents')
+
+# Upper bound on users touched by a single UPDATE so the statement stays
+# well inside SQLite's bound-parameter limit.
+BATCH_SIZE = 400
+
+
+def _split_entries(split_data, user_ids, value_key):
+    """
+    Yield ``(user_id, value)`` for each split entry, rejecting entries that
+    are malformed or name a user outside the participants.
+    """
+    if not isinstance(split_data, list):
+        raise serializers.ValidationError("splits must be a list.")
+    for split in split_data:
+        try:
+            user_id = split['user']
+            value = split[value_key]
+        except (KeyError, TypeError):
+            raise serializers.ValidationError(f"Each split needs a 'user' and '{value_key}'.")
+
+        if user_id not in user_ids:
+            raise serializers.ValidationError(f"User with ID {user_id} is not a participant of this expense.")
+        yield user_id, value
+
+
+def compute_splits(split_method, total_amount, participants, paid_by, split_data):
+    """
+    Work out how many cents each participant owes the payer.
+
+    Returns a ``{user_id: cents}`` dict that leaves out the payer, or
+    raises ``ValidationError`` when the split definition does not add up.
+    Equal and percentage splits are allocated with the largest remainder
+    method, so the shares always add up to ``total_amount`` exactly.
+    """
+    user_ids = sorted(participant.id for participant in participants)
+    if not user_ids:
+        raise serializers.ValidationError("An expense needs at least one participant.")
+    total_cents = to_cents(total_amount)
+    shares = defaultdict(int)
+
+    # equal split
+    if split_method == 'equal':
+        for user_id, cents in zip(user_ids, allocate(total_cents, [1] * len(user_ids))):
+            shares[user_id] += cents
+
+    # exact split
+    elif split_method == 'exact':
+        for user_id, amount_owed in _split_entries(split_data, user_ids, 'amount_owed'):
+            try:
+                shares[user_id] += to_cents(amount_owed)
+            except ValueError as exc:
+                raise serializers.ValidationError(str(exc))
+
+        if sum(shares.values()) != total_cents:
+            raise serializers.ValidationError("The sum of exact amounts does not equal the total amount.")
+
+    # percentage split
+    elif split_method == 'percentage':
+        entries = list(_split_entries(split_data, user_ids, 'percentage'))
+        try:
+            percentages = [Decimal(str(percentage)) for _, percentage in entries]
+        except InvalidOperation:
+            raise serializers.ValidationError("Percentages must be numbers.")
+
+        if sum(percentages) != 100:
+            raise serializers.ValidationError("The total of all percentages must equal 100%.")
+
+        for (user_id, _), cents in zip(entries, allocate(total_cents, percentages)):
+            shares[user_id] += cents
+
+    else:
+        raise serializers.ValidationError("Invalid split method specified.")
+
+    return {user_id: cents for user_id, cents in shares.items() if user_id != paid_by.id}
+
+
+def balance_deltas(paid_by_id, owed):
+    """
+    Balance changes in cents implied by one expense: every participant goes
+    down by what they owe and the payer goes up by the sum of it.
+    """
+    deltas = {user_id: -cents for user_id, cents in owed.items()}
+    deltas[paid_by_id] = deltas.get(paid_by_id, 0) + sum(owed.values())
+    return deltas
+
+
+def increment(model, key_fields, fields, deltas):
+    """
+    Add ``{key: delta}`` to ``model.fields`` for the rows identified by
+    ``key``, a tuple of values for ``key_fields``, creating missing rows.
+    ``fields`` is either one field name with int deltas or a tuple of field
+    names with a tuple of deltas per key.
+
+    Where the database supports ``INSERT ... ON CONFLICT`` on a target
+    (SQLite, PostgreSQL) all keys go through one upsert statement sent with
+    ``executemany``, which adds each delta to the existing row or inserts
+    it. Elsewhere each batch of ``BATCH_SIZE`` keys costs two statements:
+    an insert of every key, which the unique constraint over
+    ``key_fields`` turns into a no-op for existing rows, and a single
+    ``UPDATE`` with one ``CASE`` arm per key and field. Either way the
+    arithmetic happens in the database, so concurrent writers never lose
+    each other's updates.
+
+    Keys are processed in sorted order, and on backends with row locks the
+    rows are locked in that order, so two writers touching overlapping
+    users always queue behind each other instead of deadlocking.
+    """
+    if isinstance(fields, str):
+        fields = (fields,)
+        deltas = {key: (delta,) for key, delta in deltas.items()}
+    items = sorted((key, delta) for key, delta in deltas.items() if any(delta))
+    if not items:
+        return
+
+    if connection.features.supports_update_conflicts_with_target:
+        # the CASE expressions below cost about a millisecond of ORM time per
+        # key, which dominates large batches such as imports
+        upsert_increment(model, key_fields, fields, items)
+        return
+
+    for start in range(0, len(items), BATCH_SIZE):
+        batch = items[start:start + BATCH_SIZE]
+        lookups = [dict(zip(key_fields, key)) for key, _ in batch]
+        model.objects.bulk_create([model(**lookup) for lookup in lookups], ignore_conflicts=True)
+
+        if len(key_fields) == 1:
+            rows = Q(**{f'{key_fields[0]}__in': [key[0] for key, _ in batch]})
+        else:
+            rows = Q()
+            for lookup in lookups:
+                rows |= Q(**lookup)
+        if connection.features.has_select_for_update:
+            list(model.objects.filter(rows).order_by(*key_fields).select_for_update().values_list('pk', flat=True))
+        model.objects.filter(rows).update(**{
+            field: F(field) + Case(
+                *[When(**lookup, then=Value(delta[i])) for lookup, (_, delta) in zip(lookups, batch)],
+                output_field=BigIntegerField(),
+            )
+            for i, field in enumerate(fields)
+        })
+
+
+def upsert_increment(model, key_fields, fields, items):
+    """
+    ``increment`` as a single ``INSERT ... ON CONFLICT DO UPDATE`` run once
+    per ``(key, deltas)`` item.
+    """
+    quote = connection.ops.quote_name
+    opts = model._meta
+    table = quote(opts.db_table)
+    keys = [opts.get_field(name) for name in key_fields]
+    key_columns = [quote(field.column) for field in keys]
+    value_columns = [quote(opts.get_field(name).column) for name in fields]
+    sql = (
+        f"INSERT INTO {table} ({', '.join(key_columns + value_columns)}) "
+        f"VALUES ({', '.join(['%s'] * (len(keys) + len(fields)))}) "
+        f"ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET "
+        + ', '.join(f"{column} = {table}.{column} + EXCLUDED.{column}" for column in value_columns)
+    )
+    # keys repeat their values (users, days) a lot, so each distinct value
+    # is prepared for the database once
+    prepared = [{} for _ in keys]
+    rows = []
+    for key, delta in items:
+        row = []
+        for field, cache, value in zip(keys, prepared, key):
+            if value not in cache:
+                cache[value] = field.get_db_prep_value(value, connection)
+            row.append(cache[value])
+        rows.append(row + list(delta))
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def apply_balance_deltas(deltas):
+    """
+    Add ``{user_id: delta}`` to the users' balances and drop their cached
+    summaries.
+    """
+    summaries_changed(deltas)
+    increment(Balance, ('user_id',), 'balance_cents', {(user_id,): delta for user_id, delta in deltas.items()})
+
+
+def debt_deltas(paid_by_id, owed):
+    """
+    Pairwise debt changes implied by one expense, keyed by the canonical
+    ``(user_a_id, user_b_id)`` pair with ``user_a_id < user_b_id``.
+    """
+    deltas = {}
+    for user_id, cents in owed.items():
+        if user_id < paid_by_id:
+            deltas[(user_id, paid_by_id)] = deltas.get((user_id, paid_by_id), 0) + cents
+        else:
+            deltas[(paid_by_id, user_id)] = deltas.get((paid_by_id, user_id), 0) - cents
+    return deltas
+
+
+def apply_debt_deltas(deltas):
+    """
+    Add ``{(user_a_id, user_b_id): delta}`` to the pairwise debts.
+    """
+    increment(PairwiseDebt, ('user_a_id', 'user_b_id'), 'amount_cents', deltas)
+
+
+def apply_group_balance_deltas(deltas):
+    """
+    Add ``{(group_id, user_id): delta}`` to the per-group balances.
+    """
+    increment(GroupBalance, ('group_id', 'user_id'), 'balance_cents', deltas)
+
+
+def rollup_deltas(expense, owed):
+    """
+    Daily rollup changes implied by one saved expense, keyed by
+    ``(user_id, day)`` with one delta per field of ``ROLLUP_FIELDS``.
+    """
+    day = timezone.localdate(expense.created_at)
+    method = ROLLUP_FIELDS.index(f'{expense.split_method}_owed_cents')
+    deltas = defaultdict(lambda: [0] * len(ROLLUP_FIELDS))
+    deltas[(expense.paid_by_id, day)][0] += to_cents(expense.total_amount)
+    for user_id, cents in owed.items():
+        deltas[(user_id, day)][1] += cents
+        deltas[(user_id, day)][method] += cents
+    return deltas
+
+
+def apply_rollup_deltas(deltas):
+    """
+    Add ``{(user_id, day): deltas}`` to the daily rollups.
+    """
+    increment(DailyRollup, ('user_id', 'day'), ROLLUP_FIELDS, deltas)
+
+
+class ExpenseConflict(APIException):
+    status_code = 409
+    default_detail = "The expense was changed by another request; reload it and try again."
+    default_code = 'conflict'
+
+
+def apply_expense_effects(effects):
+    """
+    Apply the balance, group balance, pairwise debt and rollup changes of
+    ``(expense, owed, sign)`` triples, ``sign`` being 1 to apply a saved
+    expense and -1 to reverse it, log the net balance change of every
+    expense as ledger entries and bump the ledger version.
+
+    Changes are netted before they are written, so an edit that only
+    touches a few splits only updates the rows of the users involved.
+    """
+    deltas = defaultdict(int)
+    group_deltas = defaultdict(int)
+    debts = defaultdict(int)
+    rollups = defaultdict(lambda: [0] * len(ROLLUP_FIELDS))
+    entries = defaultdict(int)
+    for expense, owed, sign in effects:
+        for user_id, delta in balance_deltas(expense.paid_by_id, owed).items():
+            deltas[user_id] += sign * delta
+            group_deltas[(expense.group_id, user_id)] += sign * delta
+            entries[(expense.id, user_id)] += sign * delta
+        for pair, delta in debt_deltas(expense.paid_by_id, owed).items():
+            debts[pair] += sign * delta
+        for key, row in rollup_deltas(expense, owed).items():
+            rollups[key] = [total + sign * delta for total, delta in zip(rollups[key], row)]
+
+    LedgerEntry.objects.bulk_create([
+        LedgerEntry(expense_id=expense_id, user_id=user_id, amount_cents=cents)
+        for (expense_id, user_id), cents in entries.items() if cents
+    ])
+    apply_balance_deltas(deltas)
+    apply_group_balance_deltas(group_deltas)
+    apply_debt_deltas(debts)
+    apply_rollup_deltas(rollups)
+    if effects:
+        LedgerState.bump()
+
+
+def join_group(group_id, user_ids):
+    """
+    Make the users members of the group if they are not already.
+    """
+    Member = Group.members.through
+    Member.objects.bulk_create(
+        [Member(group_id=group_id, user_id=user_id) for user_id in user_ids],
+        ignore_conflicts=True,
+    )
+
+
+def stored_owed(expenses):
+    """
+    ``{expense_id: owed}`` of saved expenses as recorded in their splits,
+    in the shape returned by ``compute_splits``. One query for all of them.
+    """
+    owed = {expense.id: defaultdict(int) for expense in expenses}
+    paid_by = {expense.id: expense.paid_by_id for expense in expenses}
+    splits = ExpenseSplit.objects.filter(expense_id__in=owed).values_list('expense_id', 'user_id', 'amount_owed')
+    for expense_id, user_id, amount_owed in splits.iterator():
+        # older data may hold a split for the payer, which owes nobody
+        if user_id != paid_by[expense_id]:
+            owed[expense_id][user_id] += to_cents(amount_owed)
+    return {expense_id: dict(shares) for expense_id, shares in owed.items()}
+
+
+def claim_expense(expense):
+    """
+    Bump the version of ``expense`` if it still is the one it was loaded
+    at, raising ``ExpenseConflict`` otherwise. Taken before the old splits
+    are read, so two concurrent edits can never both reverse them.
+    """
+    if not Expense.objects.filter(id=expense.id, version=expense.version).update(version=F('version') + 1):
+        raise ExpenseConflict()
+    expense.version += 1
+
+
+def record_expenses(entries):
+    """
+    Persist a batch of new expenses together with their participants, splits,
+    ledger entries, global and per-group balance deltas, pairwise debt
+    deltas and daily rollups, and bump the ledger version. Participants
+    join the expense's group if they were not members yet.
+
+    ``entries`` is a list of ``(expense, participants, owed)`` tuples where
+    ``expense`` is an unsaved ``Expense`` and ``owed`` comes from
+    ``compute_splits``. Expenses without a group go to the default group.
+    The whole batch costs a fixed number of statements. Callers are
+    expected to wrap this in a transaction.
+    """
+    ungrouped = [expense for expense, _, _ in entries if expense.group_id is None]
+    if ungrouped:
+        group_id = default_group_id()
+        for expense in ungrouped:
+            expense.group_id = group_id
+
+    expenses = Expense.objects.bulk_create([expense for expense, _, _ in entries])
+
+    Participant = Expense.participants.through
+    Participant.objects.bulk_create([
+        Participant(expense_id=expense.id, user_id=participant.id)
+        for expense, (_, participants, _) in zip(expenses, entries)
+        for participant in participants
+    ])
+
+    Member = Group.members.through
+    Member.objects.bulk_create(
+        list({
+            (expense.group_id, participant.id): Member(group_id=expense.group_id, user_id=participant.id)
+            for expense, (_, participants, _) in zip(expenses, entries)
+            for participant in participants
+        }.values()),
+        ignore_conflicts=True,
+    )
+
+    ExpenseSplit.objects.bulk_create([
+        ExpenseSplit(expense_id=expense.id, user_id=user_id, amount_owed=from_cents(cents), created_at=expense.created_at)
+        for expense, (_, _, owed) in zip(expenses, entries)
+        for user_id, cents in owed.items()
+    ])
+
+    apply_expense_effects([(expense, owed, 1) for expense, (_, _, owed) in zip(expenses, entries)])
+    return expenses
+
+
+def update_expense(expense, fields, participants=None, owed=None):
+    """
+    Change a saved expense: set ``fields`` on it, replace its participants
+    when ``participants`` is given and its splits when ``owed`` is given,
+    then apply the old splits reversed and the new ones in one netted pass.
+    No user's balance is recomputed from scratch.
+
+    Raises ``ExpenseConflict`` when the expense was changed since it was
+    loaded. Callers are expected to wrap this in a transaction.
+    """
+    claim_expense(expense)
+    old = copy(expense)
+    old_owed = stored_owed([old])[old.id]
+
+    for name, value in fields.items():
+        setattr(expense, name, value)
+    if expense.group_id is None:
+        expense.group_id = default_group_id()
+    columns = [Expense._meta.get_field(name).attname for name in fields]
+    Expense.objects.filter(id=expense.id).update(**{column: getattr(expense, column) for column in columns})
+
+    Participant = Expense.participants.through
+    if participants is not None:
+        user_ids = {participant.id for participant in participants}
+        Participant.objects.filter(expense_id=expense.id).exclude(user_id__in=user_ids).delete()
+        Participant.objects.bulk_create(
+            [Participant(expense_id=expense.id, user_id=user_id) for user_id in user_ids],
+            ignore_conflicts=True,
+        )
+    if participants is not None or expense.group_id != old.group_id:
+        join_group(expense.group_id, Participant.objects.filter(expense_id=expense.id).values_list('user_id', flat=True))
+
+    if owed is None:
+        owed = old_owed
+    elif owed != old_owed or expense.paid_by_id != old.paid_by_id:
+        ExpenseSplit.objects.filter(expense_id=expense.id).delete()
+        ExpenseSplit.objects.bulk_create([
+            ExpenseSplit(expense_id=expense.id, user_id=user_id, amount_owed=from_cents(cents), created_at=expense.created_at)
+            for user_id, cents in owed.items()
+        ])
+
+    apply_expense_effects([(old, old_owed, -1), (expense, owed, 1)])
+    return expense
+
+
+def delete_expense(expense):
+    """
+    Reverse the balances of a saved expense and delete it with its splits.
+    Its ledger entries stay, followed by the reversing ones.
+
+    Raises ``ExpenseConflict`` when the expense was changed since it was
+    loaded. Callers are expected to wrap this in a transaction.
+    """
+    claim_expense(expense)
+    owed = stored_owed([expense])[expense.id]
+    apply_expense_effects([(expense, owed, -1)])
+    expense.delete()
+
+
+def ledger_balances():
+    """
+    Every user's balance according to the ledger: the latest snapshot plus
+    a single ``GROUP BY`` over the entries written after it, so the cost
+    grows with the tail of the log rather than with its whole length.
+
+    Returns ``({user_id: cents}, last_entry_id)``.
+    """
+    balances = defaultdict(int)
+    last_entry_id = 0
+    snapshot = BalanceSnapshot.latest()
+    if snapshot is not None:
+        last_entry_id = snapshot.last_entry_id
+        balances.update(snapshot.rows.values_list('user_id', 'balance_cents').iterator())
+
+    # fix the end of the tail first so the snapshot taken from the result
+    # records exactly the entries that were summed
+    upto = LedgerEntry.objects.aggregate(last=Max('id'))['last'] or 0
+    if upto > last_entry_id:
+        tail = (
+            LedgerEntry.objects.filter(id__gt=last_entry_id, id__lte=upto)
+            .values('user_id').annotate(total=Sum('amount_cents')).order_by()
+        )
+        for row in tail.iterator():
+            balances[row['user_id']] += row['total']
+        last_entry_id = upto
+    return balances, last_entry_id
+
+
+def take_snapshot():
+    """
+    Store the current ledger balances as a new snapshot. The snapshot is
+    built from the previous one and the ledger tail, never from ``Balance``,
+    so drift in the balance table does not leak into it.
+    """
+    balances, last_entry_id = ledger_balances()
+    snapshot = BalanceSnapshot.objects.create(last_entry_id=last_entry_id)
+    BalanceSnapshotRow.objects.bulk_create(
+        (
+            BalanceSnapshotRow(snapshot_id=snapshot.id, user_id=user_id, balance_cents=cents)
+            for user_id, cents in balances.items() if cents
+        ),
+        batch_size=BATCH_SIZE,
+    )
+    return snapshot
+
+
+def replay_balances(dry_run=False):
+    """
+    Rebuild ``Balance`` from the ledger, touching only the rows that drifted.
+    Returns ``{user_id: correction}`` for those rows. Callers are expected
+    to wrap this in a transaction.
+    """
+    balances, _ = ledger_balances()
+    current = dict(Balance.objects.values_list('user_id', 'balance_cents').iterator())
+    corrections = {
+        user_id: balances.get(user_id, 0) - current.get(user_id, 0)
+        for user_id in balances.keys() | current.keys()
+    }
+    corrections = {user_id: cents for user_id, cents in corrections.items() if cents}
+    if corrections and not dry_run:
+        apply_balance_deltas(corrections)
+        LedgerState.bump()
+    return corrections
+
+
+def split_balances(user_ids=None, by_group=False):
+    """
+    Every user's balance implied by the expenses themselves: what others
+    owe them on the expenses they paid minus what they owe on the rest.
+    Computed with a single ``GROUP BY`` over the ``(debtor, payer)`` pairs
+    of the splits, each split rounded to cents before it is summed so the
+    totals are exact even where decimals are stored as floats.
+
+    With ``user_ids`` only those users' balances are computed, with two
+    indexed ``GROUP BY`` queries per ``BATCH_SIZE`` users: one over the
+    splits they owe and one over the splits of the expenses they paid.
+    Returns ``{user_id: cents}``, or ``{(group_id, user_id): cents}`` with
+    ``by_group``.
+    """
+    # older data may hold a split for the payer, which owes nobody
+    splits = ExpenseSplit.objects.exclude(user_id=F('expense__paid_by_id'))
+    fields = ('user_id', 'expense__paid_by_id') + (('expense__group_id',) if by_group else ())
+
+    def pairs(splits):
+        rows = (
+            splits.values_list(*fields)
+            .annotate(cents=Sum(Cast(Round(F('amount_owed') * 100), BigIntegerField())))
+            .order_by().iterator()
+        )
+        for debtor_id, payer_id, *group, cents in rows:
+            if by_group:
+                yield (group[0], debtor_id), (group[0], payer_id), cents
+            else:
+                yield debtor_id, payer_id, cents
+
+    balances = defaultdict(int)
+    if user_ids is None:
+        for debtor, payer, cents in pairs(splits):
+            balances[debtor] -= cents
+            balances[payer] += cents
+        return balances
+
+    user_ids = sorted(user_ids)
+    for start in range(0, len(user_ids), BATCH_SIZE):
+        batch = user_ids[start:start + BATCH_SIZE]
+        for debtor, _, cents in pairs(splits.filter(user_id__in=batch)):
+            balances[debtor] -= cents
+        for _, payer, cents in pairs(splits.filter(expense__paid_by_id__in=batch)):
+            balances[payer] += cents
+    return balances
+
+
+def repair_balances(corrections, expected):
+    """
+    Apply ``corrections`` to ``Balance`` and bring the rest of the books in
+    line with ``expected``, the balances implied by the splits: the group
+    balances of the corrected users are reset to what their splits imply,
+    and entries without an expense are logged for the difference between
+    ``expected`` and the ledger, so a later ``replay_ledger`` (which starts
+    from a snapshot that may hold the old drift) keeps the repair.
+    """
+    user_ids = sorted(corrections)
+    ledger, _ = ledger_balances()
+    LedgerEntry.objects.bulk_create([
+        LedgerEntry(expense_id=None, user_id=user_id, amount_cents=expected.get(user_id, 0) - ledger.get(user_id, 0))
+        for user_id in user_ids if expected.get(user_id, 0) != ledger.get(user_id, 0)
+    ])
+    apply_balance_deltas(corrections)
+
+    expected_groups = split_balances(user_ids, by_group=True)
+    current_groups = {}
+    for start in range(0, len(user_ids), BATCH_SIZE):
+        rows = GroupBalance.objects.filter(user_id__in=user_ids[start:start + BATCH_SIZE])
+        current_groups.update(
+            ((group_id, user_id), cents) for group_id, user_id, cents in rows.values_list('group_id', 'user_id', 'balance_cents')
+        )
+    apply_group_balance_deltas({
+        key: expected_groups.get(key, 0) - current_groups.get(key, 0)
+        for key in expected_groups.keys() | current_groups.keys()
+        if expected_groups.get(key, 0) != current_groups.get(key, 0)
+    })
+    LedgerState.bump()
+
+
+def check_balances(user_ids=None, repair=False):
+    """
+    Compare ``Balance`` with ``split_balances`` for every user, or only for
+    ``user_ids``, and with ``repair`` correct the users that drifted with
+    ``repair_balances``.
+    Returns ``({user_id: correction}, users_checked)``. Callers are
+    expected to wrap this in a transaction.
+    """
+    expected = split_balances(user_ids)
+    if user_ids is None:
+        current = dict(Balance.objects.values_list('user_id', 'balance_cents').iterator())
+        checked = expected.keys() | current.keys()
+    else:
+        current = {}
+        user_ids = sorted(user_ids)
+        for start in range(0, len(user_ids), BATCH_SIZE):
+            batch = user_ids[start:start + BATCH_SIZE]
+            current.update(Balance.objects.filter(user_id__in=batch).values_list('user_id', 'balance_cents'))
+        checked = user_ids
+
+    corrections = {
+        user_id: expected.get(user_id, 0) - current.get(user_id, 0)
+        for user_id in checked
+    }
+    corrections = {user_id: cents for user_id, cents in corrections.items() if cents}
+    if corrections and repair:
+        repair_balances(corrections, expected)
+    return corrections, len(checked)
@@ -0,0 +1,60 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models.functions import TruncDate
+
+from expenses.ledger import ROLLUP_FIELDS, apply_rollup_deltas
+from expenses.models import DailyRollup, Expense, ExpenseSplit
+from expenses.money import to_cents
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily rollups from the expense history, streaming expenses and their splits in chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help="Expenses read per round trip.")
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        expenses = Expense.objects.annotate(day=TruncDate('created_at')).order_by('id')
+        count = 0
+        last_id = 0
+
+        with transaction.atomic():
+            DailyRollup.objects.all().delete()
+
+            # keyset over expense ids: each chunk's totals are added to the
+            # table before the next one is read, so memory stays bounded
+            while True:
+                chunk = list(
+                    expenses.filter(id__gt=last_id)
+                    .values_list('id', 'paid_by_id', 'day', 'total_amount', 'split_method')[:chunk_size]
+                )
+                if not chunk:
+                    break
+                last_id = chunk[-1][0]
+
+                deltas = defaultdict(lambda: [0] * len(ROLLUP_FIELDS))
+                expense_info = {}
+                for expense_id, paid_by_id, day, total_amount, split_method in chunk:
+                    deltas[(paid_by_id, day)][0] += to_cents(total_amount)
+                    expense_info[expense_id] = (paid_by_id, day, ROLLUP_FIELDS.index(f'{split_method}_owed_cents'))
+
+                splits = ExpenseSplit.objects.filter(expense_id__gte=chunk[0][0], expense_id__lte=last_id)
+                for expense_id, user_id, amount_owed in splits.values_list('expense_id', 'user_id', 'amount_owed').iterator(chunk_size=chunk_size):
+                    paid_by_id, day, method = expense_info[expense_id]
+                    # older data may hold a split for the payer, which owes nobody
+                    if user_id == paid_by_id:
+                        continue
+                    cents = to_cents(amount_owed)
+                    deltas[(user_id, day)][1] += cents
+                    deltas[(user_id, day)][method] += cents
+
+                apply_rollup_deltas(deltas)
+                count += len(chunk)
+                self.stdout.write(f"read {count} expenses")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {DailyRollup.objects.count()} daily rollups from {count} expenses."
+        ))
@@ -0,0 +1,109 @@
+import asyncio
+import random
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.benchmarking import percentile
+from expenses.models import Expense, User
+
+# Fast reads, relative to the server root; the ASGI run uses the /async/ copies.
+READ_PATHS = [
+    'expenses/user/{user_id}/',
+    'expenses/user/{user_id}/overall/',
+    'balances/',
+]
+SLOW_PATH = 'expenses/{expense_id}/balance_sheet/'
+
+
+async def http_get(host, port, path):
+    """
+    Minimal HTTP/1.1 GET over a fresh connection; returns the status code
+    once the whole body has been read.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+        status_line = await reader.readline()
+        while await reader.read(65536):
+            pass
+        return int(status_line.split()[1])
+    finally:
+        writer.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test running servers with a mix of fast JSON reads and slow PDF renders, and compare "
+        "read latency and throughput of a WSGI deployment (sync endpoints) with an ASGI one (/async/ endpoints). "
+        "Both servers must use this project's database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wsgi', help="Base URL of the WSGI server, e.g. http://127.0.0.1:8000")
+        parser.add_argument('--asgi', help="Base URL of the ASGI server, e.g. http://127.0.0.1:8001")
+        parser.add_argument('--concurrency', type=int, default=50, help="Requests in flight at any time.")
+        parser.add_argument('--duration', type=float, default=10.0, help="Seconds per server.")
+        parser.add_argument('--slow-ratio', type=float, default=0.1, help="Share of requests that render a PDF.")
+        parser.add_argument('--users', type=int, default=100, help="Distinct users to read.")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        targets = [(name, options[name]) for name in ('wsgi', 'asgi') if options[name]]
+        if not targets:
+            raise CommandError("Pass --wsgi and/or --asgi.")
+
+        user_ids = list(User.objects.order_by('id').values_list('id', flat=True)[:options['users']])
+        expense_ids = list(Expense.objects.order_by('-id').values_list('id', flat=True)[:1000])
+        if not user_ids or not expense_ids:
+            raise CommandError("The database needs users and expenses to read; run it against a seeded database.")
+
+        self.stdout.write(
+            f"{options['concurrency']} concurrent clients, {options['duration']:.0f}s per server, "
+            f"{options['slow_ratio']:.0%} PDF renders"
+        )
+        self.stdout.write(
+            f"{'server':<6} {'req/s':>8} {'read p50':>9} {'read p99':>9} {'pdf p50':>9} {'pdf p99':>9} {'errors':>7}  (ms)"
+        )
+        for name, url in targets:
+            prefix = 'async/' if name == 'asgi' else ''
+            rng = random.Random(options['seed'])
+            reads, pdfs, errors, elapsed = asyncio.run(
+                self.run_load(url, prefix, user_ids, expense_ids, rng, options)
+            )
+            self.stdout.write(
+                f"{name:<6} {(len(reads) + len(pdfs)) / elapsed:>8.0f} "
+                f"{percentile(reads, 0.5):>9.1f} {percentile(reads, 0.99):>9.1f} "
+                f"{percentile(pdfs, 0.5):>9.1f} {percentile(pdfs, 0.99):>9.1f} {errors:>7}"
+            )
+
+    async def run_load(self, url, prefix, user_ids, expense_ids, rng, options):
+        parts = urlsplit(url)
+        host, port = parts.hostname, parts.port or 80
+        root = parts.path.rstrip('/') + '/'
+        reads, pdfs = [], []
+        errors = 0
+        deadline = time.perf_counter() + options['duration']
+
+        async def client():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                if rng.random() < options['slow_ratio']:
+                    path, samples = root + SLOW_PATH.format(expense_id=rng.choice(expense_ids)), pdfs
+                else:
+                    path, samples = root + prefix + rng.choice(READ_PATHS).format(user_id=rng.choice(user_ids)), reads
+                start = time.perf_counter()
+                try:
+                    status = await http_get(host, port, path)
+                except OSError:
+                    status = None
+                if status != 200:
+                    errors += 1
+                    continue
+                samples.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[client() for _ in range(options['concurrency'])])
+        return reads, pdfs, errors, time.perf_counter() - start
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+
+from expenses.benchmarking import api_client, rolled_back, timed
+from expenses.models import User
+
+
+class Command(BaseCommand):
+    help = "Compare POST /expenses/bulk/ throughput against the same expenses sent as single POST /expenses/ requests."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--expenses', type=int, default=500, help="Number of expenses per run.")
+        parser.add_argument('--participants', type=int, default=5, help="Participants per expense.")
+
+    def handle(self, *args, **options):
+        count = options['expenses']
+        size = options['participants']
+
+        with rolled_back():
+            users = User.objects.bulk_create([
+                User(username=f'bench-bulk-{i}', email=f'bench-bulk-{i}@example.com', mobile_number=str(i))
+                for i in range(size)
+            ])
+            client = api_client(users[0])
+            payloads = [
+                {
+                    'creator': users[0].id,
+                    'paid_by': users[i % size].id,
+                    'participants': [user.id for user in users],
+                    'total_amount': f'{10 + i % 90}.00',
+                    'description': f'bench expense {i}',
+                    'split_method': 'equal',
+                    'splits': [],
+                }
+                for i in range(count)
+            ]
+
+            def post_singles():
+                for payload in payloads:
+                    response = client.post(reverse('expense-list'), payload, format='json')
+                    assert response.status_code == 201, response.data
+
+            def post_bulk():
+                response = client.post(reverse('expense-bulk-create'), payloads, format='json')
+                assert response.status_code == 201, response.data
+
+            _, single_seconds = timed(post_singles)
+            _, bulk_seconds = timed(post_bulk)
+
+        self.stdout.write(f"{count} expenses x {size} participants")
+        self.stdout.write(f"single posts: {single_seconds:.3f}s ({count / single_seconds:.0f} expenses/s)")
+        self.stdout.write(f"bulk post:    {bulk_seconds:.3f}s ({count / bulk_seconds:.0f} expenses/s)")
+        self.stdout.write(self.style.SUCCESS(f"speed-up: {single_seconds / bulk_seconds:.1f}x"))
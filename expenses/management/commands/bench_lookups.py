@@ -0,0 +1,72 @@
+import random
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from expenses.benchmarking import api_client, percentile, rolled_back, seed_splits, timed
+from expenses.models import Expense
+
+# The per-user lookup indexes, from 0004_lookup_indexes and
+# 0016_split_created_at, dropped for the "before" run.
+LOOKUP_INDEXES = ['expense_paid_by_created_idx', 'split_user_expense_idx', 'split_user_created_idx']
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a large expense history and report p50/p99 latency of the per-user lookups, "
+        "with the lookup indexes and again with them dropped. Everything is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--splits', type=int, default=1000000)
+        parser.add_argument('--participants', type=int, default=4, help="Splits per seeded expense.")
+        parser.add_argument('--samples', type=int, default=200, help="Requests per endpoint and run.")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+
+        with rolled_back():
+            self.stdout.write(f"seeding {options['splits']} splits for {options['users']} users...")
+            user_ids = seed_splits(options['users'], options['splits'], options['participants'], rng)
+            sample = [rng.choice(user_ids) for _ in range(options['samples'])]
+
+            after = self.measure(sample)
+
+            # plain DROP INDEX: the SQLite schema editor refuses to run inside
+            # the surrounding transaction, but the DDL itself rolls back fine
+            with connection.cursor() as cursor:
+                for name in LOOKUP_INDEXES:
+                    cursor.execute(f"DROP INDEX {connection.ops.quote_name(name)}")
+            before = self.measure(sample)
+
+        self.stdout.write(f"{'endpoint':<36} {'before p50':>11} {'before p99':>11} {'after p50':>10} {'after p99':>10}  (ms)")
+        for name in after:
+            self.stdout.write(
+                f"{name:<36} {percentile(before[name], 0.5):>11.2f} {percentile(before[name], 0.99):>11.2f} "
+                f"{percentile(after[name], 0.5):>10.2f} {percentile(after[name], 0.99):>10.2f}"
+            )
+
+    # the summary cache would serve the "before" run from entries filled
+    # during the "after" run, whatever the indexes
+    @override_settings(USER_SUMMARY_CACHE={'ENABLED': False})
+    def measure(self, user_ids):
+        client = api_client()
+        since = timezone.now() - timedelta(days=30)
+        lookups = {
+            'GET /expenses/user/{id}/': lambda user_id: client.get(reverse('expense-user-expenses', kwargs={'user_id': user_id})),
+            'GET /expenses/user/{id}/overall/': lambda user_id: client.get(reverse('expense-user-overall-expenses', kwargs={'user_id': user_id})),
+            'expenses by paid_by, created_at': lambda user_id: list(
+                Expense.objects.filter(paid_by_id=user_id, created_at__gte=since).order_by('-created_at')[:50]
+            ),
+        }
+
+        results = {}
+        for name, lookup in lookups.items():
+            results[name] = [timed(lookup, user_id)[1] * 1000 for user_id in user_ids]
+        return results
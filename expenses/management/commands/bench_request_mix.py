@@ -0,0 +1,217 @@
+import json
+import random
+import re
+import subprocess
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.benchmarking import api_client, percentile, rolled_back, seed_dataset, zipf_weights
+from expenses.models import Expense, Group, User
+
+DEFAULT_MIX = Path(settings.BASE_DIR) / 'benchmarks' / 'request_mix.jsonl'
+
+# Filled in per request: a member of a group picked by popularity, another
+# member of the same group, the group and any expense.
+PLACEHOLDER = re.compile(r'\{(user|other|group|expense)\}')
+
+
+def fill(template, values):
+    """
+    Substitute the placeholders in a path or JSON body. A string that is
+    only a placeholder becomes the bare id, so bodies keep integer ids.
+    """
+    if isinstance(template, str):
+        whole = PLACEHOLDER.fullmatch(template)
+        if whole:
+            return values[whole.group(1)]
+        return PLACEHOLDER.sub(lambda match: str(values[match.group(1)]), template)
+    if isinstance(template, list):
+        return [fill(item, values) for item in template]
+    if isinstance(template, dict):
+        return {key: fill(value, values) for key, value in template.items()}
+    return template
+
+
+def load_mix(path):
+    """
+    Read a request mix: one JSON object per line with ``method``, ``path``
+    and optionally ``name`` (the endpoint it is reported under, defaults
+    to the path), ``weight`` (default 1) and a JSON ``body``.
+    """
+    try:
+        lines = Path(path).read_text().splitlines()
+    except OSError as exc:
+        raise CommandError(f"Cannot read the request mix: {exc}")
+    mix = []
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+            mix.append({
+                'name': entry.get('name', entry['path']),
+                'method': entry['method'].upper(),
+                'path': entry['path'],
+                'weight': float(entry.get('weight', 1)),
+                'body': entry.get('body'),
+            })
+        except (ValueError, KeyError, TypeError, AttributeError):
+            raise CommandError(f"{path}:{number}: each line needs a JSON object with 'method' and 'path'.")
+    if not mix:
+        raise CommandError(f"{path} holds no requests.")
+    return mix
+
+
+def git_commit():
+    try:
+        result = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=5,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
+
+
+def summarize(samples, errors):
+    """
+    Latency figures of one endpoint in ms. ``throughput_rps`` is how many
+    of its requests one process serves per second of time spent on them.
+    """
+    busy = sum(samples) / 1000
+    return {
+        'count': len(samples),
+        'errors': errors,
+        'throughput_rps': round(len(samples) / busy, 1) if busy else 0.0,
+        'mean_ms': round(sum(samples) / len(samples), 3) if samples else 0.0,
+        'p50_ms': round(percentile(samples, 0.5), 3),
+        'p90_ms': round(percentile(samples, 0.9), 3),
+        'p99_ms': round(percentile(samples, 0.99), 3),
+        'max_ms': round(max(samples, default=0.0), 3),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a weighted request mix (benchmarks/request_mix.jsonl by default) against the API in-process and "
+        "print throughput and latency percentiles per endpoint as JSON. Writes are rolled back afterwards. "
+        "Save the output and pass it as --baseline on another commit to compare."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mix', default=str(DEFAULT_MIX), help="JSONL file with the request mix.")
+        parser.add_argument('--requests', type=int, default=2000, help="Measured requests.")
+        parser.add_argument('--warmup', type=int, default=100, help="Requests sent before measuring.")
+        parser.add_argument('--skew', type=float, default=1.1, help="Zipf exponent for how often each group is hit.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--seed-data', action='store_true',
+            help="Seed a dataset inside the rolled back transaction instead of reading the existing data.",
+        )
+        parser.add_argument('--users', type=int, default=500, help="Users seeded with --seed-data.")
+        parser.add_argument('--groups', type=int, default=100, help="Groups seeded with --seed-data.")
+        parser.add_argument('--expenses', type=int, default=5000, help="Expenses seeded with --seed-data.")
+        parser.add_argument('--output', help="Write the JSON report to this file instead of stdout.")
+        parser.add_argument('--baseline', help="Earlier JSON report to compare against.")
+
+    def handle(self, *args, **options):
+        mix = load_mix(options['mix'])
+        rng = random.Random(options['seed'])
+
+        with rolled_back():
+            if options['seed_data']:
+                seed_dataset(
+                    options['users'], options['groups'], options['expenses'], random.Random(options['seed']),
+                    skew=options['skew'], prefix='bench-mix',
+                )
+            report = self.run_mix(mix, rng, options)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            Path(options['output']).write_text(output + "\n")
+        else:
+            self.stdout.write(output)
+        if options['baseline']:
+            self.compare(report, options['baseline'])
+
+    def run_mix(self, mix, rng, options):
+        members = {}
+        for group_id, user_id in Group.members.through.objects.order_by('group_id', 'user_id').values_list('group_id', 'user_id'):
+            members.setdefault(group_id, []).append(user_id)
+        groups = [group_id for group_id, user_ids in members.items() if len(user_ids) >= 2]
+        expense_ids = list(Expense.objects.order_by('-id').values_list('id', flat=True)[:100000])
+        if not groups or not expense_ids:
+            raise CommandError(
+                "The database needs groups with members and expenses; run seed_expenses first or pass --seed-data."
+            )
+        group_weights = zipf_weights(len(groups), options['skew'])
+        database = {'users': User.objects.count(), 'groups': len(members), 'expenses': Expense.objects.count()}
+
+        def pick():
+            group_id = rng.choices(groups, group_weights)[0]
+            user_id, other_id = rng.sample(members[group_id], 2)
+            return {'user': user_id, 'other': other_id, 'group': group_id, 'expense': rng.choice(expense_ids)}
+
+        client = api_client(User.objects.get(id=members[groups[0]][0]))
+        weights = [entry['weight'] for entry in mix]
+        samples = {entry['name']: [] for entry in mix}
+        errors = dict.fromkeys(samples, 0)
+
+        def send(entry):
+            values = pick()
+            body = fill(entry['body'], values)
+            start = time.perf_counter()
+            response = client.generic(
+                entry['method'], fill(entry['path'], values),
+                json.dumps(body) if body is not None else '', content_type='application/json',
+            )
+            return response.status_code, (time.perf_counter() - start) * 1000
+
+        for entry in rng.choices(mix, weights, k=options['warmup']):
+            send(entry)
+
+        start = time.perf_counter()
+        for entry in rng.choices(mix, weights, k=options['requests']):
+            status_code, elapsed = send(entry)
+            if status_code >= 400:
+                errors[entry['name']] += 1
+            else:
+                samples[entry['name']].append(elapsed)
+        elapsed = time.perf_counter() - start
+
+        return {
+            'commit': git_commit(),
+            'mix': options['mix'],
+            'seed': options['seed'],
+            'requests': options['requests'],
+            'database': database,
+            'elapsed_seconds': round(elapsed, 3),
+            'throughput_rps': round(options['requests'] / elapsed, 1) if elapsed else 0.0,
+            'endpoints': {name: summarize(samples[name], errors[name]) for name in samples},
+        }
+
+    def compare(self, report, path):
+        try:
+            baseline = json.loads(Path(path).read_text())
+        except (OSError, ValueError) as exc:
+            raise CommandError(f"Cannot read the baseline report: {exc}")
+
+        def change(new, old):
+            return f"{(new / old - 1) * 100:+.1f}%" if old else 'n/a'
+
+        self.stderr.write(f"compared with {baseline.get('commit') or path}")
+        self.stderr.write(f"{'endpoint':<40} {'p50':>9} {'p99':>9} {'req/s':>9}")
+        for name, row in report['endpoints'].items():
+            old = baseline.get('endpoints', {}).get(name)
+            if old is None:
+                self.stderr.write(f"{name:<40} {'new':>9}")
+                continue
+            self.stderr.write(
+                f"{name:<40} {change(row['p50_ms'], old['p50_ms']):>9} {change(row['p99_ms'], old['p99_ms']):>9} "
+                f"{change(row['throughput_rps'], old['throughput_rps']):>9}"
+            )
+        self.stderr.write(
+            f"{'overall':<40} {'':>9} {'':>9} {change(report['throughput_rps'], baseline.get('throughput_rps', 0)):>9}"
+        )
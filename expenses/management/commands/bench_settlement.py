@@ -0,0 +1,45 @@
+import random
+
+from django.core.management.base import BaseCommand
+
+from expenses.benchmarking import percentile, timed
+from expenses.settlement import EXACT_MAX_USERS, exact_transfers, greedy_transfers
+
+
+def random_balances(users, rng):
+    """
+    Integer-cent balances for ``users`` users that sum to zero.
+    """
+    balances = {user_id: rng.randint(-500_000, 500_000) for user_id in range(users - 1)}
+    balances[users - 1] = -sum(balances.values())
+    return balances
+
+
+class Command(BaseCommand):
+    help = "Time the settle-up solvers on random balances from 10 to 10,000 users."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000], help="Group sizes to benchmark.")
+        parser.add_argument('--repeat', type=int, default=20, help="Runs per group size.")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+
+        self.stdout.write(f"{'users':>6} {'solver':>7} {'p50 ms':>9} {'p99 ms':>9} {'transfers':>10}")
+        for size in options['sizes']:
+            solvers = [('greedy', greedy_transfers)]
+            if size <= EXACT_MAX_USERS:
+                solvers.append(('exact', exact_transfers))
+
+            for name, solver in solvers:
+                samples = []
+                transfers = 0
+                for _ in range(options['repeat']):
+                    result, seconds = timed(solver, random_balances(size, rng))
+                    samples.append(seconds * 1000)
+                    transfers += len(result)
+                self.stdout.write(
+                    f"{size:>6} {name:>7} {percentile(samples, 0.5):>9.3f} {percentile(samples, 0.99):>9.3f} "
+                    f"{transfers / options['repeat']:>10.1f}"
+                )
@@ -0,0 +1,60 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+from expenses.ledger import check_balances
+from expenses.models import BalanceCheck, LedgerEntry
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute every user's balance from the expense splits and compare it with Balance, reporting or "
+        "repairing the drift. With --incremental only the users whose balance changed since the last check are "
+        "checked, which is cheap enough to run nightly."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true', help="Correct the drifted balances.")
+        parser.add_argument(
+            '--incremental', action='store_true',
+            help="Only check users with ledger entries written since the last check.",
+        )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        with transaction.atomic():
+            previous = BalanceCheck.latest()
+            upto = LedgerEntry.objects.aggregate(last=Max('id'))['last'] or 0
+            user_ids = None
+            if options['incremental']:
+                if previous is None:
+                    self.stdout.write("No earlier check to continue from; checking every user.")
+                else:
+                    # every balance change writes a ledger entry, read here
+                    # by primary key range
+                    user_ids = set(
+                        LedgerEntry.objects.filter(id__gt=previous.last_entry_id, id__lte=upto)
+                        .values_list('user_id', flat=True).iterator()
+                    )
+            corrections, checked = check_balances(user_ids, repair=options['repair'])
+
+            # drift that is only reported keeps the watermark where it was,
+            # so the next incremental check looks at those users again
+            if options['repair'] or not corrections:
+                last_entry_id = upto
+            else:
+                last_entry_id = previous.last_entry_id if previous is not None else 0
+            BalanceCheck.objects.create(
+                last_entry_id=last_entry_id, incremental=user_ids is not None, users_checked=checked,
+                drifted=len(corrections), repaired=options['repair'],
+            )
+        elapsed = time.perf_counter() - start
+
+        for user_id, cents in sorted(corrections.items()):
+            self.stdout.write(f"user {user_id}: {cents:+d} cents")
+        verb = "corrected" if options['repair'] else "drifted"
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(corrections)} of {checked} balances {verb}, checked in {elapsed:.2f}s."
+        ))
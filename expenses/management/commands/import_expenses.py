@@ -0,0 +1,104 @@
+import json
+import os
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.importing import CHUNK_SIZE, FORMATS, READERS, USER_KEYS, InvalidRow, import_records, user_map
+from expenses.models import ImportCheckpoint
+
+# rejected rows listed on stderr before only their number is reported
+SHOWN_REJECTS = 20
+
+
+class Command(BaseCommand):
+    help = (
+        "Import historical expenses from a CSV or NDJSON file, one transaction per chunk. Balances, group "
+        "balances, debts, the ledger and the daily rollups are updated along the way. Progress is checkpointed "
+        "with every chunk, so running the command again on the same file resumes where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import.")
+        parser.add_argument(
+            '--format', choices=FORMATS,
+            help="File format; by default ndjson for .ndjson and .jsonl files and csv otherwise.",
+        )
+        parser.add_argument(
+            '--user-key', choices=USER_KEYS, default='email', help="User field the file refers to users by.",
+        )
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="Expenses written per transaction.")
+        parser.add_argument(
+            '--name', help="Name the checkpoint is kept under; defaults to the file's absolute path.",
+        )
+        parser.add_argument(
+            '--restart', action='store_true',
+            help="Start from the top of the file, ignoring its checkpoint. Rows imported before are imported again.",
+        )
+        parser.add_argument('--strict', action='store_true', help="Stop at the first invalid row instead of skipping it.")
+        parser.add_argument('--rejects', help="Write every skipped row, with the reason, to this NDJSON file.")
+
+    def handle(self, *args, **options):
+        path = Path(options['path']).resolve()
+        file_format = options['format'] or ('ndjson' if path.suffix in ('.ndjson', '.jsonl') else 'csv')
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be positive.")
+        try:
+            stream = open(path, 'rb')
+        except OSError as exc:
+            raise CommandError(f"Cannot read {path}: {exc}")
+
+        checkpoint, _ = ImportCheckpoint.objects.get_or_create(source=options['name'] or str(path))
+        if options['restart']:
+            checkpoint.position = checkpoint.line = checkpoint.imported = checkpoint.rejected = 0
+            checkpoint.save()
+        if checkpoint.position > os.fstat(stream.fileno()).st_size:
+            raise CommandError(f"{path} is shorter than its checkpoint; pass --restart if the file was replaced.")
+        if checkpoint.position:
+            self.stdout.write(f"Resuming after line {checkpoint.line} ({checkpoint.imported} expenses imported).")
+
+        rejects = open(options['rejects'], 'a') if options['rejects'] else None
+        shown = 0
+        start = time.perf_counter()
+        imported_before = checkpoint.imported
+
+        def on_reject(line, error):
+            nonlocal shown
+            if rejects:
+                rejects.write(json.dumps({'line': line, 'error': error}) + "\n")
+            if shown < SHOWN_REJECTS:
+                self.stderr.write(f"line {line}: {error}")
+            shown += 1
+
+        def on_chunk(checkpoint):
+            seconds = time.perf_counter() - start
+            rate = (checkpoint.imported - imported_before) / seconds if seconds else 0
+            self.stdout.write(
+                f"line {checkpoint.line}: {checkpoint.imported} imported, {checkpoint.rejected} rejected "
+                f"({rate:.0f} expenses/s)"
+            )
+
+        try:
+            with stream:
+                records = READERS[file_format](stream, checkpoint.position, checkpoint.line)
+                import_records(
+                    records, checkpoint, user_map(options['user_key']), options['chunk_size'],
+                    strict=options['strict'], on_reject=on_reject, on_chunk=on_chunk,
+                )
+        except InvalidRow as exc:
+            raise CommandError(f"{exc}. Fix the row and run the command again to resume.")
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        finally:
+            if rejects:
+                rejects.close()
+
+        seconds = time.perf_counter() - start
+        imported = checkpoint.imported - imported_before
+        if shown > SHOWN_REJECTS:
+            self.stderr.write(f"... and {shown - SHOWN_REJECTS} more rejected rows.")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {imported} expenses in {seconds:.1f}s ({imported / seconds if seconds else 0:.0f} expenses/s); "
+            f"{shown} rows rejected."
+        ))
@@ -0,0 +1,21 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from expenses.idempotency import get_config
+from expenses.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = "Delete idempotency keys older than the IDEMPOTENCY_KEYS TTL."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl', type=int, help="Override the TTL, in seconds.")
+
+    def handle(self, *args, **options):
+        ttl = options['ttl'] if options['ttl'] is not None else get_config()['TTL']
+        cutoff = timezone.now() - timedelta(seconds=ttl)
+        # a single DELETE over the created_at index
+        deleted, _ = IdempotencyKey.objects.filter(created_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f"Pruned {deleted} idempotency keys older than {ttl}s."))
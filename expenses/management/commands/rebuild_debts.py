@@ -0,0 +1,46 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from expenses.models import ExpenseSplit, PairwiseDebt
+from expenses.money import to_cents
+
+
+class Command(BaseCommand):
+    help = "Rebuild the pairwise debt table from ExpenseSplit, streaming the splits in chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help="Rows fetched per round trip and inserted per batch.")
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+
+        # the read and the rewrite share one transaction, which holds the
+        # write lock from its start (IMMEDIATE on SQLite), so no expense
+        # written meanwhile can be added to the old table and then wiped
+        with transaction.atomic():
+            PairwiseDebt.objects.all().delete()
+
+            # only the running total per pair is kept in memory, never the splits
+            totals = defaultdict(int)
+            splits = ExpenseSplit.objects.values_list('user_id', 'expense__paid_by_id', 'amount_owed').order_by()
+            count = 0
+            for user_id, paid_by_id, amount_owed in splits.iterator(chunk_size=chunk_size):
+                if user_id < paid_by_id:
+                    totals[(user_id, paid_by_id)] += to_cents(amount_owed)
+                elif user_id > paid_by_id:
+                    totals[(paid_by_id, user_id)] -= to_cents(amount_owed)
+                count += 1
+                if count % chunk_size == 0:
+                    self.stdout.write(f"read {count} splits")
+
+            PairwiseDebt.objects.bulk_create(
+                (
+                    PairwiseDebt(user_a_id=user_a_id, user_b_id=user_b_id, amount_cents=cents)
+                    for (user_a_id, user_b_id), cents in totals.items() if cents
+                ),
+                batch_size=chunk_size,
+            )
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(totals)} pairwise debts from {count} splits."))
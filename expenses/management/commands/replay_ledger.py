@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from expenses.ledger import replay_balances, take_snapshot
+
+
+class Command(BaseCommand):
+    help = "Rebuild Balance from the latest snapshot plus the ledger entries written after it."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Report the drifted balances without fixing them.")
+        parser.add_argument('--snapshot', action='store_true', help="Store a new snapshot after the replay.")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        with transaction.atomic():
+            corrections = replay_balances(dry_run=options['dry_run'])
+            if options['snapshot'] and not options['dry_run']:
+                take_snapshot()
+        elapsed = time.perf_counter() - start
+
+        for user_id, cents in sorted(corrections.items()):
+            self.stdout.write(f"user {user_id}: {cents:+d} cents")
+        verb = "drifted" if options['dry_run'] else "corrected"
+        self.stdout.write(self.style.SUCCESS(f"{len(corrections)} balances {verb}, replayed in {elapsed:.2f}s."))
@@ -0,0 +1,34 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from expenses.recurring import materialize_due
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the expenses of every recurring expense that is due, in batches of one transaction each. "
+        "Run it periodically, e.g. every few minutes from cron; an interrupted run is safe to repeat."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=100, help="Recurring expenses handled per transaction.")
+        parser.add_argument(
+            '--max-per-template', type=int, default=12,
+            help="Occurrences of one recurring expense created per batch when it is far behind.",
+        )
+        parser.add_argument('--until', help="Materialize occurrences due by this ISO time instead of now.")
+
+    def handle(self, *args, **options):
+        until = None
+        if options['until']:
+            try:
+                until = datetime.fromisoformat(options['until'])
+            except ValueError:
+                raise CommandError("--until must be an ISO date and time.")
+            if timezone.is_naive(until):
+                until = timezone.make_aware(until)
+
+        created, batches = materialize_due(until, options['batch'], options['max_per_template'])
+        self.stdout.write(self.style.SUCCESS(f"Created {created} expenses in {batches} batches."))
@@ -0,0 +1,113 @@
+import multiprocessing
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from expenses.report_jobs import claim_jobs, fail_job, heartbeat, prune_jobs, recover_stale_jobs, run_job
+from expenses.worker import init_worker_process, render_job
+
+# seconds between two rounds of stale job recovery and pruning
+HOUSEKEEPING_INTERVAL = 60
+
+
+class Command(BaseCommand):
+    help = "Render queued report jobs with a local process pool."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=2, help="Worker processes; 0 renders in this process.")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds to wait when the queue is empty.")
+        parser.add_argument('--stale-after', type=int, default=600,
+                            help="Requeue running jobs whose worker has not reported for this many seconds.")
+        parser.add_argument('--keep-days', type=int, default=7, help="Delete finished jobs and their files after this many days.")
+        parser.add_argument('--once', action='store_true', help="Drain the queue and exit instead of polling forever.")
+
+    def handle(self, *args, **options):
+        self.last_housekeeping = None
+
+        if options['processes'] == 0:
+            self.run_inline(options)
+            return
+
+        # spawned workers set Django up themselves and open their own
+        # database connections instead of inheriting ours
+        connections.close_all()
+        context = multiprocessing.get_context('spawn')
+        pool = None
+        running = {}
+        try:
+            while True:
+                self.housekeeping(options)
+                if pool is None:
+                    pool = ProcessPoolExecutor(options['processes'], mp_context=context, initializer=init_worker_process)
+
+                for job_id in claim_jobs(options['processes'] - len(running)):
+                    try:
+                        running[pool.submit(render_job, job_id)] = job_id
+                    except BrokenProcessPool:
+                        self.fail(job_id)
+
+                if not running:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                done, _ = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                broken = False
+                for future in done:
+                    job_id = running.pop(future)
+                    try:
+                        self.report(*future.result())
+                    except Exception as exc:
+                        broken = broken or isinstance(exc, BrokenProcessPool)
+                        self.fail(job_id)
+                heartbeat(list(running.values()))
+
+                if broken:
+                    # a worker process died; the pool refuses new work, so
+                    # start over with a fresh one
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool = None
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    def run_inline(self, options):
+        while True:
+            self.housekeeping(options)
+            claimed = claim_jobs(1)
+            if not claimed:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+            self.report(*run_job(claimed[0]))
+
+    def housekeeping(self, options):
+        """
+        Requeue the jobs of workers that stopped reporting and prune old
+        jobs, at most once every HOUSEKEEPING_INTERVAL seconds.
+        """
+        now = time.monotonic()
+        if self.last_housekeeping is not None and now - self.last_housekeeping < HOUSEKEEPING_INTERVAL:
+            return
+        self.last_housekeeping = now
+
+        requeued = recover_stale_jobs(timedelta(seconds=options['stale_after']))
+        if requeued:
+            self.stdout.write(f"requeued {requeued} stale jobs")
+        pruned = prune_jobs(timedelta(days=options['keep_days']))
+        if pruned:
+            self.stdout.write(f"pruned {pruned} finished jobs")
+
+    def fail(self, job_id):
+        fail_job(job_id, traceback.format_exc())
+        self.report(job_id, 'failed')
+
+    def report(self, job_id, outcome):
+        self.stdout.write(f"job {job_id}: {outcome}")
@@ -0,0 +1,45 @@
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.benchmarking import seed_dataset, timed
+from expenses.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the database with synthetic users, groups and expenses for benchmarks and load tests. "
+        "Expenses are written through the regular split engine, so balances, debts, the ledger and the "
+        "daily rollups are all consistent. The same --seed always produces the same data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=200)
+        parser.add_argument('--expenses', type=int, default=20000)
+        parser.add_argument('--group-size', type=int, default=6, help="Average members per group.")
+        parser.add_argument(
+            '--skew', type=float, default=1.1,
+            help="Zipf exponent for how activity is spread over users and groups; 0 spreads it evenly.",
+        )
+        parser.add_argument('--days', type=int, default=90, help="Expenses are spread over this many past days.")
+        parser.add_argument('--batch', type=int, default=500, help="Expenses written per transaction.")
+        parser.add_argument('--prefix', default='seed', help="Prefix of the generated usernames.")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['users'] < 2 or options['groups'] < 1:
+            raise CommandError("Seeding needs at least 2 users and 1 group.")
+        if User.objects.filter(username__startswith=f"{options['prefix']}-").exists():
+            raise CommandError(f"Users prefixed '{options['prefix']}-' already exist; pass another --prefix.")
+
+        (user_ids, group_members), seconds = timed(
+            seed_dataset,
+            options['users'], options['groups'], options['expenses'], random.Random(options['seed']),
+            skew=options['skew'], group_size=options['group_size'], days=options['days'],
+            batch_size=options['batch'], prefix=options['prefix'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {len(user_ids)} users, {len(group_members)} groups and {options['expenses']} expenses "
+            f"in {seconds:.1f}s."
+        ))
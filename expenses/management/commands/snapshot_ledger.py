@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from expenses.ledger import take_snapshot
+from expenses.models import BalanceSnapshot
+
+
+class Command(BaseCommand):
+    help = "Store the ledger balances as a snapshot so replays only read the entries after it. Meant to run periodically."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep', type=int, default=3, help="Number of most recent snapshots to keep; 0 keeps all.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            snapshot = take_snapshot()
+            pruned = 0
+            if options['keep'] > 0:
+                stale = BalanceSnapshot.objects.order_by('-last_entry_id', '-id').values_list('id', flat=True)[options['keep']:]
+                pruned, _ = BalanceSnapshot.objects.filter(id__in=list(stale)).delete()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Snapshot {snapshot.id} covers ledger entries up to {snapshot.last_entry_id} "
+            f"({snapshot.rows.count()} users); {pruned} rows of older snapshots pruned."
+        ))
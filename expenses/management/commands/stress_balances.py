@@ -0,0 +1,105 @@
+import multiprocessing
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.models import Sum
+
+from expenses.ledger import stored_owed
+from expenses.models import Balance, Expense, LedgerEntry, User
+from expenses.worker import create_expenses, init_worker_process
+
+
+class Command(BaseCommand):
+    help = (
+        "Create expenses from several processes at once among a small set of users, so every write contends "
+        "for the same balance rows, then check that no update was lost. The users and their expenses are "
+        "deleted afterwards unless --keep is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=4)
+        parser.add_argument('--expenses', type=int, default=2000, help="Expenses created in total.")
+        parser.add_argument('--users', type=int, default=5)
+        parser.add_argument('--batch', type=int, default=50, help="Expenses per task handed to a process.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--keep', action='store_true', help="Keep the created users and expenses.")
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            raise CommandError("Worker processes cannot share an in-memory SQLite database.")
+
+        rng = random.Random(options['seed'])
+        prefix = f'stress-{rng.getrandbits(32):08x}'
+        users = User.objects.bulk_create([
+            User(username=f'{prefix}-{i}', email=f'{prefix}-{i}@example.com', mobile_number=str(i))
+            for i in range(options['users'])
+        ])
+        user_ids = [user.id for user in users]
+
+        payloads = []
+        for i in range(options['expenses']):
+            participants = rng.sample(user_ids, rng.randint(2, len(user_ids)))
+            payloads.append({
+                'creator': participants[0],
+                'paid_by': rng.choice(participants),
+                'participants': participants,
+                'total_amount': f'{rng.randint(1, 50000) / 100:.2f}',
+                'description': f'{prefix} expense {i}',
+                'split_method': 'equal',
+            })
+        tasks = [payloads[start:start + options['batch']] for start in range(0, len(payloads), options['batch'])]
+
+        try:
+            # children open their own connections
+            connections.close_all()
+            context = multiprocessing.get_context('spawn')
+            start = time.perf_counter()
+            with ProcessPoolExecutor(
+                options['processes'], mp_context=context,
+                initializer=init_worker_process, initargs=(str(connection.settings_dict['NAME']),),
+            ) as pool:
+                created = sum(pool.map(create_expenses, tasks))
+            elapsed = time.perf_counter() - start
+
+            errors = self.verify(user_ids)
+        finally:
+            if not options['keep']:
+                User.objects.filter(id__in=user_ids).delete()
+
+        self.stdout.write(
+            f"{created} expenses from {options['processes']} processes in {elapsed:.2f}s "
+            f"({created / elapsed:.0f} expenses/s)"
+        )
+        if errors:
+            raise CommandError("; ".join(errors))
+        self.stdout.write(self.style.SUCCESS("Balances are consistent: total is zero and no update was lost."))
+
+    def verify(self, user_ids):
+        errors = []
+        balances = dict(Balance.objects.filter(user_id__in=user_ids).values_list('user_id', 'balance_cents'))
+        if sum(balances.values()) != 0:
+            errors.append(f"balances add up to {sum(balances.values())} cents instead of zero")
+
+        # what every balance should be according to the splits
+        expected = dict.fromkeys(user_ids, 0)
+        expenses = list(Expense.objects.filter(paid_by_id__in=user_ids).only('id', 'paid_by_id'))
+        for start in range(0, len(expenses), 500):
+            chunk = expenses[start:start + 500]
+            owed = stored_owed(chunk)
+            for expense in chunk:
+                for user_id, cents in owed[expense.id].items():
+                    expected[user_id] -= cents
+                    expected[expense.paid_by_id] += cents
+        logged = dict(
+            LedgerEntry.objects.filter(user_id__in=user_ids).values('user_id')
+            .annotate(total=Sum('amount_cents')).values_list('user_id', 'total')
+        )
+        for user_id in user_ids:
+            if balances.get(user_id, 0) != expected[user_id]:
+                errors.append(f"user {user_id} has {balances.get(user_id, 0)} cents, splits say {expected[user_id]}")
+            if logged.get(user_id, 0) != expected[user_id]:
+                errors.append(f"user {user_id} has {logged.get(user_id, 0)} cents in the ledger, splits say {expected[user_id]}")
+        return errors
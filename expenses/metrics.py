@@ -0,0 +1,272 @@
+"""
+Per-request query and timing instrumentation.
+
+``RequestMetricsMiddleware`` records for every request the number of SQL
+queries, the time spent in the database, the time spent rendering the
+response body and the total latency. It reports them to the client in a
+``Server-Timing`` header and accumulates them per view in a process-local
+registry that ``metrics_view`` exposes in the Prometheus text format.
+
+Queries are counted by an execute wrapper installed on every database
+connection. It finds the current request's stats through a context
+variable, so queries made by async views from their worker threads count
+too. Everything is opt-in::
+
+    REQUEST_METRICS = {
+        'ENABLED': True,
+        'SERVER_TIMING': True,
+        'BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    }
+
+When disabled the middleware removes itself at startup and ``/metrics``
+answers 404, so it costs nothing.
+"""
+import bisect
+import contextvars
+import threading
+import time
+from collections import defaultdict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse
+
+DEFAULTS = {
+    'ENABLED': False,
+    'SERVER_TIMING': True,
+    'BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+}
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'REQUEST_METRICS', {})}
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db_time', 'render_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+
+
+def record_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_time += time.perf_counter() - start
+        stats.queries += 1
+
+
+def _install_on(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def install_query_recorder():
+    """
+    Count queries on every connection, including those already open.
+    """
+    connection_created.connect(_install_on, dispatch_uid='expenses.metrics')
+    for connection in connections.all(initialized_only=True):
+        _install_on(connection)
+
+
+class Counter:
+    """
+    Monotonic counter with a fixed set of label names.
+    """
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.values = defaultdict(float)
+
+    def inc(self, *label_values, amount=1):
+        with registry.lock:
+            self.values[label_values] += amount
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} counter"
+        for label_values, value in sorted(self.values.items()):
+            yield f"{self.name}{_labels(self.label_names, label_values)} {_number(value)}"
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket..., +Inf count, sum]
+        self.values = {}
+
+    def observe(self, value, *label_values):
+        with registry.lock:
+            row = self.values.get(label_values)
+            if row is None:
+                row = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            row[bisect.bisect_left(self.buckets, value)] += 1
+            row[-1] += value
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} histogram"
+        for label_values, row in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), row):
+                cumulative += count
+                labels = _labels(self.label_names + ('le',), label_values + (_number(bound) if bound != '+Inf' else bound,))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.label_names, label_values)} {_number(row[-1])}"
+            yield f"{self.name}_count{_labels(self.label_names, label_values)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def counter(self, name, help_text, label_names=()):
+        """
+        The counter called ``name``, created on first use.
+        """
+        if name not in self.metrics:
+            self.metrics[name] = Counter(name, help_text, label_names)
+        return self.metrics[name]
+
+    def histogram(self, name, help_text, label_names, buckets):
+        if name not in self.metrics:
+            self.metrics[name] = Histogram(name, help_text, label_names, buckets)
+        return self.metrics[name]
+
+    def render(self):
+        with self.lock:
+            lines = [line for metric in self.metrics.values() for line in metric.collect()]
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self.lock:
+            self.metrics.clear()
+
+
+registry = Registry()
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def observe_request(request, response, stats, duration):
+    match = request.resolver_match
+    view = match.view_name if match is not None else 'unmatched'
+    method = request.method
+    registry.counter(
+        'http_requests_total', "Requests handled, by view, method and status.", ('view', 'method', 'status'),
+    ).inc(view, method, str(response.status_code))
+    registry.histogram(
+        'http_request_duration_seconds', "Total request latency.", ('view', 'method'), get_config()['BUCKETS'],
+    ).observe(duration, view, method)
+    registry.counter(
+        'http_request_db_queries_total', "SQL queries issued while handling requests.", ('view', 'method'),
+    ).inc(view, method, amount=stats.queries)
+    registry.counter(
+        'http_request_db_seconds_total', "Time spent in the database while handling requests.", ('view', 'method'),
+    ).inc(view, method, amount=stats.db_time)
+    registry.counter(
+        'http_request_render_seconds_total', "Time spent rendering response bodies.", ('view', 'method'),
+    ).inc(view, method, amount=stats.render_time)
+
+
+class RequestMetricsMiddleware:
+    """
+    Opt-in request instrumentation, see the module docstring.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = get_config()
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.server_timing = config['SERVER_TIMING']
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        install_query_recorder()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, stats, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, stats, time.perf_counter() - start)
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns; time that part
+        stats = _current.get()
+        if stats is not None:
+            start = time.perf_counter()
+
+            def rendered(response):
+                stats.render_time += time.perf_counter() - start
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def finish(self, request, response, stats, duration):
+        observe_request(request, response, stats, duration)
+        if self.server_timing:
+            response['Server-Timing'] = (
+                f'db;dur={stats.db_time * 1000:.2f};desc="{stats.queries} queries", '
+                f'render;dur={stats.render_time * 1000:.2f}, '
+                f'total;dur={duration * 1000:.2f}'
+            )
+        return response
+
+
+def metrics_view(request):
+    """
+    The accumulated metrics of this process in the Prometheus text format.
+    """
+    if not get_config()['ENABLED']:
+        raise Http404
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,66 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import migrations, models
+
+
+def to_cents(value):
+    return int(Decimal(str(value)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP) * 100)
+
+
+def forwards(apps, schema_editor):
+    Balance = apps.get_model('expenses', 'Balance')
+    PairwiseDebt = apps.get_model('expenses', 'PairwiseDebt')
+
+    balances = list(Balance.objects.only('id', 'balance'))
+    for balance in balances:
+        balance.balance_cents = to_cents(balance.balance)
+    Balance.objects.bulk_update(balances, ['balance_cents'], batch_size=500)
+
+    debts = list(PairwiseDebt.objects.only('id', 'amount'))
+    for debt in debts:
+        debt.amount_cents = to_cents(debt.amount)
+    PairwiseDebt.objects.bulk_update(debts, ['amount_cents'], batch_size=500)
+
+
+def backwards(apps, schema_editor):
+    Balance = apps.get_model('expenses', 'Balance')
+    PairwiseDebt = apps.get_model('expenses', 'PairwiseDebt')
+
+    balances = list(Balance.objects.only('id', 'balance_cents'))
+    for balance in balances:
+        balance.balance = balance.balance_cents / 100
+    Balance.objects.bulk_update(balances, ['balance'], batch_size=500)
+
+    debts = list(PairwiseDebt.objects.only('id', 'amount_cents'))
+    for debt in debts:
+        debt.amount = Decimal(debt.amount_cents) / 100
+    PairwiseDebt.objects.bulk_update(debts, ['amount'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0002_pairwise_debt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='balance',
+            name='balance_cents',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='pairwisedebt',
+            name='amount_cents',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(forwards, backwards),
+        migrations.RemoveField(
+            model_name='balance',
+            name='balance',
+        ),
+        migrations.RemoveField(
+            model_name='pairwisedebt',
+            name='amount',
+        ),
+    ]
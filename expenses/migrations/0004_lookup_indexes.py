@@ -0,0 +1,43 @@
+# Generated by Django 5.1.2 on 2026-10-18 13:08
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_balances(apps, schema_editor):
+    """
+    Fold duplicate balance rows of a user into the oldest one so that the
+    unique constraint can be added.
+    """
+    Balance = apps.get_model('expenses', 'Balance')
+    duplicates = (
+        Balance.objects.values('user_id')
+        .annotate(rows=Count('id'), keep=Min('id'), total=Sum('balance_cents'))
+        .filter(rows__gt=1)
+    )
+    for duplicate in duplicates:
+        Balance.objects.filter(id=duplicate['keep']).update(balance_cents=duplicate['total'])
+        Balance.objects.filter(user_id=duplicate['user_id']).exclude(id=duplicate['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0003_integer_cent_balances'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['paid_by', 'created_at'], name='expense_paid_by_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expensesplit',
+            index=models.Index(fields=['user', 'expense', 'amount_owed'], name='split_user_expense_idx'),
+        ),
+        migrations.RunPython(merge_duplicate_balances, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='balance',
+            constraint=models.UniqueConstraint(fields=('user',), name='unique_balance_user'),
+        ),
+    ]
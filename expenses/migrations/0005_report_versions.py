@@ -0,0 +1,30 @@
+# Generated by Django 5.1.2 on 2026-10-18 13:13
+
+from django.db import migrations, models
+
+
+def create_ledger_state(apps, schema_editor):
+    apps.get_model('expenses', 'LedgerState').objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0004_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.RunPython(create_ledger_state, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,101 @@
+# Generated by Django 5.1.2 on 2026-10-18 13:16
+
+from collections import defaultdict
+from decimal import ROUND_HALF_UP, Decimal
+
+import django.db.models.deletion
+import expenses.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+def to_cents(amount):
+    return int(Decimal(amount).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP) * 100)
+
+
+def assign_default_group(apps, schema_editor):
+    """
+    Move every existing expense into the default group, make its participants
+    members and rebuild the default group's balances from the splits.
+    """
+    Group = apps.get_model('expenses', 'Group')
+    Expense = apps.get_model('expenses', 'Expense')
+    ExpenseSplit = apps.get_model('expenses', 'ExpenseSplit')
+    GroupBalance = apps.get_model('expenses', 'GroupBalance')
+
+    if not Expense.objects.exists():
+        return
+
+    group, _ = Group.objects.get_or_create(is_default=True, defaults={'name': 'Default'})
+    Expense.objects.update(group=group)
+
+    Member = Group.members.through
+    member_ids = Expense.participants.through.objects.values_list('user_id', flat=True).distinct()
+    Member.objects.bulk_create(
+        [Member(group_id=group.id, user_id=user_id) for user_id in member_ids.iterator()],
+        batch_size=500,
+    )
+
+    balances = defaultdict(int)
+    splits = ExpenseSplit.objects.values_list('user_id', 'expense__paid_by_id', 'amount_owed')
+    for user_id, paid_by_id, amount_owed in splits.iterator(chunk_size=2000):
+        if user_id == paid_by_id:
+            continue
+        cents = to_cents(amount_owed)
+        balances[user_id] -= cents
+        balances[paid_by_id] += cents
+    GroupBalance.objects.bulk_create(
+        [GroupBalance(group_id=group.id, user_id=user_id, balance_cents=cents) for user_id, cents in balances.items()],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0006_report_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Group',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('is_default', models.BooleanField(default=False, editable=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('members', models.ManyToManyField(blank=True, related_name='expense_groups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(condition=models.Q(('is_default', True)), fields=('is_default',), name='single_default_group')],
+            },
+        ),
+        migrations.CreateModel(
+            name='GroupBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance_cents', models.BigIntegerField(default=0)),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balances', to='expenses.group')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='group_balances', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('group', 'user'), name='unique_group_balance')],
+            },
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='group',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='expenses', to='expenses.group'),
+        ),
+        migrations.RunPython(assign_default_group, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='expense',
+            name='group',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='expenses', to='expenses.group'),
+        ),
+        migrations.AlterField(
+            model_name='expense',
+            name='group',
+            field=models.ForeignKey(default=expenses.models.default_group_id, on_delete=django.db.models.deletion.PROTECT, related_name='expenses', to='expenses.group'),
+        ),
+    ]
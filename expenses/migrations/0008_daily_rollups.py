@@ -0,0 +1,31 @@
+# Generated by Django 5.1.2 on 2026-10-18 13:22
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0007_groups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('paid_cents', models.BigIntegerField(default=0)),
+                ('owed_cents', models.BigIntegerField(default=0)),
+                ('equal_owed_cents', models.BigIntegerField(default=0)),
+                ('exact_owed_cents', models.BigIntegerField(default=0)),
+                ('percentage_owed_cents', models.BigIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'day'), name='unique_daily_rollup')],
+            },
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.1.2 on 2026-10-18 13:23
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def snapshot_existing_balances(apps, schema_editor):
+    """
+    Balances written before the ledger existed have no entries, so record
+    them as the baseline snapshot the ledger starts from.
+    """
+    Balance = apps.get_model('expenses', 'Balance')
+    BalanceSnapshot = apps.get_model('expenses', 'BalanceSnapshot')
+    BalanceSnapshotRow = apps.get_model('expenses', 'BalanceSnapshotRow')
+
+    if not Balance.objects.exists():
+        return
+    snapshot = BalanceSnapshot.objects.create(last_entry_id=0)
+    BalanceSnapshotRow.objects.bulk_create(
+        (
+            BalanceSnapshotRow(snapshot_id=snapshot.id, user_id=user_id, balance_cents=cents)
+            for user_id, cents in Balance.objects.values_list('user_id', 'balance_cents').iterator()
+        ),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0008_daily_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_entry_id', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BalanceSnapshotRow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance_cents', models.BigIntegerField()),
+                ('snapshot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rows', to='expenses.balancesnapshot')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount_cents', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expense', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='ledger_entries', to='expenses.expense')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(snapshot_existing_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.2 on 2026-10-18 14:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0012_import_checkpoints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceCheck',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_entry_id', models.BigIntegerField()),
+                ('incremental', models.BooleanField(default=False)),
+                ('users_checked', models.BigIntegerField(default=0)),
+                ('drifted', models.BigIntegerField(default=0)),
+                ('repaired', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
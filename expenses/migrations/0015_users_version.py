@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 14:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0014_ledger_corrections'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ledgerstate',
+            name='users_version',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
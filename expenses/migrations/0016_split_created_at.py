@@ -0,0 +1,36 @@
+# Generated by Django 5.1.2 on 2026-10-18 14:56
+
+from django.db import migrations, models
+
+
+def copy_expense_dates(apps, schema_editor):
+    ExpenseSplit = apps.get_model('expenses', 'ExpenseSplit')
+    Expense = apps.get_model('expenses', 'Expense')
+    ExpenseSplit.objects.update(
+        created_at=models.Subquery(Expense.objects.filter(id=models.OuterRef('expense_id')).values('created_at')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0015_users_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expensesplit',
+            name='created_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(copy_expense_dates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='expensesplit',
+            name='created_at',
+            field=models.DateTimeField(),
+        ),
+        migrations.AddIndex(
+            model_name='expensesplit',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='split_user_created_idx'),
+        ),
+    ]
@@ -1,11 +1,36 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
+from .money import from_cents
 
 # User Model
 class User(AbstractUser):
     email = models.EmailField(unique=True)
     mobile_number = models.CharField(max_length=15)
 
+# Group Model
+class Group(models.Model):
+    """
+    A circle of users sharing expenses. Expenses created without a group go
+    to the single group flagged ``is_default``.
+    """
+    name = models.CharField(max_length=100)
+    members = models.ManyToManyField(User, related_name='expense_groups', blank=True)
+    is_default = models.BooleanField(default=False, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['is_default'], condition=models.Q(is_default=True), name='single_default_group'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+def default_group_id():
+    group, _ = Group.objects.get_or_create(is_default=True, defaults={'name': 'Default'})
+    return group.pk
+
 # Expense Model
 class Expense(models.Model):
     SPLIT_METHODS = [
@@ -17,21 +42,334 @@ class Expense(models.Model):
     creator = models.ForeignKey(User, on_delete=models.CASCADE, related_name='created_expenses')
     paid_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='paid_expenses')
     participants = models.ManyToManyField(User, related_name='participated_expenses')
+    group = models.ForeignKey(Group, on_delete=models.PROTECT, related_name='expenses', default=default_group_id)
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
     description = models.CharField(max_length=255)
     split_method = models.CharField(max_length=20, choices=SPLIT_METHODS)
     created_at = models.DateTimeField(auto_now_add=True)
+    # bumped whenever the expense or its splits change; part of the report cache key
+    version = models.PositiveIntegerField(default=1, editable=False)
+    # set on expenses materialized from a recurring expense, see expenses/recurring.py
+    recurrence = models.ForeignKey('RecurringExpense', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='occurrences')
+    occurrence_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['paid_by', 'created_at'], name='expense_paid_by_created_idx'),
+        ]
+        constraints = [
+            # an occurrence is materialized at most once, even by a scheduler re-run
+            models.UniqueConstraint(fields=['recurrence', 'occurrence_at'], name='unique_recurrence_occurrence'),
+        ]
 
 #Expense Split Model
 class ExpenseSplit(models.Model):
     expense = models.ForeignKey(Expense, on_delete=models.CASCADE, related_name='splits')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     amount_owed = models.DecimalField(max_digits=10, decimal_places=2)
+    # copy of the expense's created_at, so a user's splits are paged newest
+    # first straight from split_user_created_idx without joining the expenses
+    created_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # covers the per-user lookups: filter on user, join on expense
+            # and sum amount_owed without touching the table
+            models.Index(fields=['user', 'expense', 'amount_owed'], name='split_user_expense_idx'),
+            models.Index(fields=['user', 'created_at', 'id'], name='split_user_created_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.created_at is None:
+            self.created_at = self.expense.created_at
+        super().save(*args, **kwargs)
 
 # Balance Model
 class Balance(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    balance = models.FloatField(default=0.0)
+    # kept in whole cents so that sums are exact
+    balance_cents = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user'], name='unique_balance_user'),
+        ]
+
+    @property
+    def balance(self):
+        return from_cents(self.balance_cents)
+
+    def __str__(self):
+        return f"{self.user.username}'s balance: {self.balance}"
+
+# Group Balance Model
+class GroupBalance(models.Model):
+    """
+    A user's balance within one group, maintained alongside the global
+    ``Balance`` so a group's balances are read without scanning expenses.
+    """
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='balances')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='group_balances')
+    balance_cents = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['group', 'user'], name='unique_group_balance'),
+        ]
+
+    @property
+    def balance(self):
+        return from_cents(self.balance_cents)
+
+
+# Daily Rollup Model
+class DailyRollup(models.Model):
+    """
+    A user's totals for one day, maintained on every expense write so that
+    analytics over a date range read one row per day instead of every split.
+    ``paid_cents`` is what the user paid for expenses, ``owed_cents`` what
+    they owe to other payers, broken down by split method in the other
+    columns.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_rollups')
+    day = models.DateField()
+    paid_cents = models.BigIntegerField(default=0)
+    owed_cents = models.BigIntegerField(default=0)
+    equal_owed_cents = models.BigIntegerField(default=0)
+    exact_owed_cents = models.BigIntegerField(default=0)
+    percentage_owed_cents = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # also the index behind the per-user date range reads
+            models.UniqueConstraint(fields=['user', 'day'], name='unique_daily_rollup'),
+        ]
+
+
+# Pairwise Debt Model
+class PairwiseDebt(models.Model):
+    """
+    Net amount owed between two users, maintained alongside ``Balance``.
+
+    Each pair is stored once with ``user_a_id < user_b_id``. A positive
+    ``amount_cents`` means ``user_a`` owes ``user_b``, a negative one means
+    ``user_b`` owes ``user_a``.
+    """
+    user_a = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    user_b = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    amount_cents = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_a', 'user_b'], name='unique_pairwise_debt'),
+        ]
+
+    @property
+    def debtor_id(self):
+        return self.user_a_id if self.amount_cents >= 0 else self.user_b_id
+
+    @property
+    def creditor_id(self):
+        return self.user_b_id if self.amount_cents >= 0 else self.user_a_id
 
     def __str__(self):
-        return f"{self.user.username}'s balance: {self.balance}"
\ No newline at end of file
+        return f"{self.debtor_id} owes {self.creditor_id}: {from_cents(abs(self.amount_cents))}"
+
+
+# Ledger State Model
+class LedgerState(models.Model):
+    """
+    Single row holding a version number that is bumped by every write that
+    moves balances, and one bumped by every change to a user's profile.
+    Cached reports built from the balances are keyed by both.
+    """
+    version = models.BigIntegerField(default=0)
+    users_version = models.BigIntegerField(default=0)
+
+    @classmethod
+    def current_version(cls):
+        return cls.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+
+    @classmethod
+    def current_versions(cls):
+        """
+        ``(version, users_version)``.
+        """
+        return cls.objects.filter(pk=1).values_list('version', 'users_version').first() or (0, 0)
+
+    @classmethod
+    def bump(cls):
+        if not cls.objects.filter(pk=1).update(version=models.F('version') + 1):
+            cls.objects.get_or_create(pk=1, defaults={'version': 1})
+
+    @classmethod
+    def bump_users(cls):
+        if not cls.objects.filter(pk=1).update(users_version=models.F('users_version') + 1):
+            cls.objects.get_or_create(pk=1, defaults={'users_version': 1})
+
+
+# Ledger Entry Model
+class LedgerEntry(models.Model):
+    """
+    Append-only log of every balance change. ``Balance`` holds the running
+    sum of these rows per user and can be rebuilt from them with the
+    ``replay_ledger`` command. Rows are never updated or deleted; an undone
+    change is recorded as a new entry with the opposite amount.
+    """
+    # a plain reference: the entries outlive the expense they came from.
+    # Corrections written by ``check_balances --repair`` have no expense.
+    expense = models.ForeignKey(
+        Expense, on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='ledger_entries',
+    )
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='ledger_entries')
+    amount_cents = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+# Balance Snapshot Model
+class BalanceSnapshot(models.Model):
+    """
+    Every user's balance once all ledger entries up to ``last_entry_id`` are
+    applied, so a replay only has to read the entries after it.
+    """
+    last_entry_id = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def latest(cls):
+        return cls.objects.order_by('-last_entry_id', '-id').first()
+
+
+class BalanceSnapshotRow(models.Model):
+    snapshot = models.ForeignKey(BalanceSnapshot, on_delete=models.CASCADE, related_name='rows')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    balance_cents = models.BigIntegerField()
+
+
+# Balance Check Model
+class BalanceCheck(models.Model):
+    """
+    One run of ``check_balances``. ``last_entry_id`` is the ledger entry up
+    to which the balances are known to match the splits; an incremental
+    run only checks the users with ledger entries after it.
+    """
+    last_entry_id = models.BigIntegerField()
+    incremental = models.BooleanField(default=False)
+    users_checked = models.BigIntegerField(default=0)
+    drifted = models.BigIntegerField(default=0)
+    repaired = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def latest(cls):
+        return cls.objects.order_by('-id').first()
+
+
+# Idempotency Key Model
+class IdempotencyKey(models.Model):
+    """
+    Stored response of a request sent with an ``Idempotency-Key`` header,
+    replayed when a retry sends the same key. Rows older than the TTL are
+    swept by ``prune_idempotency_keys``.
+    """
+    key = models.CharField(max_length=255, unique=True)
+    # hash of the method, path and payload the key was first used with
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(default=0)
+    response_body = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+
+# Recurring Expense Model
+class RecurringExpense(models.Model):
+    """
+    Template of an expense that repeats every ``every`` ``interval`` from
+    ``starts_at``, e.g. rent every 1 month. The ``run_recurring_expenses``
+    command turns due occurrences into expenses and moves ``next_run_at``
+    on; ``runs`` counts the occurrences materialized so far. The split
+    definition is kept as sent, in the ``splits`` format of an expense.
+    """
+    INTERVALS = [
+        ('day', 'Day'),
+        ('week', 'Week'),
+        ('month', 'Month'),
+        ('year', 'Year'),
+    ]
+
+    creator = models.ForeignKey(User, on_delete=models.CASCADE, related_name='created_recurring_expenses')
+    paid_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='paid_recurring_expenses')
+    participants = models.ManyToManyField(User, related_name='recurring_expenses')
+    # null sends the occurrences to the default group
+    group = models.ForeignKey(Group, on_delete=models.PROTECT, null=True, blank=True, related_name='recurring_expenses')
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    description = models.CharField(max_length=255)
+    split_method = models.CharField(max_length=20, choices=Expense.SPLIT_METHODS)
+    splits = models.JSONField(default=list, blank=True)
+    interval = models.CharField(max_length=10, choices=INTERVALS)
+    every = models.PositiveIntegerField(default=1)
+    starts_at = models.DateTimeField()
+    ends_at = models.DateTimeField(null=True, blank=True)
+    next_run_at = models.DateTimeField()
+    runs = models.PositiveIntegerField(default=0)
+    active = models.BooleanField(default=True)
+    # why the scheduler deactivated the template, if it did
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # only active templates are ever due; also serves the ORDER BY
+            models.Index(fields=['next_run_at'], condition=models.Q(active=True), name='recurring_due_idx'),
+        ]
+
+
+# Report Job Model
+class ReportJob(models.Model):
+    """
+    A PDF report rendered in the background by the ``run_report_worker``
+    command. The job row is the queue: workers claim pending jobs with a
+    conditional update, so no external broker is needed.
+    """
+    KINDS = [
+        ('balances', 'Balance sheet'),
+        ('expense', 'Expense balance sheet'),
+    ]
+    STATUSES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KINDS)
+    expense = models.ForeignKey(Expense, on_delete=models.CASCADE, null=True, blank=True, related_name='report_jobs')
+    status = models.CharField(max_length=10, choices=STATUSES, default='pending')
+    file_path = models.CharField(max_length=500, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # refreshed by the worker while the job renders; a running job whose
+    # heartbeat stops is requeued
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='report_job_queue_idx'),
+        ]
+
+
+# Import Checkpoint Model
+class ImportCheckpoint(models.Model):
+    """
+    Progress of an ``import_expenses`` run over one source file, saved in
+    the same transaction as every chunk it imports, so an interrupted
+    import resumes right after the last chunk that was committed.
+    """
+    source = models.CharField(max_length=500, unique=True)
+    # byte offset and line number of the first row not imported yet
+    position = models.BigIntegerField(default=0)
+    line = models.BigIntegerField(default=0)
+    imported = models.BigIntegerField(default=0)
+    rejected = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
@@ -0,0 +1,65 @@
+"""
+Integer-cent money arithmetic used by the split engine.
+
+Amounts enter the engine as ``Decimal``/str/int values, are converted to
+whole cents once, and every split and balance is computed on ints from
+then on. ``allocate`` splits a total into parts that always add back up
+to the total exactly.
+"""
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+CENT = Decimal('0.01')
+
+
+def to_cents(value):
+    """
+    Convert a money amount to whole cents, rounding half up.
+
+    Raises ``ValueError`` when ``value`` is not a number.
+    """
+    try:
+        amount = Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f"{value!r} is not a valid amount.")
+    if not amount.is_finite():
+        raise ValueError(f"{value!r} is not a valid amount.")
+    return int(amount.quantize(CENT, rounding=ROUND_HALF_UP) * 100)
+
+
+def from_cents(cents):
+    """
+    Convert whole cents back to a two-decimal ``Decimal``.
+    """
+    return (Decimal(cents) / 100).quantize(CENT)
+
+
+def allocate(total, weights):
+    """
+    Split ``total`` cents proportionally to ``weights`` using the largest
+    remainder method.
+
+    Every part is first rounded down, and the cents left over go one at a
+    time to the parts with the largest fractional remainder, ties going to
+    the earliest part. The result is deterministic and sums to ``total``.
+    """
+    if not all(type(weight) is int for weight in weights):
+        # decimal weights are scaled to whole numbers, which leaves the
+        # proportions, and so the result, unchanged
+        weights = [Decimal(str(weight)) for weight in weights]
+        places = max([-weight.as_tuple().exponent for weight in weights if weight.is_finite()] + [0])
+        weights = [int(weight.scaleb(places)) for weight in weights]
+    total_weight = sum(weights)
+    if total_weight <= 0:
+        raise ValueError("Weights must add up to a positive number.")
+
+    # the remainders are compared as integers over the common denominator
+    parts = []
+    remainders = []
+    for weight in weights:
+        part, remainder = divmod(total * weight, total_weight)
+        parts.append(part)
+        remainders.append(remainder)
+    leftover = total - sum(parts)
+    for i in sorted(range(len(parts)), key=lambda i: (-remainders[i], i))[:leftover]:
+        parts[i] += 1
+    return parts
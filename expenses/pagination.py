@@ -0,0 +1,101 @@
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def _query_params(request):
+    # DRF requests expose query_params, plain Django requests only GET
+    return getattr(request, 'query_params', request.GET)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Newest-first cursor pagination on a ``(timestamp, id)`` pair.
+
+    The cursor carries the key of the last row of the previous page, so the
+    next page is a range scan from that key rather than an OFFSET, and
+    scrolling deeper never makes a page more expensive. Works on querysets
+    of model instances or ``values()`` dicts.
+    """
+    page_size = 100
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self, time_field='created_at', id_field='id'):
+        self.time_field = time_field
+        self.id_field = id_field
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset, page_size = self.page_query(queryset, request)
+        return self.page_rows(list(queryset), page_size)
+
+    async def apaginate_queryset(self, queryset, request):
+        """
+        Same as ``paginate_queryset`` for async views, fetching the page
+        with the async ORM. Accepts a plain Django ``HttpRequest``.
+        """
+        queryset, page_size = self.page_query(queryset, request)
+        return self.page_rows([row async for row in queryset], page_size)
+
+    def page_query(self, queryset, request):
+        """
+        The query for the requested page, one row longer than the page so
+        the presence of a next page is known without a COUNT.
+        """
+        self.request = request
+        page_size = self.get_page_size(request)
+
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            timestamp, pk = cursor
+            queryset = queryset.filter(
+                Q(**{f'{self.time_field}__lt': timestamp})
+                | Q(**{self.time_field: timestamp, f'{self.id_field}__lt': pk})
+            )
+        return queryset.order_by(f'-{self.time_field}', f'-{self.id_field}')[:page_size + 1], page_size
+
+    def page_rows(self, rows, page_size):
+        page = rows[:page_size]
+        self.next_cursor = self.encode_cursor(page[-1]) if len(rows) > page_size else None
+        return page
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+    def get_page_size(self, request):
+        try:
+            size = int(_query_params(request)[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+
+    def _key(self, row):
+        if isinstance(row, dict):
+            return row[self.time_field], row[self.id_field]
+        return getattr(row, self.time_field), getattr(row, self.id_field)
+
+    def encode_cursor(self, row):
+        timestamp, pk = self._key(row)
+        return base64.urlsafe_b64encode(f'{timestamp.isoformat()}|{pk}'.encode()).decode()
+
+    def decode_cursor(self, request):
+        encoded = _query_params(request).get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            timestamp, pk = base64.urlsafe_b64decode(encoded.encode()).decode().split('|')
+            return datetime.fromisoformat(timestamp), int(pk)
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
@@ -0,0 +1,146 @@
+"""
+Materialization of recurring expenses.
+
+``materialize_due`` finds the templates whose ``next_run_at`` has passed
+through the ``recurring_due_idx`` index, builds an expense for every due
+occurrence with the same split engine as ``POST /expenses/`` and writes a
+batch of templates at a time with ``record_expenses``. Each batch is one
+transaction that both inserts the expenses and moves the templates'
+``next_run_at`` on, so a run that crashes leaves either all or none of a
+batch behind and the next run picks up where it stopped. The unique
+``(recurrence, occurrence_at)`` constraint on expenses is the backstop
+against two schedulers materializing the same occurrence.
+"""
+import calendar
+from datetime import timedelta
+
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from .ledger import compute_splits, record_expenses
+from .models import Expense, RecurringExpense
+
+
+def add_interval(start, interval, count):
+    """
+    ``start`` moved ``count`` intervals on in local wall-clock time. Month
+    and year steps keep the day of month, clamped to the month's length,
+    so an expense due on the 31st falls on the last day of short months.
+    """
+    if interval == 'day':
+        return start + timedelta(days=count)
+    if interval == 'week':
+        return start + timedelta(weeks=count)
+    months = count * (12 if interval == 'year' else 1)
+    year, month = divmod(start.month - 1 + months, 12)
+    year += start.year
+    day = min(start.day, calendar.monthrange(year, month + 1)[1])
+    return start.replace(year=year, month=month + 1, day=day)
+
+
+def occurrence(template, index):
+    """
+    Due time of the ``index``-th occurrence of ``template``, counting from 0.
+    Always computed from ``starts_at`` so month ends do not drift.
+    """
+    start = timezone.localtime(template.starts_at)
+    return add_interval(start, template.interval, index * template.every)
+
+
+def advance(template):
+    """
+    Count the occurrence at ``next_run_at`` as done and schedule the next
+    one, deactivating the template past its ``ends_at``.
+    """
+    template.runs += 1
+    template.next_run_at = occurrence(template, template.runs)
+    if template.ends_at is not None and template.next_run_at > template.ends_at:
+        template.active = False
+
+
+def template_entries(template, until, limit):
+    """
+    ``record_expenses`` entries for the occurrences of ``template`` due by
+    ``until``, at most ``limit`` of them, advancing the template past them.
+    """
+    participants = list(template.participants.all())
+    owed = compute_splits(
+        template.split_method, template.total_amount, participants, template.paid_by, template.splits,
+    )
+    entries = []
+    while template.active and template.next_run_at <= until and len(entries) < limit:
+        expense = Expense(
+            creator_id=template.creator_id, paid_by_id=template.paid_by_id, group_id=template.group_id,
+            total_amount=template.total_amount, description=template.description,
+            split_method=template.split_method, recurrence=template, occurrence_at=template.next_run_at,
+        )
+        entries.append((expense, participants, owed))
+        advance(template)
+    return entries
+
+
+def due_templates(until):
+    return RecurringExpense.objects.filter(active=True, next_run_at__lte=until).order_by('next_run_at', 'id')
+
+
+def materialize_due(until=None, batch_size=100, max_per_template=12):
+    """
+    Turn every occurrence due by ``until`` (default now) into an expense.
+
+    Templates are handled ``batch_size`` at a time, one transaction per
+    batch; a template far behind contributes at most ``max_per_template``
+    occurrences to a batch and is picked up again by the next one. A
+    template whose split definition no longer adds up is deactivated with
+    the reason in ``last_error``. An ``IntegrityError`` is retried once
+    per batch, as it normally means another scheduler got there first.
+    Returns ``(expenses_created, batches)``.
+    """
+    until = until or timezone.now()
+    created = batches = 0
+    failed = None
+    while True:
+        attempt = None
+        try:
+            with transaction.atomic():
+                templates = due_templates(until)
+                if connection.features.has_select_for_update_skip_locked:
+                    # concurrent schedulers take disjoint batches
+                    templates = templates.select_for_update(skip_locked=True, of=('self',))
+                templates = list(templates.select_related('paid_by').prefetch_related('participants')[:batch_size])
+                if not templates:
+                    return created, batches
+
+                earliest = templates[0].next_run_at
+                attempt = (templates[0].id, earliest)
+                entries = []
+                for template in templates:
+                    try:
+                        entries += template_entries(template, until, max_per_template)
+                    except (serializers.ValidationError, ValueError) as exc:
+                        template.active = False
+                        template.last_error = "; ".join(map(str, getattr(exc, 'detail', [exc])))
+
+                # occurrences written before the template's schedule was
+                # saved, e.g. by hand, are skipped rather than duplicated
+                existing = set(
+                    Expense.objects.filter(recurrence__in=templates, occurrence_at__range=(earliest, until))
+                    .values_list('recurrence_id', 'occurrence_at')
+                )
+                if existing:
+                    entries = [entry for entry in entries if (entry[0].recurrence_id, entry[0].occurrence_at) not in existing]
+
+                record_expenses(entries)
+                RecurringExpense.objects.bulk_update(templates, ['runs', 'next_run_at', 'active', 'last_error'])
+        except IntegrityError:
+            # another scheduler materialized some of these occurrences
+            # first; re-read the templates it moved on. A retry that finds
+            # the same batch again made no progress, so the error is not
+            # such a race and would come back forever.
+            if attempt is None or attempt == failed:
+                raise
+            failed = attempt
+            continue
+        failed = None
+        created += len(entries)
+        batches += 1
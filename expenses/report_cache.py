@@ -0,0 +1,190 @@
+"""
+Cache of rendered PDF reports keyed by content version.
+
+A report key embeds the version of the data it was built from (the global
+``LedgerState`` version or an expense's ``version``), so entries never
+need to be invalidated: once the data changes the old key is simply no
+longer asked for and ages out of the LRU. The same version doubles as the
+response ETag, which lets clients revalidate with ``If-None-Match`` and
+get a 304 without the report being looked up at all.
+
+The backend is chosen by the ``REPORT_CACHE`` setting::
+
+    REPORT_CACHE = {
+        'BACKEND': 'locmem',         # or 'file'
+        'LOCATION': '/var/tmp/reports',  # directory, file backend only
+        'MAX_BYTES': 64 * 1024 * 1024,
+        'MAX_ITEM_BYTES': 16 * 1024 * 1024,
+    }
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+
+from .reports import pdf_response
+
+DEFAULTS = {
+    'BACKEND': 'locmem',
+    'LOCATION': os.path.join(tempfile.gettempdir(), 'expenses-report-cache'),
+    'MAX_BYTES': 64 * 1024 * 1024,
+    'MAX_ITEM_BYTES': 16 * 1024 * 1024,
+}
+
+
+class LocMemReportStore:
+    """
+    In-process LRU bounded by the total size of the stored reports.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+            return data
+
+    def set(self, key, data):
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+            self.entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes and self.entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+class FileReportStore:
+    """
+    Directory of report files shared by every process on the machine.
+    A hit refreshes the file's mtime, and the least recently used files are
+    removed once the directory grows past ``max_bytes``.
+    """
+    def __init__(self, location, max_bytes):
+        self.location = location
+        self.max_bytes = max_bytes
+        os.makedirs(location, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.location, hashlib.sha256(key.encode()).hexdigest() + '.pdf')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def set(self, key, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.location, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(key))
+        self._evict()
+
+    def _evict(self):
+        files = []
+        for entry in os.scandir(self.location):
+            if entry.name.endswith('.pdf'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        size = sum(file_size for _, file_size, _ in files)
+        for _, file_size, path in sorted(files):
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= file_size
+
+    def clear(self):
+        for entry in os.scandir(self.location):
+            if entry.name.endswith('.pdf'):
+                os.remove(entry.path)
+
+
+_store = None
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'REPORT_CACHE', {})}
+
+
+def get_store():
+    global _store
+    if _store is None:
+        config = get_config()
+        if config['BACKEND'] == 'locmem':
+            _store = LocMemReportStore(config['MAX_BYTES'])
+        elif config['BACKEND'] == 'file':
+            _store = FileReportStore(config['LOCATION'], config['MAX_BYTES'])
+        else:
+            raise ImproperlyConfigured(f"Unknown REPORT_CACHE backend {config['BACKEND']!r}.")
+    return _store
+
+
+def _reset_store(*, setting, **kwargs):
+    global _store
+    if setting == 'REPORT_CACHE':
+        _store = None
+
+
+setting_changed.connect(_reset_store)
+
+
+def cached_pdf_response(request, key, filename, render, *args):
+    """
+    Serve the report identified by ``key`` from the cache, rendering it
+    with ``render(fileobj, *args)`` on a miss. ``key`` must change whenever
+    the report content does; it is also sent as the ETag.
+    """
+    etag = f'"{key}"'
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    store = get_store()
+    data = store.get(key)
+    if data is not None:
+        response = HttpResponse(data, content_type='application/pdf')
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    else:
+        response = pdf_response(render, filename, *args)
+        spool = response.file_to_stream
+        size = spool.seek(0, os.SEEK_END)
+        spool.seek(0)
+        # reports too large to keep in the cache are streamed as they are
+        if size <= get_config()['MAX_ITEM_BYTES']:
+            store.set(key, spool.read())
+            spool.seek(0)
+
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
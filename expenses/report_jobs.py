@@ -0,0 +1,128 @@
+"""
+Background rendering of PDF reports.
+
+``ReportJob`` rows are the queue. ``claim_jobs`` moves pending jobs to
+running with a conditional ``UPDATE`` so concurrent workers never pick the
+same job, and ``run_job`` renders one job into ``REPORT_JOBS_ROOT``. Both
+are driven by the ``run_report_worker`` management command, which hands
+jobs to a local process pool through ``expenses.worker``.
+
+A worker refreshes ``heartbeat_at`` on the jobs it is rendering at every
+poll, so any worker can requeue the jobs of one that died without taking
+over jobs that are still running. Finished jobs and their files are
+pruned after a retention period.
+"""
+import os
+import tempfile
+import traceback
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ReportJob
+from .reports import render_balance_sheet, render_expense_sheet
+
+
+def job_filename(job):
+    if job.kind == 'expense':
+        return f"expense_{job.expense_id}_balance_sheet.pdf"
+    return "balance_sheet.pdf"
+
+
+def claim_jobs(limit):
+    """
+    Mark up to ``limit`` of the oldest pending jobs as running and return
+    their ids. A job is only returned to the worker whose update won.
+    """
+    claimed = []
+    pending = ReportJob.objects.filter(status='pending').order_by('created_at', 'id').values_list('id', flat=True)
+    for job_id in pending[:limit]:
+        now = timezone.now()
+        if ReportJob.objects.filter(id=job_id, status='pending').update(status='running', started_at=now, heartbeat_at=now):
+            claimed.append(job_id)
+    return claimed
+
+
+def heartbeat(job_ids):
+    """
+    Record that the jobs are still being rendered.
+    """
+    if job_ids:
+        ReportJob.objects.filter(id__in=job_ids, status='running').update(heartbeat_at=timezone.now())
+
+
+def recover_stale_jobs(older_than):
+    """
+    Put running jobs whose heartbeat stopped more than ``older_than`` ago
+    back in the queue. Returns how many were requeued.
+    """
+    cutoff = timezone.now() - older_than
+    stale = Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at=None, started_at__lt=cutoff)
+    return ReportJob.objects.filter(stale, status='running').update(status='pending', started_at=None, heartbeat_at=None)
+
+
+def fail_job(job_id, error):
+    """
+    Record a job whose render never reported back, e.g. because its worker
+    process died.
+    """
+    ReportJob.objects.filter(id=job_id, status='running').update(status='failed', error=error, finished_at=timezone.now())
+
+
+def prune_jobs(older_than):
+    """
+    Delete the jobs that finished more than ``older_than`` ago together with
+    their files, and temporary files left behind by renders that were
+    killed. Returns how many jobs were deleted.
+    """
+    cutoff = timezone.now() - older_than
+    finished = ReportJob.objects.filter(status__in=('done', 'failed'), finished_at__lt=cutoff)
+    for path in finished.exclude(file_path='').values_list('file_path', flat=True).iterator():
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    deleted, _ = finished.delete()
+
+    root = str(settings.REPORT_JOBS_ROOT)
+    if os.path.isdir(root):
+        for entry in os.scandir(root):
+            try:
+                if entry.name.endswith('.tmp') and entry.stat().st_mtime < cutoff.timestamp():
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+    return deleted
+
+
+def run_job(job_id):
+    """
+    Render one claimed job and record the outcome on its row.
+    """
+    job = ReportJob.objects.select_related('expense__creator', 'expense__paid_by').get(id=job_id)
+    root = str(settings.REPORT_JOBS_ROOT)
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, f"job_{job.id}.pdf")
+
+    try:
+        # write to a temporary name first so a crash never leaves a
+        # half-written file behind the final path
+        fd, tmp_path = tempfile.mkstemp(dir=root, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if job.kind == 'expense':
+                    render_expense_sheet(f, job.expense)
+                else:
+                    render_balance_sheet(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    except Exception:
+        ReportJob.objects.filter(id=job.id).update(status='failed', error=traceback.format_exc(), finished_at=timezone.now())
+        return job.id, 'failed'
+
+    ReportJob.objects.filter(id=job.id).update(status='done', file_path=path, error='', finished_at=timezone.now())
+    return job.id, 'done'
+
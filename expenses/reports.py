@@ -0,0 +1,126 @@
+"""
+PDF balance sheets.
+
+``PDFReport`` writes lines top to bottom and starts a new page whenever
+the current one is full. The renderers read their rows with
+``.iterator()`` as plain tuples, so no model instances pile up, and write
+into any binary file object. reportlab still keeps every finished page,
+compressed, until ``save()``, so memory grows with the size of the PDF
+rather than with the number of rows fetched. ``pdf_response`` renders
+into a spooled temporary file and streams it back in blocks.
+"""
+import tempfile
+
+from django.http import FileResponse
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+
+from .models import Balance
+from .money import from_cents
+
+# Reports smaller than this stay in memory, larger ones spill to disk.
+SPOOL_MAX_SIZE = 1024 * 1024
+
+ROW_CHUNK_SIZE = 2000
+
+
+class PDFReport:
+    line_height = 20
+    top = 750
+    bottom = 50
+    left = 100
+
+    def __init__(self, fileobj, title):
+        self.title = title
+        self.page = 0
+        self.font = None
+        self.canvas = canvas.Canvas(fileobj, pagesize=letter, pageCompression=1)
+        self.start_page()
+
+    def start_page(self):
+        if self.page:
+            self.canvas.showPage()
+        self.page += 1
+        self.y = self.top
+        self.set_font("Helvetica", 9)
+        self.canvas.drawRightString(letter[0] - 50, self.bottom - 20, f"{self.title} - page {self.page}")
+
+    def set_font(self, name, size):
+        # showPage() resets the font, and setting an unchanged one still
+        # emits an operator, so only switch when needed
+        if (name, size, self.page) != self.font:
+            self.canvas.setFont(name, size)
+            self.font = (name, size, self.page)
+
+    def line(self, text, indent=0, bold=False, size=12):
+        if self.y < self.bottom:
+            self.start_page()
+        self.set_font("Helvetica-Bold" if bold else "Helvetica", size)
+        self.canvas.drawString(self.left + indent, self.y, text)
+        self.y -= self.line_height
+
+    def skip(self, lines=1):
+        self.y -= self.line_height * lines
+
+    def close(self):
+        self.canvas.showPage()
+        self.canvas.save()
+
+
+def render_balance_sheet(fileobj, chunk_size=ROW_CHUNK_SIZE):
+    """
+    Balance sheet for all the users combined.
+    """
+    report = PDFReport(fileobj, "Balance Sheet")
+    report.line("Balance Sheet")
+    report.skip(1)
+
+    balances = Balance.objects.values_list('user__username', 'balance_cents').order_by('id')
+    for username, balance_cents in balances.iterator(chunk_size=chunk_size):
+        report.line(f"{username}: ${from_cents(balance_cents)}")
+    report.close()
+
+
+def render_expense_sheet(fileobj, expense, chunk_size=ROW_CHUNK_SIZE):
+    """
+    Balance sheet of a single expense and its splits.
+    """
+    report = PDFReport(fileobj, f"Expense {expense.id}")
+
+    # Header information
+    report.line(f"Balance Sheet for Expense ID: {expense.id}", bold=True, size=14)
+    report.line(f"Description: {expense.description}")
+    report.line(f"Total Amount: ${expense.total_amount}")
+    report.line(f"Created by: {expense.creator.username}")
+    report.line(f"Paid by: {expense.paid_by.username}")
+    report.line(f"Split Method: {expense.get_split_method_display()}")
+    report.line(f"Date: {expense.created_at.strftime('%Y-%m-%d %H:%M:%S')}")
+
+    # Participants and their splits
+    report.skip(1)
+    report.line("Participants and their splits:", bold=True)
+
+    # Include the payer in the list
+    report.line(f"{expense.paid_by.username} (Paid: ${expense.total_amount})", indent=20)
+
+    total_owed = 0
+    splits = expense.splits.exclude(user_id=expense.paid_by_id).values_list('user__username', 'amount_owed').order_by('id')
+    for username, amount_owed in splits.iterator(chunk_size=chunk_size):
+        report.line(f"{username}: Owes ${amount_owed}", indent=20)
+        total_owed += amount_owed
+
+    # the payer gets back what everyone else owes
+    report.skip(1)
+    report.line(f"{expense.paid_by.username} should receive: ${total_owed:.2f}", indent=20, bold=True)
+    report.close()
+
+
+def pdf_response(render, filename, *args):
+    """
+    Run ``render(fileobj, *args)`` into a spooled temporary file and stream
+    the result as a PDF attachment.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    render(spool, *args)
+    spool.seek(0)
+    return FileResponse(spool, as_attachment=True, filename=filename, content_type='application/pdf')
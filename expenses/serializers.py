@@ -1,7 +1,10 @@
 from rest_framework import serializers
-from .models import User, Expense, ExpenseSplit, Balance
+from rest_framework.relations import MANY_RELATION_KWARGS
+from .models import User, Group, GroupBalance, Expense, ExpenseSplit, Balance, PairwiseDebt, RecurringExpense, ReportJob
 from django.db import transaction
-import pdb
+from django.urls import reverse
+from .ledger import compute_splits, record_expenses, update_expense
+from .money import from_cents
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -13,110 +16,230 @@ class ExpenseSplitSerializer(serializers.ModelSerializer):
         model = ExpenseSplit
         fields = ['user', 'amount_owed']
 
+class UserIdListField(serializers.ManyRelatedField):
+    """
+    Resolves a list of user ids with one query instead of one query per id.
+    """
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+
+        ids = set()
+        for pk in data:
+            try:
+                ids.add(int(pk))
+            except (TypeError, ValueError):
+                self.child_relation.fail('incorrect_type', data_type=type(pk).__name__)
+
+        prefetched = self.context.get('users')
+        if prefetched is not None:
+            users = [prefetched[pk] for pk in ids if pk in prefetched]
+        else:
+            users = list(self.child_relation.get_queryset().filter(pk__in=ids))
+        missing = ids - {user.pk for user in users}
+        if missing:
+            self.child_relation.fail('does_not_exist', pk_value=min(missing))
+        return users
+
+class UserRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    User primary key field that reads from a ``users`` map in the serializer
+    context when the caller already fetched them, e.g. for bulk writes.
+    """
+    context_key = 'users'
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return UserIdListField(**list_kwargs)
+
+    def to_internal_value(self, data):
+        prefetched = self.context.get(self.context_key)
+        if prefetched is None:
+            return super().to_internal_value(data)
+        try:
+            return prefetched[int(data)]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+class GroupRelatedField(UserRelatedField):
+    """
+    Group primary key field backed by a ``groups`` map in the context.
+    """
+    context_key = 'groups'
+
+class GroupSerializer(serializers.ModelSerializer):
+    members = UserRelatedField(many=True, required=False, queryset=User.objects.all())
+
+    class Meta:
+        model = Group
+        fields = ['id', 'name', 'members', 'is_default', 'created_at']
+
+class GroupBalanceSerializer(serializers.ModelSerializer):
+    balance = serializers.DecimalField(max_digits=14, decimal_places=2, coerce_to_string=False, read_only=True)
+
+    class Meta:
+        model = GroupBalance
+        fields = ['user', 'balance']
+
+# fields the splits of an expense are computed from
+SPLIT_FIELDS = ('paid_by', 'total_amount', 'split_method')
+
 class ExpenseSerializer(serializers.ModelSerializer):
     splits = ExpenseSplitSerializer(many=True, read_only=True)
+    creator = UserRelatedField(queryset=User.objects.all())
+    paid_by = UserRelatedField(queryset=User.objects.all())
+    participants = UserRelatedField(many=True, allow_empty=False, queryset=User.objects.all())
+    # left out, the expense goes to the default group
+    group = GroupRelatedField(queryset=Group.objects.all(), required=False)
 
     class Meta:
         model = Expense
-        fields = ['id', 'creator', 'paid_by', 'participants', 'total_amount', 'description', 'split_method', 'created_at', 'splits']
+        fields = ['id', 'creator', 'paid_by', 'participants', 'group', 'total_amount', 'description', 'split_method', 'created_at', 'splits']
+
+    def build_entry(self, validated_data):
+        """
+        Work out every split of the expense in memory without writing
+        anything, so an invalid split definition costs no queries at all.
+
+        Returns the ``(expense, participants, owed)`` tuple consumed by
+        ``ledger.record_expenses``.
+        """
+        validated_data = dict(validated_data)
+        participants = set(validated_data.pop('participants', []))
+        owed = compute_splits(
+            validated_data.get('split_method'),
+            validated_data['total_amount'],
+            participants,
+            validated_data['paid_by'],
+            self.initial_data.get('splits', []),
+        )
+        # an explicit None skips the model's default group lookup, which
+        # record_expenses does once for the whole batch instead
+        validated_data.setdefault('group', None)
+        return Expense(**validated_data), participants, owed
 
     # Creating an expense based on the type of split.
     @transaction.atomic
     def create(self, validated_data):
-        split_data = self.context['request'].data.get('splits', [])
-        total_amount = validated_data['total_amount']
-        participants = validated_data['participants']
-        paid_by = validated_data['paid_by']
-        user_ids = [participant.id for participant in participants]
-        
-        validated_data['participants'] = set(validated_data['participants'])
-        participants = validated_data.pop('participants', [])
-        
-        # saving the expense object in the db
-        expense = Expense.objects.create(**validated_data)
-        expense.participants.set(participants)
-
-        split_method = validated_data.get('split_method')
-
-        # pdb.set_trace()
-        total_owed_amount=0
-        # equal split
-        if split_method == 'equal':
-            num_participants = len(participants)
-            amount_per_participant = total_amount / num_participants
-            for participant in participants:
-                if participant != paid_by:
-                    ExpenseSplit.objects.create(expense=expense, user=participant, amount_owed=amount_per_participant)
-                    
-                    # Update participant's balance
-                    total_owed_amount += amount_per_participant
-                    participant_balance, _ = Balance.objects.get_or_create(user=participant)
-                    participant_balance.balance -= float(amount_per_participant)
-                    participant_balance.save()
-                    
-        #exact split
-        elif split_method == 'exact':
-            total_split_amount = 0
-            for split in split_data:
-                user_id = split['user']
-                amount_owed = split['amount_owed']
-                
-                if user_id not in user_ids:
-                    raise serializers.ValidationError(f"User with ID {user_id} is not a participant of this expense.")
-
-                total_split_amount += amount_owed
-                if user_id != paid_by.id:
-                    ExpenseSplit.objects.create(expense=expense, user_id=user_id, amount_owed=amount_owed)
-                    total_owed_amount += amount_owed
-
-                    # Update participant's balance
-                    participant_balance, _ = Balance.objects.get_or_create(user_id=user_id)
-                    participant_balance.balance -= float(amount_owed)
-                    participant_balance.save()
-
-            # validation of total split amount. If the error is raised then, the transaction is rolled back.
-            if total_split_amount != total_amount:
-                raise serializers.ValidationError("The sum of exact amounts does not equal the total amount.")
-
-        # percentage split
-        elif split_method == 'percentage':
-            total_percentage = 0
-            for split in split_data:
-                user_id = split['user']
-                percentage = split['percentage']
-
-                if user_id not in user_ids:
-                    raise serializers.ValidationError(f"User with ID {user_id} is not a participant of this expense.")
-
-                amount_owed = (percentage / 100) * float(total_amount)
-                
-                total_percentage += percentage
-                if user_id != paid_by.id:
-                    ExpenseSplit.objects.create(expense=expense, user_id=user_id, amount_owed=amount_owed)
-                    total_owed_amount += amount_owed
-
-                    # Update participant's balance
-                    participant_balance, _ = Balance.objects.get_or_create(user_id=user_id)
-                    participant_balance.balance -= float(amount_owed)
-                    participant_balance.save()
-            
-            # validation of total percentage. If the error is raised then, the transaction is rolled back.
-            if total_percentage != 100:
-                raise serializers.ValidationError("The total of all percentages must equal 100%.")
-
-        else:
-            raise serializers.ValidationError("Invalid split method specified.")
-        
-        # update payer's balance
-        participant_balance, _ = Balance.objects.get_or_create(user=paid_by)
-        participant_balance.balance += float(total_amount) - float(total_owed_amount)
-        participant_balance.save()
-        
+        # the expense, participants, splits and balance deltas are written
+        # with set-based statements
+        expense, = record_expenses([self.build_entry(validated_data)])
         return expense
 
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        """
+        Apply an edit as a delta: the old splits are reversed and the new
+        ones applied in one netted pass. Splits are recomputed when
+        ``splits`` or a field they depend on is sent, and kept otherwise.
+        """
+        validated_data = dict(validated_data)
+        participants = validated_data.pop('participants', None)
+        if participants is not None:
+            participants = set(participants)
+
+        owed = None
+        if participants is not None or 'splits' in self.initial_data or any(field in validated_data for field in SPLIT_FIELDS):
+            owed = compute_splits(
+                validated_data.get('split_method', instance.split_method),
+                validated_data.get('total_amount', instance.total_amount),
+                participants if participants is not None else set(instance.participants.all()),
+                validated_data.get('paid_by', instance.paid_by),
+                self.initial_data.get('splits', []),
+            )
+        return update_expense(instance, validated_data, participants, owed)
+
 class BalanceSerializer(serializers.ModelSerializer):
     user = UserSerializer()
+    balance = serializers.DecimalField(max_digits=14, decimal_places=2, coerce_to_string=False, read_only=True)
 
     class Meta:
         model = Balance
-        fields = ['user', 'balance']
\ No newline at end of file
+        fields = ['user', 'balance']
+
+class PairwiseDebtSerializer(serializers.ModelSerializer):
+    debtor = serializers.IntegerField(source='debtor_id')
+    creditor = serializers.IntegerField(source='creditor_id')
+    amount = serializers.SerializerMethodField()
+
+    class Meta:
+        model = PairwiseDebt
+        fields = ['debtor', 'creditor', 'amount']
+
+    def get_amount(self, obj):
+        return str(from_cents(abs(obj.amount_cents)))
+
+# fields the occurrence times of a recurring expense are computed from
+SCHEDULE_FIELDS = ('interval', 'every', 'starts_at')
+
+class RecurringExpenseSerializer(serializers.ModelSerializer):
+    creator = UserRelatedField(queryset=User.objects.all())
+    paid_by = UserRelatedField(queryset=User.objects.all())
+    participants = UserRelatedField(many=True, allow_empty=False, queryset=User.objects.all())
+    group = GroupRelatedField(queryset=Group.objects.all(), required=False, allow_null=True)
+    every = serializers.IntegerField(min_value=1, required=False)
+
+    class Meta:
+        model = RecurringExpense
+        fields = [
+            'id', 'creator', 'paid_by', 'participants', 'group', 'total_amount', 'description', 'split_method', 'splits',
+            'interval', 'every', 'starts_at', 'ends_at', 'next_run_at', 'runs', 'active', 'last_error', 'created_at',
+        ]
+        read_only_fields = ['next_run_at', 'runs', 'last_error', 'created_at']
+
+    def validate(self, data):
+        if self.instance is not None:
+            changed = [field for field in SCHEDULE_FIELDS if field in data and data[field] != getattr(self.instance, field)]
+            if changed:
+                raise serializers.ValidationError(f"{', '.join(changed)} cannot be changed; create a new recurring expense instead.")
+
+        def current(field):
+            return data[field] if field in data else getattr(self.instance, field, None)
+
+        participants = data['participants'] if 'participants' in data else list(self.instance.participants.all())
+        # the check every occurrence will go through, run up front
+        compute_splits(current('split_method'), current('total_amount'), participants, current('paid_by'), current('splits') or [])
+
+        ends_at = current('ends_at')
+        if ends_at is not None and ends_at < current('starts_at'):
+            raise serializers.ValidationError("ends_at must not be before starts_at.")
+        return data
+
+    def create(self, validated_data):
+        validated_data['next_run_at'] = validated_data['starts_at']
+        return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        if validated_data.get('active'):
+            validated_data['last_error'] = ''
+        return super().update(instance, validated_data)
+
+class ReportJobSerializer(serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ReportJob
+        fields = ['id', 'kind', 'expense', 'status', 'error', 'created_at', 'finished_at', 'download_url']
+        read_only_fields = ['status', 'error', 'created_at', 'finished_at']
+
+    def validate(self, data):
+        if data['kind'] == 'expense' and data.get('expense') is None:
+            raise serializers.ValidationError("An expense report needs an expense.")
+        if data['kind'] == 'balances':
+            data['expense'] = None
+        return data
+
+    def get_download_url(self, obj):
+        if obj.status != 'done':
+            return None
+        url = reverse('report-download', kwargs={'pk': obj.pk})
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
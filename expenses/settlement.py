@@ -0,0 +1,98 @@
+"""
+Debt simplification: turn net balances into a short list of transfers.
+
+Balances are integer cents keyed by user id, positive when the user is
+owed money and negative when they owe it. ``greedy_transfers`` repeatedly
+matches the largest creditor with the largest debtor using two heaps and
+runs in O(n log n), so even groups of thousands settle in milliseconds.
+``exact_transfers`` finds a provably
+minimal set of transfers for small groups by partitioning the users into
+as many zero-sum subsets as possible.
+"""
+import heapq
+
+# The exact solver is exponential in the number of non-zero balances.
+EXACT_MAX_USERS = 14
+
+
+def greedy_transfers(balances):
+    """
+    Return ``(debtor_id, creditor_id, cents)`` transfers settling ``balances``.
+
+    At most ``n - 1`` transfers are produced for ``n`` non-zero balances.
+    """
+    creditors = [(-cents, user_id) for user_id, cents in balances.items() if cents > 0]
+    debtors = [(cents, user_id) for user_id, cents in balances.items() if cents < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    transfers = []
+    while creditors and debtors:
+        credit, creditor_id = heapq.heappop(creditors)
+        debt, debtor_id = heapq.heappop(debtors)
+        cents = min(-credit, -debt)
+        transfers.append((debtor_id, creditor_id, cents))
+
+        if -credit > cents:
+            heapq.heappush(creditors, (credit + cents, creditor_id))
+        if -debt > cents:
+            heapq.heappush(debtors, (debt + cents, debtor_id))
+    return transfers
+
+
+def exact_transfers(balances):
+    """
+    Minimal number of transfers settling ``balances``.
+
+    A zero-sum group of ``k`` users always settles in ``k - 1`` transfers,
+    so the optimum comes from splitting the users into the largest number of
+    zero-sum groups. That is found with a DP over subsets, after which each
+    group is settled with ``greedy_transfers``. Raises ``ValueError`` for
+    more than ``EXACT_MAX_USERS`` non-zero balances.
+    """
+    users = [(user_id, cents) for user_id, cents in balances.items() if cents]
+    n = len(users)
+    if n > EXACT_MAX_USERS:
+        raise ValueError(f"The exact solver supports at most {EXACT_MAX_USERS} non-zero balances, got {n}.")
+
+    full = (1 << n) - 1
+    sums = [0] * (full + 1)
+    groups = [0] * (full + 1)
+    for mask in range(1, full + 1):
+        low = (mask & -mask).bit_length() - 1
+        sums[mask] = sums[mask & (mask - 1)] + users[low][1]
+        best = 0
+        rest = mask
+        while rest:
+            bit = rest & -rest
+            best = max(best, groups[mask ^ bit])
+            rest ^= bit
+        groups[mask] = best + (sums[mask] == 0)
+
+    # walk back from the full set to recover the order users were added in
+    order = []
+    mask = full
+    while mask:
+        target = groups[mask] - (sums[mask] == 0)
+        rest = mask
+        while rest:
+            bit = rest & -rest
+            if groups[mask ^ bit] == target:
+                break
+            rest ^= bit
+        order.append(bit.bit_length() - 1)
+        mask ^= bit
+
+    # every prefix (in insertion order) that sums to zero closes a group
+    transfers = []
+    group = {}
+    running = 0
+    for index in reversed(order):
+        user_id, cents = users[index]
+        group[user_id] = cents
+        running += cents
+        if running == 0:
+            transfers += greedy_transfers(group)
+            group = {}
+    transfers += greedy_transfers(group)
+    return transfers
@@ -0,0 +1,164 @@
+"""
+Read-through cache of per-user summaries.
+
+``GET /expenses/user/{id}/overall/`` and ``GET /balances/{id}/`` are the
+most read endpoints of the dashboards. Their responses are kept in a
+Django cache (an in-process ``LocMemCache`` unless ``CACHES`` says
+otherwise) under keys that embed a per-user generation token. Every write
+that moves a user's balance replaces the user's token, once right away so
+the writing transaction reads its own changes and once more when it
+commits, so an entry filled from the old rows in between lands under a
+token nobody asks for any more. Old entries are never deleted; they age
+out after ``TIMEOUT``.
+
+Tokens live in the cache too, so with a per-process ``LocMemCache`` a write
+only reaches the process that served it. Other processes keep answering
+from their own entries until they expire, which is why ``TIMEOUT`` is short:
+it is the longest a summary can lag behind a write made elsewhere. With a
+shared backend (Redis, memcached) invalidation reaches every process and
+``TIMEOUT`` can be raised.
+
+On a miss only one request per entry computes it: it takes a lock with
+``cache.add`` while the others poll for its result for up to ``WAIT``
+seconds. Lookups are counted by summary and result (``hit``, ``miss`` or
+``wait``) in the ``user_summary_cache_requests_total`` metric. Configured
+with::
+
+    USER_SUMMARY_CACHE = {
+        'ENABLED': True,
+        'CACHE': 'default',  # alias in CACHES
+        'TIMEOUT': 30,
+        'LOCK_TIMEOUT': 10,
+        'WAIT': 1.0,
+    }
+"""
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .metrics import registry
+from .models import Balance
+
+DEFAULTS = {
+    'ENABLED': True,
+    'CACHE': 'default',
+    'TIMEOUT': 30,
+    'LOCK_TIMEOUT': 10,
+    'WAIT': 1.0,
+}
+
+# seconds between two looks at an entry another request is computing
+POLL_INTERVAL = 0.01
+
+_missing = object()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'USER_SUMMARY_CACHE', {})}
+
+
+def get_cache():
+    return caches[get_config()['CACHE']]
+
+
+def _token_key(user_id):
+    return f'user-summary:{user_id}'
+
+
+def user_token(cache, user_id):
+    """
+    Current generation token of ``user_id``, created on first use.
+    """
+    key = _token_key(user_id)
+    token = cache.get(key)
+    if token is None:
+        token = uuid.uuid4().hex
+        if not cache.add(key, token, None):
+            token = cache.get(key, token)
+    return token
+
+
+def count(summary, result):
+    registry.counter(
+        'user_summary_cache_requests_total', "Per-user summary cache lookups, by summary and result.",
+        ('summary', 'result'),
+    ).inc(summary, result)
+
+
+def cached_summary(summary, user_id, compute):
+    """
+    The ``summary`` of ``user_id`` from the cache, or ``compute()`` stored
+    in it on a miss. ``None`` means there is nothing to show and is not
+    cached.
+    """
+    config = get_config()
+    if not config['ENABLED']:
+        return compute()
+    cache = get_cache()
+    key = f'{_token_key(user_id)}:{user_token(cache, user_id)}:{summary}'
+    value = cache.get(key, _missing)
+    if value is not _missing:
+        count(summary, 'hit')
+        return value
+
+    lock = f'{key}:lock'
+    if not cache.add(lock, 1, config['LOCK_TIMEOUT']):
+        deadline = time.monotonic() + config['WAIT']
+        while time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            value = cache.get(key, _missing)
+            if value is not _missing:
+                count(summary, 'wait')
+                return value
+            if cache.get(lock) is None:
+                # the other request found nothing to cache
+                break
+        count(summary, 'miss')
+        return compute()
+
+    count(summary, 'miss')
+    try:
+        value = compute()
+        if value is not None:
+            cache.set(key, value, config['TIMEOUT'])
+    finally:
+        cache.delete(lock)
+    return value
+
+
+def invalidate(user_ids):
+    if user_ids and get_config()['ENABLED']:
+        get_cache().set_many({_token_key(user_id): uuid.uuid4().hex for user_id in user_ids}, None)
+
+
+def summaries_changed(user_ids):
+    """
+    Drop the cached summaries of ``user_ids`` now and again when the
+    current transaction commits.
+    """
+    user_ids = list(user_ids)
+    invalidate(user_ids)
+    transaction.on_commit(lambda: invalidate(user_ids))
+
+
+def balance_owner(balance_id):
+    """
+    Id of the user the balance ``balance_id`` belongs to, or None. Cached,
+    as it never changes while the balance exists.
+    """
+    config = get_config()
+    key = f'balance-owner:{balance_id}'
+    user_id = get_cache().get(key) if config['ENABLED'] else None
+    if user_id is None:
+        user_id = Balance.objects.filter(id=balance_id).values_list('user_id', flat=True).first()
+        if user_id is not None and config['ENABLED']:
+            get_cache().set(key, user_id, config['TIMEOUT'])
+    return user_id
+
+
+def forget_balance_owner(balance_id):
+    if get_config()['ENABLED']:
+        get_cache().delete(f'balance-owner:{balance_id}')
@@ -1,10 +1,87 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings, tag
 from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
+import csv
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
+from datetime import date, datetime, timedelta
 from decimal import Decimal
-from .models import User, Expense, ExpenseSplit, Balance
+from io import StringIO
+from django.core.management import CommandError, call_command
+from django.utils import timezone
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Max, Sum
+from django.test.utils import CaptureQueriesContext
+from .models import (
+    User, Group, GroupBalance, DailyRollup, Expense, ExpenseSplit, Balance, BalanceSnapshot, BalanceSnapshotRow, LedgerEntry, LedgerState, PairwiseDebt,
+    IdempotencyKey, ImportCheckpoint, RecurringExpense, ReportJob, default_group_id,
+)
 from .serializers import UserSerializer, ExpenseSerializer, BalanceSerializer
+from .renderers import FastJSONRenderer
+from rest_framework.renderers import JSONRenderer
+from .ledger import ExpenseConflict, compute_splits, delete_expense, record_expenses, replay_balances
+from . import importing
+from .benchmarking import seed_splits
+from .idempotency import get_recent
+from .metrics import install_query_recorder, registry
+from .money import allocate, from_cents, to_cents
+from .report_jobs import prune_jobs
+from .report_cache import FileReportStore, LocMemReportStore, get_store
+from .settlement import exact_transfers, greedy_transfers
+from . import summary_cache
+
+
+class ExpenseAPITestCase(TestCase):
+    """
+    ``user_count`` users, ``user1`` to ``userN`` and also in ``self.users``, a
+    client authenticated as ``user1`` and helpers to create expenses through
+    the API.
+    """
+    user_count = 2
+
+    def setUp(self):
+        self.client = APIClient()
+        self.users = [
+            User.objects.create(username=f'user{i}', email=f'user{i}@example.com', mobile_number=f'{i:010d}')
+            for i in range(1, self.user_count + 1)
+        ]
+        for i, user in enumerate(self.users, 1):
+            setattr(self, f'user{i}', user)
+        self.client.force_authenticate(user=self.user1)
+
+    def expense_payload(self, paid_by=None, total_amount='100.00', participants=None, **fields):
+        """
+        An equal split of ``total_amount`` paid by ``paid_by`` (``user1``)
+        among ``participants`` (every user); ``fields`` override the rest.
+        """
+        paid_by = paid_by or self.user1
+        return {
+            'creator': paid_by.id,
+            'paid_by': paid_by.id,
+            'participants': [user.id for user in participants or self.users],
+            'total_amount': total_amount,
+            'description': 'Dinner',
+            'split_method': 'equal',
+            'splits': [],
+            **fields,
+        }
+
+    def create_expense(self, *args, **kwargs):
+        response = self.client.post(reverse('expense-list'), self.expense_payload(*args, **kwargs), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return Expense.objects.get(id=response.data['id'])
+
 
 class UserViewSetTestCase(TestCase):
     def setUp(self):
@@ -26,13 +103,7 @@ class UserViewSetTestCase(TestCase):
         self.assertEqual(response.data['username'], 'testuser')
         self.assertEqual(response.data['mobile_number'], '1234567890')
 
-class ExpenseViewSetTestCase(TestCase):
-    def setUp(self):
-        self.client = APIClient()
-        self.user1 = User.objects.create(username='user1', email='user1@example.com', mobile_number='1111111111')
-        self.user2 = User.objects.create(username='user2', email='user2@example.com', mobile_number='2222222222')
-        self.client.force_authenticate(user=self.user1)
-
+class ExpenseViewSetTestCase(ExpenseAPITestCase):
     def test_create_expense(self):
         url = reverse('expense-list')
         data = {
@@ -51,6 +122,18 @@ class ExpenseViewSetTestCase(TestCase):
         self.assertEqual(Expense.objects.count(), 1)
         self.assertEqual(ExpenseSplit.objects.count(), 1)
 
+    def test_create_expense_without_participants(self):
+        data = {
+            'creator': self.user1.id, 'paid_by': self.user1.id, 'participants': [],
+            'total_amount': '100.00', 'description': 'Test Expense', 'split_method': 'equal',
+        }
+        response = self.client.post(reverse('expense-list'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('participants', response.data)
+        with self.assertRaises(ValidationError):
+            compute_splits('equal', '100.00', [], self.user1, [])
+        self.assertEqual(Expense.objects.count(), 0)
+
     def test_get_user_expenses(self):
         expense = Expense.objects.create(
             creator=self.user1,
@@ -65,15 +148,84 @@ class ExpenseViewSetTestCase(TestCase):
         url = reverse('expense-user-expenses', kwargs={'user_id': self.user2.id})
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['amount_owed'], 50.00)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['amount_owed'], 50.00)
+        self.assertIsNone(response.data['next'])
+
+    def test_user_expenses_keyset_pagination(self):
+        for i in range(5):
+            expense = Expense.objects.create(
+                creator=self.user1, paid_by=self.user1, total_amount=Decimal('10.00'),
+                description=f'Expense {i}', split_method='equal',
+            )
+            ExpenseSplit.objects.create(expense=expense, user=self.user2, amount_owed=Decimal('5.00'))
+
+        url = reverse('expense-user-expenses', kwargs={'user_id': self.user2.id}) + '?page_size=2'
+        descriptions = []
+        while url:
+            with self.assertNumQueries(2):
+                response = self.client.get(url)
+            descriptions += [row['expense_description'] for row in response.data['results']]
+            url = response.data['next']
+
+        self.assertEqual(descriptions, [f'Expense {i}' for i in reversed(range(5))])
+        self.assertEqual(self.client.get(reverse('expense-user-expenses', kwargs={'user_id': self.user2.id}), {'cursor': 'bogus'}).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_user_expenses_page_is_an_index_range_scan(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('expense-user-expenses', kwargs={'user_id': self.user2.id}), {'page_size': 2})
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + queries[-1]['sql'])
+            plan = ' '.join(row[-1] for row in cursor.fetchall())
+        self.assertIn('split_user_created_idx', plan)
+        # the page comes out of the index in order, with no sort of every split
+        self.assertNotIn('TEMP B-TREE', plan)
+
+class AsyncReadTestCase(ExpenseAPITestCase):
+    def setUp(self):
+        super().setUp()
+        for i in range(3):
+            expense = Expense.objects.create(
+                creator=self.user1, paid_by=self.user1, total_amount=Decimal('10.00'),
+                description=f'Expense {i}', split_method='equal',
+            )
+            ExpenseSplit.objects.create(expense=expense, user=self.user2, amount_owed=Decimal('5.00'))
+        Balance.objects.create(user=self.user1, balance_cents=1500)
+        Balance.objects.create(user=self.user2, balance_cents=-1500)
+        summary_cache.get_cache().clear()
+
+    def assertSameJSON(self, async_url, sync_url):
+        async_response = self.client.get(async_url)
+        self.assertEqual(async_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(async_response.json(), self.client.get(sync_url).json())
+
+    def test_async_reads_match_sync_api(self):
+        kwargs = {'user_id': self.user2.id}
+        self.assertSameJSON(reverse('async-user-expenses', kwargs=kwargs), reverse('expense-user-expenses', kwargs=kwargs))
+        self.assertSameJSON(reverse('async-user-overall-expenses', kwargs=kwargs), reverse('expense-user-overall-expenses', kwargs=kwargs))
+        self.assertSameJSON(reverse('async-balance-list'), reverse('balance-list'))
+
+    def test_async_user_expenses_pagination(self):
+        url = reverse('async-user-expenses', kwargs={'user_id': self.user2.id}) + '?page_size=2'
+        descriptions = []
+        while url:
+            data = self.client.get(url).json()
+            descriptions += [row['expense_description'] for row in data['results']]
+            url = data['next']
+        self.assertEqual(descriptions, ['Expense 2', 'Expense 1', 'Expense 0'])
+
+        self.assertEqual(self.client.get(reverse('async-user-expenses', kwargs={'user_id': self.user2.id}), {'cursor': 'bogus'}).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(reverse('async-user-expenses', kwargs={'user_id': 0})).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.post(reverse('async-balance-list')).status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
 
 class BalanceViewTestCase(TestCase):
     def setUp(self):
         self.client = APIClient()
         self.user = User.objects.create(username='testuser', email='test@example.com', mobile_number='1234567890')
-        self.balance = Balance.objects.create(user=self.user, balance=100.00)
+        self.balance = Balance.objects.create(user=self.user, balance_cents=10000)
         self.client.force_authenticate(user=self.user)
+        # balances below are written directly, without bumping the ledger version
+        get_store().clear()
 
     def test_get_balance(self):
         url = reverse('balance-list')
@@ -89,6 +241,84 @@ class BalanceViewTestCase(TestCase):
         self.assertEqual(response['Content-Type'], 'application/pdf')
         self.assertTrue(response['Content-Disposition'].startswith('attachment; filename="balance_sheet.pdf"'))
 
+    def test_download_balance_sheet_breaks_pages(self):
+        users = User.objects.bulk_create([
+            User(username=f'user{i}', email=f'user{i}@example.com', mobile_number=str(i)) for i in range(100)
+        ])
+        Balance.objects.bulk_create([Balance(user=user, balance_cents=i) for i, user in enumerate(users)])
+
+        response = self.client.get(reverse('balance-download'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        pdf = b''.join(response.streaming_content)
+        self.assertEqual(len(re.findall(rb'/Type /Page\b', pdf)), 3)
+
+    def test_download_expense_balance_sheet(self):
+        other = User.objects.create(username='other', email='other@example.com', mobile_number='2')
+        expense = Expense.objects.create(
+            creator=self.user, paid_by=self.user, total_amount=Decimal('30.00'), description='Taxi', split_method='equal',
+        )
+        ExpenseSplit.objects.create(expense=expense, user=other, amount_owed=Decimal('15.00'))
+
+        response = self.client.get(reverse('expense-balance-sheet', kwargs={'pk': expense.pk}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+    def test_balance_sheet_revalidation(self):
+        url = reverse('balance-download')
+        etag = self.client.get(url)['ETag']
+
+        cached = self.client.get(url)
+        self.assertEqual(cached['ETag'], etag)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        other = User.objects.create(username='other', email='other@example.com', mobile_number='2')
+        data = {
+            'creator': self.user.id, 'paid_by': self.user.id, 'participants': [self.user.id, other.id],
+            'total_amount': '10.00', 'description': 'Coffee', 'split_method': 'equal', 'splits': [],
+        }
+        self.client.post(reverse('expense-list'), data, format='json')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+        # renaming a user changes the report as well
+        etag = response['ETag']
+        self.client.patch(reverse('user-detail', kwargs={'pk': other.id}), {'username': 'renamed'}, format='json')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_expense_sheet_changes_with_usernames(self):
+        expense = Expense.objects.create(
+            creator=self.user, paid_by=self.user, total_amount=Decimal('30.00'), description='Taxi', split_method='equal',
+        )
+        url = reverse('expense-balance-sheet', kwargs={'pk': expense.pk})
+        etag = self.client.get(url)['ETag']
+        self.client.patch(reverse('user-detail', kwargs={'pk': self.user.id}), {'username': 'renamed'}, format='json')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    def test_report_store_evicts_least_recently_used(self):
+        store = LocMemReportStore(max_bytes=10)
+        store.set('a', b'aaaa')
+        store.set('b', b'bbbb')
+        store.get('a')
+        store.set('c', b'cccc')
+        self.assertEqual(store.get('a'), b'aaaa')
+        self.assertIsNone(store.get('b'))
+
+        with tempfile.TemporaryDirectory() as location:
+            store = FileReportStore(location, max_bytes=10)
+            store.set('a', b'aaaa')
+            store.set('b', b'bbbb')
+            # file timestamps are coarse, so age both entries explicitly
+            os.utime(store._path('a'), (1, 1))
+            os.utime(store._path('b'), (2, 2))
+            store.get('a')
+            store.set('c', b'cccc')
+            self.assertEqual(store.get('a'), b'aaaa')
+            self.assertIsNone(store.get('b'))
+
 class SerializerTestCase(TestCase):
     def test_user_serializer(self):
         user_data = {
@@ -116,3 +346,1237 @@ class SerializerTestCase(TestCase):
         }
         serializer = ExpenseSerializer(data=expense_data)
         self.assertTrue(serializer.is_valid())
+
+
+class ListEndpointTestCase(ExpenseAPITestCase):
+    user_count = 4
+
+    def setUp(self):
+        super().setUp()
+        for i, method in enumerate(['equal', 'exact', 'percentage']):
+            self.create_expense(
+                self.users[i], description=f'Expense {i}', split_method=method,
+                splits=[{'user': user.id, 'amount_owed': '25.00', 'percentage': 25} for user in self.users],
+            )
+
+    def assertSameAsSerializer(self, url, serializer_class, queryset):
+        with self.assertNumQueries(3 if serializer_class is ExpenseSerializer else 1):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        expected = serializer_class(queryset.order_by('id'), many=True).data
+        self.assertEqual(response.content, JSONRenderer().render(expected))
+
+    def test_lean_lists_match_the_serializers(self):
+        self.assertSameAsSerializer(reverse('user-list'), UserSerializer, User.objects.all())
+        self.assertSameAsSerializer(reverse('balance-list'), BalanceSerializer, Balance.objects.all())
+        self.assertSameAsSerializer(reverse('expense-list'), ExpenseSerializer, Expense.objects.all())
+
+    def test_fast_renderer_matches_the_stock_renderer(self):
+        data = {
+            'amount': Decimal('12.50'),
+            'created_at': timezone.now(),
+            'day': date(2024, 2, 29),
+            'text': 'caf\u00e9 \u2028 "quoted"',
+            'nested': [{'id': 1, 'ok': True, 'none': None}, (1, 2)],
+            3: 'int key',
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(
+            FastJSONRenderer().render(data, 'application/json; indent=2'),
+            JSONRenderer().render(data, 'application/json; indent=2'),
+        )
+
+
+class ExportTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.users = [
+            User.objects.create(username=f'user{i}', email=f'user{i}@example.com', mobile_number=str(i)) for i in range(3)
+        ]
+        for i, (payer, day) in enumerate([(0, date(2026, 1, 10)), (1, date(2026, 2, 10)), (0, date(2026, 3, 10))]):
+            payload = {
+                'creator': self.users[payer].id,
+                'paid_by': self.users[payer].id,
+                'participants': [self.users[payer].id, self.users[2].id] if i < 2 else [self.users[0].id, self.users[1].id],
+                'total_amount': '30.00',
+                'description': f'Expense, "{i}"',
+                'split_method': 'equal',
+                'splits': [],
+            }
+            expense_id = self.client.post(reverse('expense-list'), payload, format='json').data['id']
+            Expense.objects.filter(id=expense_id).update(created_at=timezone.make_aware(datetime.combine(day, datetime.min.time())))
+
+    def _get(self, name, file_format, **params):
+        response = self.client.get(reverse(name, kwargs={'file_format': file_format}), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_exports(self):
+        rows = list(csv.reader(StringIO(self._get('expense-export', 'csv'))))
+        self.assertEqual(rows[0], ['id', 'created_at', 'description', 'total_amount', 'split_method', 'creator', 'paid_by', 'group'])
+        self.assertEqual([row[2] for row in rows[1:]], ['Expense, "0"', 'Expense, "1"', 'Expense, "2"'])
+        self.assertEqual(rows[1][1], '2026-01-10T00:00:00Z')
+
+        rows = list(csv.reader(StringIO(self._get('expense-export-splits', 'csv', start='2026-02-01'))))
+        self.assertEqual(rows[1:], [
+            [str(Expense.objects.get(description='Expense, "1"').id), str(self.users[2].id), '15.00', '2026-02-10T00:00:00Z'],
+            [str(Expense.objects.get(description='Expense, "2"').id), str(self.users[1].id), '15.00', '2026-03-10T00:00:00Z'],
+        ])
+
+        rows = list(csv.reader(StringIO(self._get('balance-export', 'csv'))))
+        self.assertEqual(rows[1:], [
+            [str(self.users[0].id), 'user0', '30.00'],
+            [str(self.users[1].id), 'user1', '0.00'],
+            [str(self.users[2].id), 'user2', '-30.00'],
+        ])
+
+    def test_ndjson_exports_with_filters(self):
+        lines = self._get('expense-export', 'ndjson', user=self.users[1].id, end='2026-02-28').splitlines()
+        self.assertEqual([json.loads(line)['description'] for line in lines], ['Expense, "1"'])
+
+        # the payer or a participant matches the user filter
+        lines = self._get('expense-export', 'ndjson', user=self.users[0].id).splitlines()
+        self.assertEqual(len(lines), 2)
+
+        lines = self._get('balance-export', 'ndjson', user=self.users[2].id).splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [{'user': self.users[2].id, 'username': 'user2', 'balance': '-30.00'}])
+
+        response = self.client.get(reverse('expense-export', kwargs={'file_format': 'csv'}), {'start': '10/01/2026'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ExpenseWriteQueryCountTestCase(ExpenseAPITestCase):
+    user_count = 50
+
+    def setUp(self):
+        super().setUp()
+        # created on first use; warm it up so every write costs the same
+        default_group_id()
+
+    def _payload(self, participants, split_method):
+        data = self.expense_payload(participants[0], str(len(participants) * 10), participants, split_method=split_method)
+        if split_method == 'exact':
+            data['splits'] = [{'user': user.id, 'amount_owed': '10.00'} for user in participants]
+        elif split_method == 'percentage':
+            share = 100 // len(participants)
+            data['splits'] = [{'user': user.id, 'percentage': share} for user in participants]
+            data['splits'][0]['percentage'] += 100 - share * len(participants)
+        return data
+
+    def _count_create_queries(self, participants, split_method):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse('expense-list'), self._payload(participants, split_method), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return len(ctx.captured_queries)
+
+    def test_query_count_independent_of_participants(self):
+        for split_method in ['equal', 'exact', 'percentage']:
+            with self.subTest(split_method=split_method):
+                small = self._count_create_queries(self.users[:5], split_method)
+                Balance.objects.all().delete()
+                large = self._count_create_queries(self.users, split_method)
+                Balance.objects.all().delete()
+                self.assertEqual(small, large)
+
+    def test_balance_is_unique_per_user(self):
+        Balance.objects.create(user=self.users[0])
+        with self.assertRaises(IntegrityError):
+            Balance.objects.create(user=self.users[0])
+
+    def test_balances_are_conserved(self):
+        self._count_create_queries(self.users[:3], 'equal')
+        self.assertEqual(ExpenseSplit.objects.count(), 2)
+        self.assertEqual(sum(Balance.objects.values_list('balance_cents', flat=True)), 0)
+        self.assertEqual(Balance.objects.get(user=self.users[0]).balance_cents, 2000)
+
+
+class BulkExpenseCreateTestCase(ExpenseAPITestCase):
+    def test_bulk_create_reports_partial_failures(self):
+        payloads = [
+            self.expense_payload(),
+            self.expense_payload(split_method='exact', splits=[{'user': self.user2.id, 'amount_owed': '10.00'}]),
+            self.expense_payload(total_amount='40.00'),
+        ]
+        response = self.client.post(reverse('expense-bulk-create'), payloads, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([result['status'] for result in response.data['results']], [201, 400, 201])
+        self.assertEqual(Expense.objects.count(), 2)
+        self.assertEqual(ExpenseSplit.objects.count(), 2)
+        self.assertEqual(Balance.objects.get(user=self.user2).balance_cents, -7000)
+
+    def test_splits_that_are_not_a_list(self):
+        for splits in (5, 'alice:10', {'user': 1}):
+            payload = self.expense_payload(split_method='exact', splits=splits)
+            response = self.client.post(reverse('expense-list'), payload, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            response = self.client.post(reverse('expense-bulk-create'), [payload], format='json')
+            self.assertEqual(response.data['results'][0]['errors'], ['splits must be a list.'])
+        self.assertEqual(Expense.objects.count(), 0)
+
+    def test_bulk_create_accepts_ndjson(self):
+        body = '\n'.join(json.dumps(self.expense_payload()) for _ in range(3))
+        response = self.client.post(reverse('expense-bulk-create'), body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Expense.objects.count(), 3)
+        self.assertEqual(set(Expense.objects.get(id=response.data['results'][0]['id']).participants.all()), {self.user1, self.user2})
+
+
+class PairwiseDebtTestCase(ExpenseAPITestCase):
+    user_count = 3
+
+    def _debts(self):
+        return {(debt['debtor'], debt['creditor']): debt['amount'] for debt in self.client.get(reverse('balance-debts')).data}
+
+    def test_debts_are_netted_per_pair(self):
+        self.create_expense(self.user1, '90.00')
+        self.create_expense(self.user2, '30.00')
+        self.assertEqual(self._debts(), {
+            (self.user2.id, self.user1.id): '20.00',
+            (self.user3.id, self.user1.id): '30.00',
+            (self.user3.id, self.user2.id): '10.00',
+        })
+
+        response = self.client.get(reverse('balance-debts'), {'user': self.user3.id})
+        self.assertEqual(len(response.data), 2)
+
+    def test_rebuild_matches_incremental_maintenance(self):
+        self.create_expense(self.user1, '90.00')
+        self.create_expense(self.user3, '60.00')
+        incremental = self._debts()
+
+        PairwiseDebt.objects.all().delete()
+        call_command('rebuild_debts', chunk_size=2, stdout=StringIO())
+        self.assertEqual(self._debts(), incremental)
+
+
+class GroupTestCase(ExpenseAPITestCase):
+    user_count = 3
+
+    def test_expense_without_group_goes_to_default_group(self):
+        expense = self.create_expense(self.user1, '10.00', [self.user1, self.user2])
+        group = Group.objects.get(is_default=True)
+        self.assertEqual(expense.group_id, group.id)
+        self.assertEqual(set(group.members.all()), {self.user1, self.user2})
+
+    def test_group_balances_are_partitioned(self):
+        trip = Group.objects.create(name='Trip')
+        flat = Group.objects.create(name='Flat')
+        self.create_expense(self.user1, '40.00', [self.user1, self.user2], group=trip.id)
+        self.create_expense(self.user3, '30.00', [self.user2, self.user3], group=flat.id)
+
+        response = self.client.get(reverse('group-balances', args=[trip.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual({row['user']: row['balance'] for row in response.data}, {
+            self.user1.id: Decimal('20.00'), self.user2.id: Decimal('-20.00'),
+        })
+        response = self.client.get(reverse('group-balances', args=[flat.id]))
+        self.assertEqual({row['user']: row['balance'] for row in response.data}, {
+            self.user2.id: Decimal('-15.00'), self.user3.id: Decimal('15.00'),
+        })
+
+        # the global balance is the sum over every group
+        self.assertEqual(Balance.objects.get(user=self.user2).balance, Decimal('-35.00'))
+        self.assertEqual(set(trip.members.all()), {self.user1, self.user2})
+
+    def test_group_with_expenses_cannot_be_deleted(self):
+        trip = Group.objects.create(name='Trip')
+        self.create_expense(self.user1, '10.00', [self.user1, self.user2], group=trip.id)
+        response = self.client.delete(reverse('group-detail', args=[trip.id]))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class AnalyticsTestCase(ExpenseAPITestCase):
+    def _rollups(self):
+        return list(DailyRollup.objects.order_by('user_id', 'day').values_list(
+            'user_id', 'day', 'paid_cents', 'owed_cents', 'equal_owed_cents', 'exact_owed_cents', 'percentage_owed_cents',
+        ))
+
+    def test_rollups_are_maintained_on_create(self):
+        self.create_expense(self.user1, '30.00')
+        self.create_expense(self.user1, '10.00', split_method='exact', splits=[{'user': self.user1.id, 'amount_owed': '4.00'}, {'user': self.user2.id, 'amount_owed': '6.00'}])
+        today = timezone.localdate()
+        self.assertEqual(self._rollups(), [
+            (self.user1.id, today, 4000, 0, 0, 0, 0),
+            (self.user2.id, today, 0, 2100, 1500, 600, 0),
+        ])
+
+    def test_monthly_analytics_after_backfill(self):
+        january = self.create_expense(self.user1, '30.00')
+        self.create_expense(self.user2, '10.00')
+        Expense.objects.filter(id=january.id).update(created_at=timezone.make_aware(datetime(2024, 1, 15, 12)))
+        incremental = self._rollups()
+
+        DailyRollup.objects.all().delete()
+        call_command('backfill_rollups', chunk_size=1, stdout=StringIO())
+        self.assertNotEqual(self._rollups(), incremental)
+        self.assertEqual(DailyRollup.objects.filter(day=date(2024, 1, 15)).count(), 2)
+
+        url = reverse('expense-user-analytics', kwargs={'user_id': self.user2.id})
+        response = self.client.get(url, {'start': '2024-01-01', 'end': timezone.localdate().isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual(results[0]['period_start'], date(2024, 1, 1))
+        self.assertEqual(results[0]['owed'], '15.00')
+        self.assertEqual(results[0]['owed_by_split_method'], {'equal': '15.00', 'exact': '0.00', 'percentage': '0.00'})
+        self.assertEqual(results[-1]['paid'], '10.00')
+
+        self.assertEqual(self.client.get(url, {'period': 'day'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(url, {'start': 'yesterday'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class LedgerReplayTestCase(ExpenseAPITestCase):
+    user_count = 3
+
+    def _balances(self):
+        return dict(Balance.objects.values_list('user_id', 'balance_cents'))
+
+    def test_entries_mirror_balances(self):
+        self.create_expense(self.users[0], '30.00')
+        self.create_expense(self.users[1], '10.00')
+        totals = dict(LedgerEntry.objects.values('user_id').annotate(total=Sum('amount_cents')).values_list('user_id', 'total'))
+        self.assertEqual(totals, self._balances())
+        self.assertEqual(sum(totals.values()), 0)
+
+    def test_replay_repairs_drift_from_snapshot_and_tail(self):
+        self.create_expense(self.users[0], '30.00')
+        call_command('snapshot_ledger', stdout=StringIO())
+        self.create_expense(self.users[1], '10.00')
+        expected = self._balances()
+
+        Balance.objects.filter(user=self.users[2]).update(balance_cents=0)
+        # snapshots come from the ledger, so the drift is not captured
+        call_command('snapshot_ledger', stdout=StringIO())
+        self.create_expense(self.users[2], '3.00')
+        expected[self.users[0].id] -= 100
+        expected[self.users[1].id] -= 100
+        expected[self.users[2].id] += 200
+
+        out = StringIO()
+        call_command('replay_ledger', '--dry-run', stdout=out)
+        self.assertIn('1 balances drifted', out.getvalue())
+        self.assertNotEqual(self._balances(), expected)
+
+        version = LedgerState.current_version()
+        call_command('replay_ledger', stdout=StringIO())
+        self.assertEqual(self._balances(), expected)
+        self.assertGreater(LedgerState.current_version(), version)
+
+        out = StringIO()
+        call_command('replay_ledger', stdout=out)
+        self.assertIn('0 balances corrected', out.getvalue())
+
+    def test_check_balances_against_splits(self):
+        self.create_expense(self.users[0], '30.00')
+        self.create_expense(self.users[1], '10.00')
+        expected = self._balances()
+        Balance.objects.filter(user=self.users[2]).update(balance_cents=F('balance_cents') + 5)
+
+        out = StringIO()
+        call_command('check_balances', stdout=out)
+        self.assertIn(f'user {self.users[2].id}: -5 cents', out.getvalue())
+        self.assertIn('1 of 3 balances drifted', out.getvalue())
+        self.assertNotEqual(self._balances(), expected)
+
+        call_command('check_balances', '--repair', stdout=StringIO())
+        self.assertEqual(self._balances(), expected)
+        out = StringIO()
+        call_command('check_balances', stdout=out)
+        self.assertIn('0 of 3 balances drifted', out.getvalue())
+
+    def test_repair_survives_replay_from_a_drifted_snapshot(self):
+        self.create_expense(self.users[0], '30.00')
+        expected = self._balances()
+        Balance.objects.filter(user=self.users[2]).update(balance_cents=F('balance_cents') + 1)
+        GroupBalance.objects.filter(user=self.users[2]).update(balance_cents=F('balance_cents') + 1)
+        # old drift copied into the baseline snapshot, as migration 0009 did
+        snapshot = BalanceSnapshot.objects.create(last_entry_id=LedgerEntry.objects.aggregate(last=Max('id'))['last'])
+        BalanceSnapshotRow.objects.bulk_create(
+            BalanceSnapshotRow(snapshot=snapshot, user_id=user_id, balance_cents=cents)
+            for user_id, cents in self._balances().items()
+        )
+
+        call_command('check_balances', '--repair', stdout=StringIO())
+        self.assertEqual(self._balances(), expected)
+        self.assertEqual(dict(GroupBalance.objects.values_list('user_id', 'balance_cents')), expected)
+        correction = LedgerEntry.objects.get(expense=None)
+        self.assertEqual((correction.user_id, correction.amount_cents), (self.users[2].id, -1))
+
+        self.assertEqual(replay_balances(), {})
+        self.assertEqual(self._balances(), expected)
+
+    def test_incremental_check_reads_users_touched_since_the_last_one(self):
+        self.create_expense(self.users[0], '30.00')
+        call_command('check_balances', '--incremental', stdout=StringIO())
+        Balance.objects.filter(user=self.users[2]).update(balance_cents=0)
+
+        # the drift was not written through the ledger, so nobody was touched
+        out = StringIO()
+        call_command('check_balances', '--incremental', stdout=out)
+        self.assertIn('0 of 0 balances drifted', out.getvalue())
+
+        self.create_expense(self.users[1], '3.00')
+        for _ in range(2):
+            # drift that is only reported is checked again next time
+            out = StringIO()
+            call_command('check_balances', '--incremental', stdout=out)
+            self.assertIn(f'user {self.users[2].id}: -1000 cents', out.getvalue())
+            self.assertIn('1 of 3 balances drifted', out.getvalue())
+
+        call_command('check_balances', '--incremental', '--repair', stdout=StringIO())
+        self.assertEqual(Balance.objects.get(user=self.users[2]).balance_cents, -1100)
+        out = StringIO()
+        call_command('check_balances', '--incremental', stdout=out)
+        self.assertIn('0 of 0 balances drifted', out.getvalue())
+
+    def test_snapshot_pruning(self):
+        self.create_expense(self.users[0], '30.00')
+        for _ in range(4):
+            call_command('snapshot_ledger', keep=2, stdout=StringIO())
+        self.assertEqual(BalanceSnapshot.objects.count(), 2)
+        self.assertEqual(BalanceSnapshot.latest().last_entry_id, LedgerEntry.objects.latest('id').id)
+
+
+class ExpenseEditTestCase(ExpenseAPITestCase):
+    user_count = 3
+
+    def setUp(self):
+        super().setUp()
+        self.expense = self.create_expense(total_amount='30.00')
+
+    def _balances(self):
+        return [Balance.objects.get(user=user).balance_cents for user in self.users]
+
+    def _nonzero(self, model, *fields):
+        return sorted(row for row in model.objects.values_list(*fields) if any(row[-1:]))
+
+    def assertLedgerConsistent(self):
+        # every derived table agrees with a rebuild from the splits or the log
+        self.assertEqual(replay_balances(dry_run=True), {})
+        self.assertEqual(sum(Balance.objects.values_list('balance_cents', flat=True)), 0)
+        group_totals = defaultdict(int)
+        for user_id, cents in GroupBalance.objects.values_list('user_id', 'balance_cents'):
+            group_totals[user_id] += cents
+        self.assertEqual({k: v for k, v in group_totals.items() if v}, {k: v for k, v in Balance.objects.values_list('user_id', 'balance_cents') if v})
+
+        debts = self._nonzero(PairwiseDebt, 'user_a_id', 'user_b_id', 'amount_cents')
+        call_command('rebuild_debts', stdout=StringIO())
+        self.assertEqual(self._nonzero(PairwiseDebt, 'user_a_id', 'user_b_id', 'amount_cents'), debts)
+
+        fields = ('user_id', 'day', 'owed_cents', 'equal_owed_cents', 'exact_owed_cents', 'percentage_owed_cents', 'paid_cents')
+        rollups = [row for row in DailyRollup.objects.order_by('user_id', 'day').values_list(*fields) if any(row[2:])]
+        call_command('backfill_rollups', stdout=StringIO())
+        self.assertEqual(list(DailyRollup.objects.order_by('user_id', 'day').values_list(*fields)), rollups)
+
+    def test_update_applies_the_delta(self):
+        response = self.client.patch(reverse('expense-detail', args=[self.expense.id]), {'total_amount': '60.00'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self._balances(), [4000, -2000, -2000])
+        self.assertEqual(sorted(split['amount_owed'] for split in response.data['splits']), ['20.00', '20.00'])
+        self.expense.refresh_from_db()
+        self.assertEqual(self.expense.version, 2)
+        self.assertLedgerConsistent()
+
+    def test_update_payer_participants_and_method(self):
+        data = {
+            'creator': self.users[0].id,
+            'paid_by': self.users[1].id,
+            'participants': [self.users[1].id, self.users[2].id],
+            'total_amount': '12.00',
+            'description': 'Lunch',
+            'split_method': 'exact',
+            'splits': [{'user': self.users[1].id, 'amount_owed': '5.00'}, {'user': self.users[2].id, 'amount_owed': '7.00'}],
+        }
+        response = self.client.put(reverse('expense-detail', args=[self.expense.id]), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self._balances(), [0, 700, -700])
+        self.assertEqual(set(self.expense.participants.all()), {self.users[1], self.users[2]})
+        self.assertLedgerConsistent()
+
+    def test_update_without_split_changes_keeps_balances(self):
+        entries = LedgerEntry.objects.count()
+        response = self.client.patch(reverse('expense-detail', args=[self.expense.id]), {'description': 'Late dinner'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self._balances(), [2000, -1000, -1000])
+        self.assertEqual(LedgerEntry.objects.count(), entries)
+
+    def test_invalid_update_changes_nothing(self):
+        response = self.client.patch(reverse('expense-detail', args=[self.expense.id]), {'split_method': 'exact'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self._balances(), [2000, -1000, -1000])
+        self.expense.refresh_from_db()
+        self.assertEqual((self.expense.split_method, self.expense.version), ('equal', 1))
+
+    def test_delete_reverses_balances(self):
+        response = self.client.delete(reverse('expense-detail', args=[self.expense.id]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Expense.objects.exists())
+        self.assertFalse(ExpenseSplit.objects.exists())
+        self.assertEqual(self._balances(), [0, 0, 0])
+        self.assertEqual(LedgerEntry.objects.filter(expense_id=self.expense.id).aggregate(total=Sum('amount_cents'))['total'], 0)
+        self.assertLedgerConsistent()
+
+    def test_concurrent_edits_apply_once(self):
+        # both requests loaded the expense before either one wrote
+        first = Expense.objects.get(id=self.expense.id)
+        second = Expense.objects.get(id=self.expense.id)
+
+        serializer = ExpenseSerializer(first, data={'total_amount': '60.00'}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        serializer = ExpenseSerializer(second, data={'total_amount': '90.00'}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        with self.assertRaises(ExpenseConflict):
+            serializer.save()
+        self.assertEqual(self._balances(), [4000, -2000, -2000])
+
+        # a delete racing with the edit is refused as well
+        with self.assertRaises(ExpenseConflict):
+            with transaction.atomic():
+                delete_expense(second)
+        self.assertEqual(self._balances(), [4000, -2000, -2000])
+        self.assertLedgerConsistent()
+
+
+class IdempotencyKeyTestCase(ExpenseAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.payload = self.expense_payload(total_amount='20.00', description='Taxi')
+        get_recent().clear()
+
+    def _post(self, key, payload=None, url=None):
+        return self.client.post(url or reverse('expense-list'), payload or self.payload, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_stored_response(self):
+        first = self._post('retry-1')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+
+        retry = self._post('retry-1')
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(Expense.objects.count(), 1)
+        self.assertEqual(Balance.objects.get(user=self.user2).balance_cents, -1000)
+
+    def test_recent_keys_are_served_from_memory(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self._post('retry-2')
+        with self.assertNumQueries(0):
+            retry = self._post('retry-2')
+        self.assertEqual(retry.json(), first.json())
+
+    def test_key_reused_for_another_request_is_refused(self):
+        self._post('retry-3')
+        response = self._post('retry-3', {**self.payload, 'total_amount': '30.00'})
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Expense.objects.count(), 1)
+
+    def test_failed_request_does_not_keep_its_key(self):
+        response = self._post('retry-4', {**self.payload, 'split_method': 'unknown'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self._post('retry-4').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(IdempotencyKey.objects.get(key='retry-4').status_code, 201)
+
+    def test_bulk_create_honours_the_key(self):
+        url = reverse('expense-bulk-create')
+        self.assertEqual(self._post('retry-5', [self.payload, self.payload], url).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self._post('retry-5', [self.payload, self.payload], url).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Expense.objects.count(), 2)
+
+    def test_expired_keys_are_pruned(self):
+        self._post('retry-6')
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(days=2))
+        get_recent().clear()
+
+        # an expired key no longer replays
+        self.assertNotIn('Idempotent-Replayed', self._post('retry-6'))
+        self.assertEqual(Expense.objects.count(), 2)
+
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(days=2))
+        out = StringIO()
+        call_command('prune_idempotency_keys', stdout=out)
+        self.assertIn('Pruned 1', out.getvalue())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+@override_settings(REQUEST_METRICS={'ENABLED': True})
+class RequestMetricsTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user1 = User.objects.create(username='user1', email='user1@example.com', mobile_number='1111111111')
+        Balance.objects.create(user=self.user1, balance_cents=0)
+        # the test connection was opened before the middleware was loaded
+        install_query_recorder()
+        registry.clear()
+
+    def _server_timing(self, response):
+        return dict(
+            (name, dict(param.split('=', 1) for param in params))
+            for name, *params in (entry.strip().split(';') for entry in response['Server-Timing'].split(','))
+        )
+
+    def test_server_timing_reports_queries_and_durations(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('balance-list'))
+        timing = self._server_timing(response)
+        self.assertEqual(timing['db']['desc'], f'"{len(queries)} queries"')
+        self.assertGreater(float(timing['render']['dur']), 0)
+        self.assertGreaterEqual(float(timing['total']['dur']), float(timing['db']['dur']))
+
+    async def test_async_views_are_measured(self):
+        response = await self.async_client.get(reverse('async-balance-list'))
+        self.assertEqual(self._server_timing(response)['db']['desc'], '"1 queries"')
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse('balance-list'))
+        self.client.get(reverse('balance-list'))
+        self.client.get('/no-such-page/')
+
+        response = self.client.get(reverse('metrics'))
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('http_requests_total{view="balance-list",method="GET",status="200"} 2.0', body)
+        self.assertIn('http_requests_total{view="unmatched",method="GET",status="404"} 1.0', body)
+        self.assertIn('http_request_duration_seconds_count{view="balance-list",method="GET"} 2', body)
+        self.assertIn('http_request_duration_seconds_bucket{view="balance-list",method="GET",le="+Inf"} 2', body)
+        self.assertIn('http_request_db_queries_total{view="balance-list",method="GET"}', body)
+
+    @override_settings(REQUEST_METRICS={'ENABLED': False})
+    def test_disabled_by_default(self):
+        self.assertNotIn('Server-Timing', self.client.get(reverse('balance-list')))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class SummaryCacheTestCase(ExpenseAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.balance1 = Balance.objects.create(user=self.user1, balance_cents=0)
+        self.balance2 = Balance.objects.create(user=self.user2, balance_cents=0)
+        summary_cache.get_cache().clear()
+        registry.clear()
+
+    def _lookups(self):
+        counter = registry.metrics.get('user_summary_cache_requests_total')
+        return dict(counter.values) if counter else {}
+
+    def test_overall_expenses_cached_until_a_write_touches_the_user(self):
+        url = reverse('expense-user-overall-expenses', kwargs={'user_id': self.user2.id})
+        self.create_expense(total_amount='30.00')
+        self.assertEqual(self.client.get(url).json()['total_amount_owed'], 15.0)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).json()['total_amount_owed'], 15.0)
+
+        self.create_expense(total_amount='10.00')
+        self.assertEqual(self.client.get(url).json()['total_amount_owed'], 20.0)
+        self.assertEqual(self._lookups(), {('overall', 'miss'): 2, ('overall', 'hit'): 1})
+
+        # an unknown user is not cached, so creating it later is seen at once
+        self.assertEqual(self.client.get(reverse('expense-user-overall-expenses', kwargs={'user_id': 999})).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(reverse('expense-user-overall-expenses', kwargs={'user_id': 'x'})).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_balance_retrieve_cached_until_the_user_or_balance_changes(self):
+        url = reverse('balance-detail', kwargs={'pk': self.balance2.id})
+        self.assertEqual(self.client.get(url).json(), BalanceSerializer(self.balance2).data)
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+        self.create_expense(total_amount='30.00')
+        self.assertEqual(self.client.get(url).json()['balance'], -15.0)
+
+        self.client.patch(reverse('user-detail', kwargs={'pk': self.user2.id}), {'username': 'renamed'}, format='json')
+        self.assertEqual(self.client.get(url).json()['user']['username'], 'renamed')
+
+        # writes to one user leave the other's entry alone
+        self.client.get(reverse('balance-detail', kwargs={'pk': self.balance1.id}))
+        self.client.patch(reverse('user-detail', kwargs={'pk': self.user2.id}), {'username': 'again'}, format='json')
+        with self.assertNumQueries(0):
+            self.client.get(reverse('balance-detail', kwargs={'pk': self.balance1.id}))
+
+        self.assertEqual(self.client.get(reverse('balance-detail', kwargs={'pk': 999})).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_writes_invalidate_again_on_commit(self):
+        url = reverse('expense-user-overall-expenses', kwargs={'user_id': self.user2.id})
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.create_expense(total_amount='30.00')
+        # a reader filling the cache before the commit stores a stale entry
+        summary_cache.cached_summary('overall', self.user2.id, lambda: {'total_amount_owed': 0})
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.client.get(url).json()['total_amount_owed'], 15.0)
+
+    def test_concurrent_misses_compute_once(self):
+        computed = []
+
+        def compute():
+            computed.append(1)
+            time.sleep(0.1)
+            return {'total': 1}
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(summary_cache.cached_summary('overall', 1, compute)))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(computed), 1)
+        self.assertEqual(results, [{'total': 1}] * 4)
+        self.assertEqual(self._lookups(), {('overall', 'miss'): 1, ('overall', 'wait'): 3})
+
+    @override_settings(USER_SUMMARY_CACHE={'ENABLED': False})
+    def test_disabled(self):
+        url = reverse('expense-user-overall-expenses', kwargs={'user_id': self.user2.id})
+        self.client.get(url)
+        with self.assertNumQueries(2):
+            self.client.get(url)
+        self.assertEqual(self._lookups(), {})
+
+
+class SettlementTestCase(TestCase):
+    def _apply(self, balances, transfers):
+        remaining = dict(balances)
+        for debtor_id, creditor_id, cents in transfers:
+            self.assertGreater(cents, 0)
+            remaining[debtor_id] += cents
+            remaining[creditor_id] -= cents
+        return remaining
+
+    def test_solvers_clear_all_balances(self):
+        balances = {1: -600, 2: -900, 3: -600, 4: 900, 5: 1200}
+        for solver in (greedy_transfers, exact_transfers):
+            with self.subTest(solver=solver.__name__):
+                self.assertEqual(set(self._apply(balances, solver(balances)).values()), {0})
+
+    def test_exact_solver_beats_greedy_on_zero_sum_subgroups(self):
+        balances = {1: -600, 2: -900, 3: -600, 4: 900, 5: 1200}
+        self.assertEqual(len(greedy_transfers(balances)), 4)
+        self.assertEqual(len(exact_transfers(balances)), 3)
+
+    def test_settle_endpoint(self):
+        client = APIClient()
+        user1 = User.objects.create(username='user1', email='user1@example.com', mobile_number='1111111111')
+        user2 = User.objects.create(username='user2', email='user2@example.com', mobile_number='2222222222')
+        Balance.objects.create(user=user1, balance_cents=2550)
+        Balance.objects.create(user=user2, balance_cents=-2550)
+
+        for method in ('greedy', 'exact'):
+            response = client.get(reverse('balance-settle'), {'method': method})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['transfers'], [{'from': user2.id, 'to': user1.id, 'amount': '25.50'}])
+
+
+class MoneyTestCase(TestCase):
+    def test_allocate_sums_to_total(self):
+        self.assertEqual(allocate(10000, [1, 1, 1]), [3334, 3333, 3333])
+        self.assertEqual(allocate(1000, [Decimal('33.33'), Decimal('33.33'), Decimal('33.34')]), [333, 333, 334])
+        self.assertEqual(allocate(5, [1, 1, 1, 1]), [2, 1, 1, 1])
+        # weights of mixed precision keep their proportions
+        self.assertEqual(allocate(1, ['33.333', Decimal('33.3330'), 33.334]), [0, 0, 1])
+        self.assertEqual(allocate(-7, [2, 1]), [-5, -2])
+
+    def test_cent_conversion(self):
+        self.assertEqual(to_cents('0.1'), 10)
+        self.assertEqual(to_cents(Decimal('2.345')), 235)
+        self.assertEqual(from_cents(-2550), Decimal('-25.50'))
+        with self.assertRaises(ValueError):
+            to_cents('abc')
+
+    def test_splits_add_up_to_total(self):
+        users = [
+            User.objects.create(username=f'user{i}', email=f'user{i}@example.com', mobile_number=str(i))
+            for i in range(3)
+        ]
+        client = APIClient()
+        data = {
+            'creator': users[0].id,
+            'paid_by': users[0].id,
+            'participants': [user.id for user in users],
+            'total_amount': '0.30',
+            'description': 'Gum',
+            'split_method': 'exact',
+            'splits': [{'user': users[1].id, 'amount_owed': 0.1}, {'user': users[2].id, 'amount_owed': 0.2}],
+        }
+        self.assertEqual(client.post(reverse('expense-list'), data, format='json').status_code, status.HTTP_201_CREATED)
+
+        data.update(total_amount='100.00', split_method='equal', splits=[])
+        self.assertEqual(client.post(reverse('expense-list'), data, format='json').status_code, status.HTTP_201_CREATED)
+
+        self.assertEqual(Balance.objects.get(user=users[0]).balance_cents, 30 + 6666)
+        self.assertEqual(sum(Balance.objects.values_list('balance_cents', flat=True)), 0)
+
+
+class BenchmarkToolsTestCase(TestCase):
+    def test_seed_expenses_keeps_the_books_consistent(self):
+        out = StringIO()
+        call_command('seed_expenses', users=20, groups=4, expenses=60, days=5, batch=25, stdout=out)
+        self.assertIn('Seeded 20 users, 4 groups and 60 expenses', out.getvalue())
+
+        self.assertEqual(Expense.objects.filter(description='seed expense').count(), 60)
+        self.assertEqual(Balance.objects.aggregate(total=Sum('balance_cents'))['total'], 0)
+        self.assertEqual(replay_balances(dry_run=True), {})
+        # expenses are backdated and the rollups follow them
+        self.assertGreater(Expense.objects.dates('created_at', 'day').count(), 1)
+        self.assertEqual(
+            DailyRollup.objects.aggregate(total=Sum('paid_cents'))['total'],
+            to_cents(Expense.objects.aggregate(total=Sum('total_amount'))['total']),
+        )
+
+        # the same seed produces the same data
+        with self.assertRaises(CommandError):
+            call_command('seed_expenses', users=20, groups=4, expenses=60, stdout=StringIO())
+        first = list(Expense.objects.order_by('id').values_list('paid_by__username', 'total_amount', 'split_method'))
+        call_command('seed_expenses', users=20, groups=4, expenses=60, days=5, batch=25, prefix='again', stdout=StringIO())
+        second = list(
+            Expense.objects.filter(paid_by__username__startswith='again-').order_by('id')
+            .values_list('paid_by__username', 'total_amount', 'split_method')
+        )
+        self.assertEqual([(name.replace('seed', 'again'), *rest) for name, *rest in first], second)
+
+    def test_seed_splits_costs_the_same_queries_whatever_the_size(self):
+        def queries(splits):
+            with CaptureQueriesContext(connection) as ctx:
+                seed_splits(10, splits, 3, random.Random(0), prefix=f'seed{splits}')
+            return len(ctx.captured_queries)
+
+        default_group_id()
+        self.assertEqual(queries(30), queries(90))
+        self.assertEqual(ExpenseSplit.objects.count(), 120)
+
+    # the benchmark client talks to localhost, allowed by DEBUG outside tests
+    @override_settings(ALLOWED_HOSTS=['localhost'])
+    def test_bench_request_mix_reports_every_endpoint(self):
+        with tempfile.TemporaryDirectory() as root:
+            mix = os.path.join(root, 'mix.jsonl')
+            with open(mix, 'w') as f:
+                f.write(json.dumps({'name': 'user expenses', 'method': 'GET', 'path': '/expenses/user/{user}/', 'weight': 3}) + "\n")
+                f.write(json.dumps({
+                    'method': 'POST', 'path': '/expenses/',
+                    'body': {
+                        'creator': '{user}', 'paid_by': '{user}', 'participants': ['{user}', '{other}'], 'group': '{group}',
+                        'total_amount': '10.00', 'description': 'bench', 'split_method': 'equal', 'splits': [],
+                    },
+                }) + "\n")
+            output = os.path.join(root, 'report.json')
+            call_command(
+                'bench_request_mix', mix=mix, requests=40, warmup=5, seed_data=True, users=10, groups=3, expenses=20,
+                output=output, stdout=StringIO(),
+            )
+            with open(output) as f:
+                report = json.load(f)
+
+            self.assertEqual(set(report['endpoints']), {'user expenses', '/expenses/'})
+            self.assertEqual(sum(row['count'] for row in report['endpoints'].values()), 40)
+            for row in report['endpoints'].values():
+                self.assertEqual(row['errors'], 0)
+                self.assertLessEqual(row['p50_ms'], row['p99_ms'])
+            # writes and seeded data are rolled back
+            self.assertFalse(Expense.objects.exists())
+
+            err = StringIO()
+            call_command(
+                'bench_request_mix', mix=mix, requests=10, warmup=0, seed_data=True, users=10, groups=3, expenses=20,
+                baseline=output, stdout=StringIO(), stderr=err,
+            )
+            self.assertIn('user expenses', err.getvalue())
+
+
+class RecurringExpenseTestCase(ExpenseAPITestCase):
+    def _create(self, **overrides):
+        payload = {
+            'creator': self.user1.id,
+            'paid_by': self.user1.id,
+            'participants': [self.user1.id, self.user2.id],
+            'total_amount': '1000.00',
+            'description': 'Rent',
+            'split_method': 'equal',
+            'interval': 'month',
+            'starts_at': '2026-01-31T09:00:00Z',
+            **overrides,
+        }
+        return self.client.post(reverse('recurringexpense-list'), payload, format='json')
+
+    def _run(self, until, **options):
+        out = StringIO()
+        call_command('run_recurring_expenses', until=until, stdout=out, **options)
+        return out.getvalue()
+
+    def test_due_occurrences_become_expenses(self):
+        response = self._create()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['next_run_at'], '2026-01-31T09:00:00Z')
+
+        self.assertIn('Created 3 expenses', self._run('2026-04-01T00:00:00+00:00'))
+        occurrences = Expense.objects.filter(recurrence_id=response.data['id']).order_by('occurrence_at')
+        # the day of month is clamped in short months without drifting
+        self.assertEqual([expense.occurrence_at.date() for expense in occurrences], [date(2026, 1, 31), date(2026, 2, 28), date(2026, 3, 31)])
+        self.assertEqual(Balance.objects.get(user=self.user2).balance_cents, -150000)
+        template = RecurringExpense.objects.get()
+        self.assertEqual((template.runs, template.next_run_at.date()), (3, date(2026, 4, 30)))
+
+        # running again creates nothing new
+        self.assertIn('Created 0 expenses', self._run('2026-04-01T00:00:00+00:00'))
+        self.assertEqual(Expense.objects.count(), 3)
+
+    def test_batches_and_ends_at(self):
+        for i in range(5):
+            self._create(interval='week', every=2, starts_at=f'2026-01-0{i + 1}T00:00:00Z', ends_at='2026-02-01T00:00:00Z')
+
+        # every other week up to and including ends_at: three occurrences
+        # each, except for the template whose third one falls after it
+        self.assertIn('Created 14 expenses in 3 batches', self._run('2026-03-01T00:00:00+00:00', batch=2))
+        self.assertFalse(RecurringExpense.objects.filter(active=True).exists())
+        self.assertEqual(Expense.objects.aggregate(total=Sum('total_amount'))['total'], Decimal('14000.00'))
+        self.assertEqual(Balance.objects.aggregate(total=Sum('balance_cents'))['total'], 0)
+
+    def test_interrupted_run_is_safe_to_repeat(self):
+        for i in range(4):
+            self._create(description=f'Subscription {i}')
+
+        calls = []
+
+        def fail_second_batch(entries):
+            calls.append(len(entries))
+            if len(calls) == 2:
+                raise RuntimeError("scheduler killed")
+            return record_expenses(entries)
+
+        with mock.patch('expenses.recurring.record_expenses', fail_second_batch):
+            with self.assertRaises(RuntimeError):
+                self._run('2026-03-01T00:00:00+00:00', batch=2)
+        # the first batch is kept, the failed one left no trace
+        self.assertEqual(Expense.objects.count(), 4)
+
+        self.assertIn('Created 4 expenses', self._run('2026-03-01T00:00:00+00:00', batch=2))
+        self.assertEqual(Expense.objects.count(), 8)
+        self.assertEqual(
+            Expense.objects.values('recurrence_id', 'occurrence_at').distinct().count(), 8,
+        )
+        self.assertEqual(Balance.objects.get(user=self.user2).balance_cents, -400000)
+
+    def test_integrity_errors_are_retried_once(self):
+        self._create()
+        calls = []
+
+        def failing(times):
+            def record(entries):
+                calls.append(len(entries))
+                if len(calls) <= times:
+                    raise IntegrityError("UNIQUE constraint failed")
+                return record_expenses(entries)
+            return record
+
+        # a race with another scheduler clears up on the retry
+        with mock.patch('expenses.recurring.record_expenses', failing(1)):
+            self.assertIn('Created 2 expenses', self._run('2026-03-01T00:00:00+00:00'))
+
+        # an error that comes back on the same batch is raised, not retried forever
+        calls.clear()
+        with mock.patch('expenses.recurring.record_expenses', failing(100)):
+            with self.assertRaises(IntegrityError):
+                self._run('2026-05-01T00:00:00+00:00')
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(Expense.objects.count(), 2)
+
+    def test_invalid_templates(self):
+        self.assertEqual(self._create(split_method='exact', splits=[{'user': self.user2.id, 'amount_owed': '10.00'}]).status_code, status.HTTP_400_BAD_REQUEST)
+
+        template_id = self._create().data['id']
+        url = reverse('recurringexpense-detail', kwargs={'pk': template_id})
+        self.assertEqual(self.client.patch(url, {'interval': 'week'}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.patch(url, {'total_amount': '1200.00'}, format='json').status_code, status.HTTP_200_OK)
+
+        # a split definition that stopped adding up deactivates the template
+        RecurringExpense.objects.update(split_method='exact', splits=[{'user': self.user2.id, 'amount_owed': '1.00'}])
+        self.assertIn('Created 0 expenses', self._run('2026-02-15T00:00:00+00:00'))
+        template = RecurringExpense.objects.get()
+        self.assertFalse(template.active)
+        self.assertIn('does not equal the total', template.last_error)
+
+
+class ImportExpensesTestCase(ExpenseAPITestCase):
+    user_count = 3
+
+    def setUp(self):
+        super().setUp()
+        self.group = Group.objects.create(name='Trip')
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+
+    def _write(self, name, content):
+        path = os.path.join(self.root.name, name)
+        with open(path, 'w') as file:
+            file.write(content)
+        return path
+
+    def _csv(self):
+        return self._write('history.csv', (
+            "created_at,description,total_amount,split_method,paid_by,participants,splits,group\n"
+            "2024-01-15T12:00:00Z,Dinner,90.00,equal,user1@example.com,user1@example.com;user2@example.com;user3@example.com,,\n"
+            "2024-01-16T08:00:00Z,Taxi,10.00,exact,user2@example.com,user2@example.com;user3@example.com,"
+            f"user2@example.com:4.00;user3@example.com:6.00,{self.group.id}\n"
+            "2024-01-16T09:00:00Z,Lunch,12.00,equal,nobody@example.com,user1@example.com,,\n"
+            "2024-01-16T10:00:00,\"Hotel, two nights\",200.00,percentage,user3@example.com,user1@example.com;user3@example.com,"
+            "user1@example.com:25;user3@example.com:75,\n"
+        ))
+
+    def _balances(self):
+        return dict(Balance.objects.values_list('user_id', 'balance_cents'))
+
+    def test_short_and_undecodable_rows_are_rejected(self):
+        path = self._write('broken.csv', "")
+        with open(path, 'wb') as file:
+            file.write(
+                b"created_at,description,total_amount,split_method,paid_by,participants\n"
+                b"2024-01-15T12:00:00Z,Dinner,90.00\n"
+                b"2024-01-15T13:00:00Z,Caf\xe9,10.00,equal,user1@example.com,user1@example.com;user2@example.com\n"
+                b"2024-01-15T14:00:00Z,Taxi,10.00,equal,user1@example.com,user1@example.com;user2@example.com\n"
+            )
+        err = StringIO()
+        out = StringIO()
+        call_command('import_expenses', path, stdout=out, stderr=err)
+        self.assertIn('Imported 1 expenses', out.getvalue())
+        self.assertIn('line 2: paid_by is required.', err.getvalue())
+        self.assertIn('line 3: The row is not valid UTF-8.', err.getvalue())
+        self.assertEqual(ImportCheckpoint.objects.get().rejected, 2)
+
+    def test_csv_import_keeps_the_books_consistent(self):
+        out = StringIO()
+        err = StringIO()
+        call_command('import_expenses', self._csv(), chunk_size=2, stdout=out, stderr=err)
+        self.assertIn('Imported 3 expenses', out.getvalue())
+        self.assertIn("line 4: Unknown user 'nobody@example.com'.", err.getvalue())
+
+        self.assertEqual(self._balances(), {self.user1.id: 1000, self.user2.id: -2400, self.user3.id: 1400})
+        hotel = Expense.objects.get(description='Hotel, two nights')
+        self.assertEqual(hotel.created_at, timezone.make_aware(datetime(2024, 1, 16, 10)))
+        self.assertEqual(hotel.group_id, default_group_id())
+        self.assertEqual(set(hotel.participants.values_list('id', flat=True)), {self.user1.id, self.user3.id})
+        self.assertEqual(list(hotel.splits.values_list('user_id', 'amount_owed')), [(self.user1.id, Decimal('50.00'))])
+        self.assertTrue(self.group.members.filter(id=self.user3.id).exists())
+        self.assertEqual(GroupBalance.objects.get(group=self.group, user=self.user2).balance_cents, 600)
+
+        # every derived table matches a rebuild from the imported expenses
+        self.assertEqual(replay_balances(dry_run=True), {})
+        debts = list(PairwiseDebt.objects.order_by('user_a', 'user_b').values_list('user_a', 'user_b', 'amount_cents'))
+        call_command('rebuild_debts', stdout=StringIO())
+        self.assertEqual(list(PairwiseDebt.objects.order_by('user_a', 'user_b').values_list('user_a', 'user_b', 'amount_cents')), debts)
+        rollups = list(DailyRollup.objects.order_by('user', 'day').values())
+        call_command('backfill_rollups', stdout=StringIO())
+        self.assertEqual(
+            [dict(row, id=None) for row in DailyRollup.objects.order_by('user', 'day').values()],
+            [dict(row, id=None) for row in rollups],
+        )
+        self.assertEqual(DailyRollup.objects.get(user=self.user1, day=date(2024, 1, 15)).paid_cents, 9000)
+
+        # running it again resumes at the end of the file
+        call_command('import_expenses', self._csv(), stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(Expense.objects.count(), 3)
+        checkpoint = ImportCheckpoint.objects.get()
+        self.assertEqual((checkpoint.line, checkpoint.imported, checkpoint.rejected), (5, 3, 1))
+
+    def test_import_never_reuses_a_deleted_expense_id(self):
+        expense = self.create_expense(total_amount='30.00')
+        deleted_id = expense.id
+        delete_expense(expense)
+        entries = LedgerEntry.objects.filter(expense_id=deleted_id).count()
+        call_command('import_expenses', self._csv(), stdout=StringIO(), stderr=StringIO())
+
+        self.assertGreater(Expense.objects.order_by('id').first().id, deleted_id)
+        # the deleted expense's ledger entries are not picked up by an import
+        self.assertEqual(LedgerEntry.objects.filter(expense_id=deleted_id).count(), entries)
+        self.assertEqual(replay_balances(dry_run=True), {})
+
+    def test_interrupted_import_resumes_after_the_last_chunk(self):
+        path = self._csv()
+        write_chunk = importing.write_chunk
+        calls = []
+
+        def failing_second_chunk(rows):
+            calls.append(rows)
+            if len(calls) == 2:
+                raise IntegrityError("disk full")
+            write_chunk(rows)
+
+        with mock.patch('expenses.importing.write_chunk', failing_second_chunk), self.assertRaises(IntegrityError):
+            call_command('import_expenses', path, chunk_size=1, stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(list(Expense.objects.values_list('description', flat=True)), ['Dinner'])
+        self.assertEqual(ImportCheckpoint.objects.get().line, 2)
+
+        out = StringIO()
+        call_command('import_expenses', path, chunk_size=1, stdout=out, stderr=StringIO())
+        self.assertIn('Resuming after line 2', out.getvalue())
+        self.assertEqual(Expense.objects.count(), 3)
+        self.assertEqual(self._balances(), {self.user1.id: 1000, self.user2.id: -2400, self.user3.id: 1400})
+
+    def test_ndjson_import_by_username(self):
+        lines = [
+            {'created_at': '2024-02-01', 'description': 'Rent', 'total_amount': '100.00', 'split_method': 'percentage',
+             'paid_by': 'user1', 'participants': ['user1', 'user2'], 'group': self.group.id,
+             'splits': [{'user': 'user1', 'percentage': 40}, {'user': 'user2', 'percentage': 60}]},
+            {'created_at': '2024-02-02', 'description': 'Bad', 'total_amount': '10.00', 'split_method': 'exact',
+             'paid_by': 'user1', 'participants': ['user1', 'user2'], 'splits': [{'user': 'user2', 'amount_owed': '3.00'}]},
+        ]
+        path = self._write('history.ndjson', "\n".join(map(json.dumps, lines)) + "\n\nnot json\n")
+        rejects = os.path.join(self.root.name, 'rejects.ndjson')
+        call_command('import_expenses', path, user_key='username', rejects=rejects, stdout=StringIO(), stderr=StringIO())
+
+        self.assertEqual(self._balances(), {self.user1.id: 6000, self.user2.id: -6000})
+        with open(rejects) as file:
+            self.assertEqual([json.loads(line)['line'] for line in file], [2, 4])
+
+        with self.assertRaisesMessage(CommandError, 'line 2: The sum of exact amounts does not equal the total amount.'):
+            call_command('import_expenses', path, user_key='username', restart=True, strict=True, stdout=StringIO())
+
+
+class ReportJobTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(username='testuser', email='test@example.com', mobile_number='1234567890')
+        Balance.objects.create(user=self.user, balance_cents=1234)
+        self.client.force_authenticate(user=self.user)
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+
+    def test_job_lifecycle(self):
+        response = self.client.post(reverse('report-list'), {'kind': 'balances'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], 'pending')
+        job_url = reverse('report-detail', kwargs={'pk': response.data['id']})
+        download_url = reverse('report-download', kwargs={'pk': response.data['id']})
+        self.assertEqual(self.client.get(download_url).status_code, status.HTTP_409_CONFLICT)
+
+        with self.settings(REPORT_JOBS_ROOT=self.root.name):
+            call_command('run_report_worker', processes=0, once=True, stdout=StringIO())
+
+        self.assertEqual(self.client.get(job_url).data['status'], 'done')
+        response = self.client.get(download_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+    def test_expense_job_requires_expense(self):
+        response = self.client.post(reverse('report-list'), {'kind': 'expense'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_stale_running_jobs_are_requeued(self):
+        job = ReportJob.objects.create(kind='balances', status='running', started_at=timezone.now() - timedelta(hours=1))
+        with self.settings(REPORT_JOBS_ROOT=self.root.name):
+            call_command('run_report_worker', processes=0, once=True, stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+
+    def test_jobs_with_a_recent_heartbeat_are_not_requeued(self):
+        # another worker is still rendering a job it claimed long ago
+        job = ReportJob.objects.create(
+            kind='balances', status='running',
+            started_at=timezone.now() - timedelta(hours=1), heartbeat_at=timezone.now(),
+        )
+        with self.settings(REPORT_JOBS_ROOT=self.root.name):
+            call_command('run_report_worker', processes=0, once=True, stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'running')
+
+    def test_prune_removes_old_jobs_and_files(self):
+        with self.settings(REPORT_JOBS_ROOT=self.root.name):
+            old = ReportJob.objects.create(kind='balances')
+            recent = ReportJob.objects.create(kind='balances')
+            for job in (old, recent):
+                call_command('run_report_worker', processes=0, once=True, stdout=StringIO())
+            old.refresh_from_db()
+            recent.refresh_from_db()
+            ReportJob.objects.filter(id=old.id).update(finished_at=timezone.now() - timedelta(days=8))
+            stray = os.path.join(self.root.name, 'job_99.pdf.tmp')
+            open(stray, 'w').close()
+            week_ago = time.time() - 8 * 86400
+            os.utime(stray, (week_ago, week_ago))
+
+            self.assertEqual(prune_jobs(timedelta(days=7)), 1)
+
+        self.assertFalse(ReportJob.objects.filter(id=old.id).exists())
+        self.assertFalse(os.path.exists(old.file_path))
+        self.assertFalse(os.path.exists(stray))
+        self.assertTrue(os.path.exists(recent.file_path))
+
+
+class ReportWorkerTestCase(TransactionTestCase):
+    # the worker closes the database connections before starting its pool
+    def test_worker_crash_fails_the_job(self):
+        class BrokenPool:
+            def __init__(self, *args, **kwargs):
+                pass
+
+            def submit(self, fn, job_id):
+                future = Future()
+                future.set_exception(BrokenProcessPool("A process in the process pool was terminated abruptly"))
+                return future
+
+            def shutdown(self, wait=True, cancel_futures=False):
+                pass
+
+        jobs = [ReportJob.objects.create(kind='balances') for _ in range(3)]
+        out = StringIO()
+        with mock.patch('expenses.management.commands.run_report_worker.ProcessPoolExecutor', BrokenPool):
+            call_command('run_report_worker', processes=2, once=True, stdout=out)
+
+        for job in jobs:
+            job.refresh_from_db()
+            self.assertEqual(job.status, 'failed')
+            self.assertIn('BrokenProcessPool', job.error)
+        self.assertEqual(out.getvalue().count(': failed'), 3)
+
+
+@tag('slow')
+class ConcurrentWriteTestCase(TransactionTestCase):
+    def test_concurrent_creates_conserve_balances(self):
+        # thousands of creates from four processes contending for five balance rows
+        out = StringIO()
+        call_command('stress_balances', processes=4, expenses=2000, users=5, stdout=out)
+        self.assertIn('Balances are consistent', out.getvalue())
+        self.assertFalse(User.objects.exists())
+
+    def test_simultaneous_edits_apply_once(self):
+        users = [
+            User.objects.create(username=f'user{i}', email=f'user{i}@example.com', mobile_number=str(i))
+            for i in range(3)
+        ]
+        client = APIClient()
+        response = client.post(reverse('expense-list'), {
+            'creator': users[0].id, 'paid_by': users[0].id, 'participants': [user.id for user in users],
+            'total_amount': '30.00', 'description': 'Dinner', 'split_method': 'equal',
+        }, format='json')
+        url = reverse('expense-detail', kwargs={'pk': response.data['id']})
+
+        # both requests have loaded the expense before either one writes
+        barrier = threading.Barrier(2)
+        update = ExpenseSerializer.update
+
+        def racing_update(serializer, instance, validated_data):
+            barrier.wait(timeout=10)
+            return update(serializer, instance, validated_data)
+
+        statuses = []
+
+        def edit(total_amount):
+            try:
+                statuses.append(APIClient().patch(url, {'total_amount': total_amount}, format='json').status_code)
+            finally:
+                connection.close()
+
+        with mock.patch.object(ExpenseSerializer, 'update', racing_update):
+            threads = [threading.Thread(target=edit, args=(amount,)) for amount in ('60.00', '90.00')]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(sorted(statuses), [status.HTTP_200_OK, status.HTTP_409_CONFLICT])
+        total = Expense.objects.get().total_amount
+        self.assertIn(total, (Decimal('60.00'), Decimal('90.00')))
+        # the balances hold exactly one of the edits
+        share = int(total * 100) // 3
+        balances = [Balance.objects.get(user=user).balance_cents for user in users]
+        self.assertEqual(balances, [2 * share, -share, -share])
+        self.assertEqual(replay_balances(dry_run=True), {})
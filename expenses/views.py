@@ -1,25 +1,63 @@
 from django.shortcuts import render
-from rest_framework import viewsets, status
+from django.http import FileResponse
+from rest_framework import mixins, viewsets, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from django.http import HttpResponse
-from .models import User, Expense, ExpenseSplit, Balance
-from .serializers import UserSerializer, ExpenseSerializer, BalanceSerializer
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.fields import DateTimeField
+from rest_framework.parsers import JSONParser
+from .models import User, Group, GroupBalance, DailyRollup, Expense, ExpenseSplit, Balance, LedgerState, PairwiseDebt, RecurringExpense, ReportJob
+from .serializers import (
+    UserSerializer, GroupSerializer, GroupBalanceSerializer, ExpenseSerializer, BalanceSerializer, PairwiseDebtSerializer,
+    RecurringExpenseSerializer, ReportJobSerializer,
+)
+from .exports import export_response
+from .idempotency import idempotent
+from .pagination import KeysetPagination
+from .parsers import NDJSONParser
+from .report_cache import cached_pdf_response
+from .report_jobs import job_filename
+from .reports import render_balance_sheet, render_expense_sheet
+from .ledger import ROLLUP_FIELDS, delete_expense, record_expenses
+from .money import from_cents
+from .settlement import exact_transfers, greedy_transfers
+from .summary_cache import balance_owner, cached_summary, forget_balance_owner, summaries_changed
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 from django.contrib.auth.views import LoginView
 from django.urls import reverse_lazy
 from django.contrib.auth import login
-from django.db.models import Sum
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from io import BytesIO
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+from django.utils import timezone
+from collections import defaultdict
+from datetime import date, timedelta
 
 
 # User view
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
+
+    # usernames appear in the cached reports, which are keyed by the users version
+    @transaction.atomic
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        LedgerState.bump_users()
+        summaries_changed([serializer.instance.id])
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        user_id = instance.id
+        super().perform_destroy(instance)
+        LedgerState.bump_users()
+        summaries_changed([user_id])
+
+    def list(self, request, *args, **kwargs):
+        # plain rows in UserSerializer's shape, no model instances
+        users = self.filter_queryset(self.get_queryset()).order_by('id').values(*UserSerializer.Meta.fields)
+        return Response(list(users))
     
     @action(detail=True, methods=['get'])
     def details(self, request, pk=None):
@@ -30,58 +68,285 @@ class UserViewSet(viewsets.ModelViewSet):
         except User.DoesNotExist:
             return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
 
+# Group View
+class GroupViewSet(viewsets.ModelViewSet):
+    queryset = Group.objects.prefetch_related('members')
+    serializer_class = GroupSerializer
+
+    def perform_destroy(self, instance):
+        if instance.is_default or instance.expenses.exists():
+            raise ValidationError("Groups that hold expenses cannot be deleted.")
+        instance.delete()
+
+    @action(detail=True, methods=['get'])
+    def balances(self, request, pk=None):
+        """
+        Balances of the group's members within this group only.
+        """
+        group = self.get_object()
+        balances = GroupBalance.objects.filter(group=group).order_by('user_id')
+        return Response(GroupBalanceSerializer(balances, many=True).data)
+
+ANALYTICS_PERIODS = {'week': TruncWeek, 'month': TruncMonth}
+
+USER_EXPENSE_FIELDS = ('id', 'amount_owed', 'expense_id', 'created_at', 'expense__description')
+
+
+def user_overall_data(user_id):
+    """
+    Response of the user overall expenses endpoint, or None for an unknown user.
+    """
+    user = User.objects.filter(id=user_id).values('id', 'username').first()
+    if user is None:
+        return None
+
+    amount_owed = ExpenseSplit.objects.filter(user_id=user_id).aggregate(total=Sum('amount_owed'))['total'] or 0
+    return {
+        'user_id': user['id'],
+        'username': user['username'],
+        # 'total_expenses': total_amount,
+        'total_amount_owed': amount_owed,
+    }
+
+
+def user_expenses_paginator():
+    # split_user_created_idx serves every page as a range scan
+    return KeysetPagination(time_field='created_at', id_field='id')
+
+
+def user_expense_data(split):
+    """
+    Response item of the user expenses listing from a ``USER_EXPENSE_FIELDS`` row.
+    """
+    return {
+        "amount_owed": split['amount_owed'],
+        "expense_id": split['expense_id'],
+        "date_of_expense_creation": split['created_at'],
+        "expense_description": split['expense__description']
+    }
+
+EXPENSE_LIST_FIELDS = (
+    'id', 'creator_id', 'paid_by_id', 'group_id', 'total_amount', 'description', 'split_method', 'created_at',
+)
+
+
+def expense_list_data(expenses):
+    """
+    ``ExpenseSerializer`` output for every expense of the ``expenses``
+    queryset, read in three queries (expenses, participants, splits)
+    however many expenses there are.
+    """
+    ids = expenses.values('id')
+    participants = defaultdict(list)
+    Participant = Expense.participants.through
+    for expense_id, user_id in Participant.objects.filter(expense_id__in=ids).order_by('id').values_list('expense_id', 'user_id'):
+        participants[expense_id].append(user_id)
+    splits = defaultdict(list)
+    for expense_id, user_id, amount_owed in ExpenseSplit.objects.filter(expense_id__in=ids).order_by('id').values_list('expense_id', 'user_id', 'amount_owed'):
+        splits[expense_id].append({'user': user_id, 'amount_owed': str(amount_owed)})
+
+    timestamp = DateTimeField()
+    return [
+        {
+            'id': expense_id,
+            'creator': creator_id,
+            'paid_by': paid_by_id,
+            'participants': participants[expense_id],
+            'group': group_id,
+            'total_amount': str(total_amount),
+            'description': description,
+            'split_method': split_method,
+            'created_at': timestamp.to_representation(created_at),
+            'splits': splits[expense_id],
+        }
+        for expense_id, creator_id, paid_by_id, group_id, total_amount, description, split_method, created_at
+        in expenses.order_by('id').values_list(*EXPENSE_LIST_FIELDS)
+    ]
+
+
 # Expense View
 class ExpenseViewSet(viewsets.ModelViewSet):
     queryset = Expense.objects.all()
     serializer_class = ExpenseSerializer
 
+    def list(self, request, *args, **kwargs):
+        return Response(expense_list_data(self.filter_queryset(self.get_queryset())))
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        # reverses the expense's balances before deleting it
+        delete_expense(instance)
+
+    @action(detail=False, methods=['post'], url_path='bulk', parser_classes=[JSONParser, NDJSONParser])
+    @idempotent
+    def bulk_create(self, request):
+        """
+        Create many expenses in one request from a JSON array or an NDJSON body.
+
+        Every payload is validated on its own, the valid ones are written
+        together and the response reports the outcome of each item in order.
+        """
+        payloads = request.data
+        if not isinstance(payloads, list):
+            return Response({"error": "Expected a list of expenses."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # fetch every referenced user and group once for the whole batch
+        user_ids = set()
+        group_ids = set()
+        for payload in payloads:
+            if isinstance(payload, dict):
+                try:
+                    group_ids.add(int(payload['group']))
+                except (KeyError, TypeError, ValueError):
+                    pass
+                participants = payload.get('participants')
+                candidates = [payload.get('creator'), payload.get('paid_by')]
+                candidates += participants if isinstance(participants, list) else []
+                for pk in candidates:
+                    try:
+                        user_ids.add(int(pk))
+                    except (TypeError, ValueError):
+                        pass
+        context = self.get_serializer_context()
+        context['users'] = User.objects.in_bulk(user_ids)
+        context['groups'] = Group.objects.in_bulk(group_ids)
+
+        results = []
+        entries = []
+        for index, payload in enumerate(payloads):
+            serializer = self.get_serializer(data=payload, context=context)
+            try:
+                serializer.is_valid(raise_exception=True)
+                entries.append((index, serializer.build_entry(serializer.validated_data)))
+            except ValidationError as exc:
+                results.append({"index": index, "status": status.HTTP_400_BAD_REQUEST, "errors": exc.detail})
+
+        with transaction.atomic():
+            expenses = record_expenses([entry for _, entry in entries])
+
+        results += [
+            {"index": index, "status": status.HTTP_201_CREATED, "id": expense.id}
+            for (index, _), expense in zip(entries, expenses)
+        ]
+        results.sort(key=lambda result: result["index"])
+
+        if not entries and payloads:
+            response_status = status.HTTP_400_BAD_REQUEST
+        elif len(entries) < len(payloads):
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_201_CREATED
+        return Response({"created": len(entries), "failed": len(payloads) - len(entries), "results": results}, status=response_status)
+
     @action(detail=False, methods=['get'], url_path='user/(?P<user_id>[^/.]+)')
     def user_expenses(self, request, user_id=None):
         """
-        Retrieve all expenses from ExpenseSplit where the specified user is involved.
+        Retrieve all expenses from ExpenseSplit where the specified user is involved,
+        newest first and paginated with ``?cursor=`` / ``?page_size=``.
         """
         try:
             user = User.objects.get(id=user_id)
         except User.DoesNotExist:
             return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        splits = ExpenseSplit.objects.filter(user=user)
+        # one joined query for the needed columns only
+        splits = ExpenseSplit.objects.filter(user=user).values(*USER_EXPENSE_FIELDS)
+        paginator = user_expenses_paginator()
+        page = paginator.paginate_queryset(splits, request, view=self)
 
-        response_data = [
-            {
-                "amount_owed": split.amount_owed,
-                "expense_id": split.expense.id,
-                "date_of_expense_creation": split.expense.created_at,
-                "expense_description": split.expense.description
-            }
-            for split in splits
-        ]
+        response_data = [user_expense_data(split) for split in page]
 
-        return Response(response_data, status=status.HTTP_200_OK)
+        return paginator.get_paginated_response(response_data)
     
     @action(detail=False, methods=['get'], url_path='user/(?P<user_id>[^/.]+)/overall')
     def user_overall_expenses(self, request, user_id=None):
         """
-        Retrieve overall expenses for a specific user.
+        Retrieve overall expenses for a specific user, from the per-user
+        summary cache.
+        """
+        try:
+            user_id = int(user_id)
+        except ValueError:
+            user_id = None
+        response_data = None
+        if user_id is not None:
+            response_data = cached_summary('overall', user_id, lambda: user_overall_data(user_id))
+        if response_data is None:
+            return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response(response_data, status=status.HTTP_200_OK)
+    
+    
+    @action(detail=False, methods=['get'], url_path='user/(?P<user_id>[^/.]+)/analytics')
+    def user_analytics(self, request, user_id=None):
+        """
+        Weekly or monthly spend of a user, read from the daily rollups only,
+        so a year costs at most 366 rows whatever the size of the history.
+        ``?period=week|month`` (default month), ``?start=`` and ``?end=`` as
+        YYYY-MM-DD, defaulting to the year up to today.
         """
         try:
             user = User.objects.get(id=user_id)
         except User.DoesNotExist:
             return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        expense_splits = ExpenseSplit.objects.filter(user=user)
-        amount_owed = expense_splits.aggregate(total=Sum('amount_owed'))['total'] or 0
+        period = request.query_params.get('period', 'month')
+        if period not in ANALYTICS_PERIODS:
+            return Response({"error": "period must be 'week' or 'month'"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            end = date.fromisoformat(request.query_params['end']) if 'end' in request.query_params else timezone.localdate()
+            start = date.fromisoformat(request.query_params['start']) if 'start' in request.query_params else end - timedelta(days=365)
+        except ValueError:
+            return Response({"error": "start and end must be dates in YYYY-MM-DD format"}, status=status.HTTP_400_BAD_REQUEST)
+
+        rows = (
+            DailyRollup.objects.filter(user=user, day__range=(start, end))
+            .annotate(period=ANALYTICS_PERIODS[period]('day'))
+            .values('period')
+            .annotate(**{field: Sum(field) for field in ROLLUP_FIELDS})
+            .order_by('period')
+        )
 
         response_data = {
             'user_id': user.id,
-            'username': user.username,
-            # 'total_expenses': total_amount,
-            'total_amount_owed': amount_owed,
+            'period': period,
+            'start': start,
+            'end': end,
+            'results': [
+                {
+                    'period_start': row['period'],
+                    'paid': str(from_cents(row['paid_cents'])),
+                    'owed': str(from_cents(row['owed_cents'])),
+                    'owed_by_split_method': {
+                        method: str(from_cents(row[f'{method}_owed_cents'])) for method, _ in Expense.SPLIT_METHODS
+                    },
+                }
+                for row in rows
+            ],
         }
-
         return Response(response_data, status=status.HTTP_200_OK)
-    
-    
+
+    @action(detail=False, methods=['get'], url_path=r'export/(?P<file_format>csv|ndjson)')
+    def export(self, request, file_format=None):
+        """
+        Stream every expense as CSV or NDJSON. ``?start=`` and ``?end=``
+        (YYYY-MM-DD) bound the creation date, ``?user=`` keeps the expenses
+        a user paid or takes part in.
+        """
+        return export_response('expenses', file_format, request.query_params)
+
+    @action(detail=False, methods=['get'], url_path=r'splits/export/(?P<file_format>csv|ndjson)')
+    def export_splits(self, request, file_format=None):
+        """
+        Stream the split rows, filtered like ``export`` by their expense's
+        creation date and by the user who owes.
+        """
+        return export_response('splits', file_format, request.query_params)
+
     @action(detail=True, methods=['get'])
     def balance_sheet(self, request, pk=None):
         """
@@ -92,85 +357,163 @@ class ExpenseViewSet(viewsets.ModelViewSet):
         except Expense.DoesNotExist:
             return Response({"error": "Expense not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        buffer = BytesIO()
-        p = canvas.Canvas(buffer, pagesize=letter)
-
-        # Header information
-        p.setFont("Helvetica-Bold", 14)
-        p.drawString(100, 750, f"Balance Sheet for Expense ID: {expense.id}")
-        p.setFont("Helvetica", 12)
-        p.drawString(100, 730, f"Description: {expense.description}")
-        p.drawString(100, 710, f"Total Amount: ${expense.total_amount}")
-        p.drawString(100, 690, f"Created by: {expense.creator.username}")
-        p.drawString(100, 670, f"Paid by: {expense.paid_by.username}")
-        p.drawString(100, 650, f"Split Method: {expense.get_split_method_display()}")
-        p.drawString(100, 630, f"Date: {expense.created_at.strftime('%Y-%m-%d %H:%M:%S')}")
-
-        # Participants and their splits
-        y = 590
-        p.setFont("Helvetica-Bold", 12)
-        p.drawString(100, y, "Participants and their splits:")
-        y -= 20
-        p.setFont("Helvetica", 12)
-
-        # Include the payer in the list
-        p.drawString(120, y, f"{expense.paid_by.username} (Paid: ${expense.total_amount})")
-        y -= 20
-
-        total_owed = 0
-        for split in expense.splits.all():
-            if split.user != expense.paid_by:
-                p.drawString(120, y, f"{split.user.username}: Owes ${split.amount_owed}")
-                total_owed += split.amount_owed
-                y -= 20
-
-        # Calculate and display how much the payer should receive
-        amount_to_receive = expense.total_amount - total_owed
-        y -= 20
-        p.setFont("Helvetica-Bold", 12)
-        p.drawString(120, y, f"{expense.paid_by.username} should receive: ${amount_to_receive:.2f}")
-
-        p.showPage()
-        p.save()
-
-        buffer.seek(0)
-        response = HttpResponse(buffer, content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="expense_{expense.id}_balance_sheet.pdf"'
-
-        return response
+        return cached_pdf_response(
+            request, f"expense-{expense.id}-v{expense.version}-u{LedgerState.current_versions()[1]}",
+            f"expense_{expense.id}_balance_sheet.pdf", render_expense_sheet, expense,
+        )
 
     
+BALANCE_LIST_FIELDS = ('user_id', 'user__email', 'user__username', 'user__mobile_number', 'balance_cents')
+
+
+def balance_data(row):
+    """
+    ``BalanceSerializer`` output from a ``BALANCE_LIST_FIELDS`` row.
+    """
+    user_id, email, username, mobile_number, balance_cents = row
+    return {
+        'user': {'id': user_id, 'email': email, 'username': username, 'mobile_number': mobile_number},
+        'balance': from_cents(balance_cents),
+    }
+
 # Balance View
 class BalanceView(viewsets.ReadOnlyModelViewSet):
     """
     Generate downloadable balance sheet for all the users combined.
     """
-    queryset = Balance.objects.all()
+    queryset = Balance.objects.select_related('user')
     serializer_class = BalanceSerializer
 
+    def list(self, request, *args, **kwargs):
+        # one joined query into plain rows instead of a nested serializer per balance
+        balances = self.filter_queryset(self.get_queryset()).order_by('id').values_list(*BALANCE_LIST_FIELDS)
+        return Response([balance_data(row) for row in balances])
+
+    def retrieve(self, request, *args, **kwargs):
+        # served from the cached summary of the balance's user
+        try:
+            balance_id = int(kwargs['pk'])
+        except ValueError:
+            raise NotFound()
+        data = self._cached_balance(balance_id)
+        if data is None:
+            # the owner may be outdated if the id was reused after a user was deleted
+            forget_balance_owner(balance_id)
+            data = self._cached_balance(balance_id)
+        if data is None:
+            raise NotFound()
+        return Response(data)
+
+    def _cached_balance(self, balance_id):
+        user_id = balance_owner(balance_id)
+        if user_id is None:
+            return None
+
+        def compute():
+            row = Balance.objects.filter(id=balance_id, user_id=user_id).values_list(*BALANCE_LIST_FIELDS).first()
+            return balance_data(row) if row is not None else None
+
+        return cached_summary('balance', user_id, compute)
+
+    @action(detail=False, methods=['get'])
+    def debts(self, request):
+        """
+        Who owes whom, read from the materialized pairwise debt table.
+        Pass ``?user=<id>`` to only list the debts involving one user.
+        """
+        debts = PairwiseDebt.objects.exclude(amount_cents=0).order_by('user_a_id', 'user_b_id')
+
+        user_id = request.query_params.get('user')
+        if user_id is not None:
+            try:
+                user_id = int(user_id)
+            except ValueError:
+                return Response({"error": "Invalid user id"}, status=status.HTTP_400_BAD_REQUEST)
+            debts = debts.filter(Q(user_a_id=user_id) | Q(user_b_id=user_id))
+
+        return Response(PairwiseDebtSerializer(debts, many=True).data, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'])
+    def settle(self, request):
+        """
+        Minimal or near-minimal list of transfers that clears every balance.
+        ``?method=greedy`` (default) scales to large groups, ``?method=exact``
+        is optimal but limited to small groups.
+        """
+        method = request.query_params.get('method', 'greedy')
+        if method not in ('greedy', 'exact'):
+            return Response({"error": "method must be 'greedy' or 'exact'"}, status=status.HTTP_400_BAD_REQUEST)
+
+        balances = dict(Balance.objects.values_list('user_id', 'balance_cents'))
+
+        if method == 'exact':
+            try:
+                transfers = exact_transfers(balances)
+            except ValueError as exc:
+                return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            transfers = greedy_transfers(balances)
+
+        response_data = {
+            'method': method,
+            'transfers': [
+                {'from': debtor_id, 'to': creditor_id, 'amount': str(from_cents(cents))}
+                for debtor_id, creditor_id, cents in transfers
+            ],
+        }
+        return Response(response_data, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'], url_path=r'export/(?P<file_format>csv|ndjson)')
+    def export(self, request, file_format=None):
+        """
+        Stream every balance as CSV or NDJSON, or one user's with ``?user=``.
+        """
+        return export_response('balances', file_format, request.query_params)
+
     @action(detail=False, methods=['get'])
     def download(self, request):
-        buffer = BytesIO()
-        p = canvas.Canvas(buffer, pagesize=letter)
-        
-        p.setFont("Helvetica", 12)
-        p.drawString(100, 750, "Balance Sheet")
-        
-        y = 700
-        for balance in Balance.objects.all().select_related('user'):
-            line = f"{balance.user.username}: ${balance.balance}"
-            p.drawString(100, y, line)
-            y -= 20
-        
-        p.showPage()
-        p.save()
-        
-        buffer.seek(0)
-        response = HttpResponse(buffer, content_type='application/pdf')
-        response['Content-Disposition'] = 'attachment; filename="balance_sheet.pdf"'
-        
+        version, users_version = LedgerState.current_versions()
+        return cached_pdf_response(
+            request, f"balances-v{version}-u{users_version}",
+            "balance_sheet.pdf", render_balance_sheet,
+        )
+
+
+# Recurring Expense View
+class RecurringExpenseViewSet(viewsets.ModelViewSet):
+    """
+    Templates of expenses that repeat on a schedule. Their occurrences are
+    created by the ``run_recurring_expenses`` command.
+    """
+    queryset = RecurringExpense.objects.prefetch_related('participants').order_by('id')
+    serializer_class = RecurringExpenseSerializer
+
+
+# Report Job View
+class ReportJobViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    Queue balance sheet renders for the ``run_report_worker`` command, poll
+    their status and download the finished PDF.
+    """
+    queryset = ReportJob.objects.order_by('-created_at')
+    serializer_class = ReportJobSerializer
+
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        response.status_code = status.HTTP_202_ACCEPTED
         return response
 
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if job.status != 'done':
+            return Response({"error": f"Report is {job.status}", "status": job.status}, status=status.HTTP_409_CONFLICT)
+        try:
+            report = open(job.file_path, 'rb')
+        except FileNotFoundError:
+            return Response({"error": "Report file is missing"}, status=status.HTTP_410_GONE)
+        return FileResponse(report, as_attachment=True, filename=job_filename(job), content_type='application/pdf')
+
 
 # Custom Login View - Thought about it but did not use it. Future Scope.
 class CustomLoginView(LoginView):
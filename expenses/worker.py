@@ -0,0 +1,43 @@
+"""
+Entry points for worker processes.
+
+Spawned pool processes unpickle these functions before Django is set up,
+so this module must not import models at import time.
+"""
+import os
+
+
+def init_worker_process(database_name=None):
+    """
+    Process pool initializer: set Django up in a freshly spawned worker,
+    optionally pointing it at another database file than the settings do
+    (the parent's test database, for instance).
+    """
+    import django
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'expenses_project.settings')
+    django.setup()
+    if database_name is not None:
+        from django.db import connections
+        connections['default'].settings_dict['NAME'] = database_name
+
+
+def render_job(job_id):
+    from .report_jobs import run_job
+    return run_job(job_id)
+
+
+def create_expenses(payloads):
+    """
+    Create each payload through ``ExpenseSerializer`` in its own
+    transaction, the way concurrent API requests would, and return how
+    many were created.
+    """
+    from django.db import connections
+    from .serializers import ExpenseSerializer
+
+    for payload in payloads:
+        serializer = ExpenseSerializer(data=payload)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+    connections.close_all()
+    return len(payloads)
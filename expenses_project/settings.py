@@ -42,6 +42,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so its timings cover everything below; inactive unless
+    # REQUEST_METRICS['ENABLED'] is set
+    'expenses.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -79,6 +82,21 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # WAL lets readers run alongside the single writer; writers wait
+            # up to `timeout` seconds for the lock instead of failing, and
+            # take it when their transaction begins (IMMEDIATE) so a read
+            # lock is never upgraded mid-transaction, which SQLite cannot
+            # wait on
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL',
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        'TEST': {
+            # a file rather than the default in-memory database, so that the
+            # multi-process stress test can reach it
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -119,6 +137,63 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Responses are encoded with orjson when it is installed (expenses/renderers.py);
+# put 'rest_framework.renderers.JSONRenderer' first to use the stock encoder
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'expenses.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Rendered PDF reports, cached by content version (see expenses/report_cache.py)
+
+REPORT_CACHE = {
+    'BACKEND': 'locmem',  # or 'file' to share the cache between processes
+    'LOCATION': BASE_DIR / 'report_cache',
+    'MAX_BYTES': 64 * 1024 * 1024,
+    'MAX_ITEM_BYTES': 16 * 1024 * 1024,
+}
+
+# Where the run_report_worker command writes rendered report jobs
+REPORT_JOBS_ROOT = BASE_DIR / 'reports'
+
+# Responses of requests sent with an Idempotency-Key header are replayed to
+# retries for TTL seconds; the most recent keys are also kept in memory
+IDEMPOTENCY_KEYS = {
+    'TTL': 24 * 60 * 60,
+    'LRU_SIZE': 10000,
+}
+
+# Each process has its own LocMemCache, so a write only invalidates the
+# cached summaries of the process that handled it; the others serve theirs
+# for up to USER_SUMMARY_CACHE['TIMEOUT'] seconds. Point 'default' at Redis
+# or memcached to invalidate across processes.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'expenses',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
+USER_SUMMARY_CACHE = {
+    'ENABLED': True,
+    'CACHE': 'default',
+    'TIMEOUT': 30,  # staleness bound with a per-process cache
+    'LOCK_TIMEOUT': 10,
+    'WAIT': 1.0,
+}
+
+# Per-request query count, DB time, render time and latency, sent in a
+# Server-Timing header and exposed per view at /metrics (Prometheus format)
+
+REQUEST_METRICS = {
+    'ENABLED': False,
+    'SERVER_TIMING': True,
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -18,17 +18,27 @@ from django.contrib import admin
 from django.urls import path
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from expenses.views import UserViewSet, ExpenseViewSet, BalanceView, CustomLoginView
+from expenses import async_views
+from expenses.metrics import metrics_view
+from expenses.views import UserViewSet, GroupViewSet, ExpenseViewSet, RecurringExpenseViewSet, BalanceView, ReportJobViewSet, CustomLoginView
 
 router = DefaultRouter()
 router.register(r'users', UserViewSet)
+router.register(r'groups', GroupViewSet)
 router.register(r'expenses', ExpenseViewSet)
+router.register(r'recurring-expenses', RecurringExpenseViewSet)
 router.register(r'balances', BalanceView, basename='balance')
+router.register(r'reports', ReportJobViewSet, basename='report')
 # router.register(r'login', CustomLoginView, basename='login')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include(router.urls)),
     path('login/', CustomLoginView.as_view(), name='login'),
+    path('metrics', metrics_view, name='metrics'),
+    # async read path, for ASGI deployments
+    path('async/expenses/user/<int:user_id>/', async_views.user_expenses, name='async-user-expenses'),
+    path('async/expenses/user/<int:user_id>/overall/', async_views.user_overall_expenses, name='async-user-overall-expenses'),
+    path('async/balances/', async_views.balance_list, name='async-balance-list'),
 ]
 